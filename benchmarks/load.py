@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+离线吞吐与延迟基准测试
+
+启动本地模拟的OpenAI兼容服务（stub_openai.py），把 API_URL 指向它，再通过stdio
+启动两个MCP服务，在不同并发数下调用文档生成服务和提示词生成服务的
+generate_document 工具。输出每组测试的 p50/p95/p99 延迟、吞吐，以及按阶段拆分的
+服务自身开销：
+
+- before_upstream：从发出工具调用到上游收到请求（参数校验、模板、排队、限流）
+- upstream：上游从收到请求到返回完成（模拟的模型耗时）
+- after_upstream：从上游完成到工具调用返回（解析、写文件、MCP响应）
+
+结果缓存默认关闭，每个调用的描述都不同，不会被缓存或合并请求掩盖。
+
+    python benchmarks/load.py --concurrency 1,4,16 --requests 32 --latency 0.3 --token-rate 300
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mcp_client import StdioClient
+from stub_openai import StubServer, add_config_arguments, config_from_args
+
+TOOLS = {
+    "doc-gen": "generate_document",
+    "prompt-gen": "generate_document"
+}
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+def _arguments(server: str, bench_id: str, project_path: str, template_type: str) -> dict:
+    description = f"Benchmark request bench-id:{bench_id} for an order management service"
+    if server == "doc-gen":
+        return {
+            "title": f"Benchmark {bench_id}",
+            "template_type": template_type,
+            "description": description,
+            "file_name": f"bench_{bench_id}.md",
+            "project_path": project_path,
+            "use_cache": False
+        }
+    return {
+        "purpose": description,
+        "rules": "Be concise",
+        "language": "en",
+        "project_path": project_path,
+        "file_name": f"bench_{bench_id}.md",
+        "use_cache": False
+    }
+
+async def run_level(client: StdioClient, stub: StubServer, server: str, concurrency: int, requests: int, project_path: str, template_type: str, timeout: float) -> dict:
+    """Send requests tool calls with at most concurrency in flight
+
+    Returns:
+        dict: Latency percentiles, throughput, stage breakdown and stub counters
+    """
+    stub.stats.reset()
+    slots = asyncio.Semaphore(concurrency)
+    calls = {}
+
+    async def call(n: int) -> None:
+        bench_id = f"{server.replace('-', '')}{concurrency}x{n}"
+        async with slots:
+            sent = time.perf_counter()
+            try:
+                result = await client.call_tool(TOOLS[server], _arguments(server, bench_id, project_path, template_type), timeout)
+                success = bool(result.get("success"))
+            except Exception:
+                success = False
+            calls[bench_id] = (sent, time.perf_counter(), success)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(call(n) for n in range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [done - sent for sent, done, success in calls.values() if success]
+    stages = {"before_upstream": [], "upstream": [], "time_to_first_byte": [], "after_upstream": []}
+    with stub.stats.lock:
+        timings = {key: list(value) for key, value in stub.stats.timings.items()}
+    for bench_id, (sent, done, success) in calls.items():
+        upstream = timings.get(bench_id)
+        if not success or not upstream:
+            continue
+        # 一个工具调用可能对应多个上游请求（重试、续写、按章节生成）
+        arrived = min(t[0] for t in upstream)
+        first_byte = min(t[1] for t in upstream)
+        finished = max(t[2] for t in upstream)
+        stages["before_upstream"].append(arrived - sent)
+        stages["upstream"].append(finished - arrived)
+        stages["time_to_first_byte"].append(first_byte - arrived)
+        stages["after_upstream"].append(done - finished)
+
+    return {
+        "server": server,
+        "concurrency": concurrency,
+        "requests": requests,
+        "succeeded": len(latencies),
+        "failed": requests - len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else None,
+        "latency_ms": {
+            "p50": _ms(percentile(latencies, 50)),
+            "p95": _ms(percentile(latencies, 95)),
+            "p99": _ms(percentile(latencies, 99)),
+            "mean": _ms(statistics.mean(latencies)) if latencies else None
+        },
+        "stages_ms": {
+            name: {"p50": _ms(percentile(values, 50)), "p95": _ms(percentile(values, 95))}
+            for name, values in stages.items()
+        },
+        "upstream": stub.stats.snapshot()
+    }
+
+async def run(args) -> list:
+    stub = StubServer(config_from_args(args)).start()
+    results = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="mcp-bench-") as workdir:
+            env = {
+                "API_URL": stub.url,
+                "API_KEY": "benchmark",
+                "API_ENDPOINTS": "",
+                "RESPONSE_CACHE_ENABLED": "1" if args.cache else "0",
+                "RESPONSE_CACHE_DIR": os.path.join(workdir, "cache"),
+                "JOB_STATE_DIR": os.path.join(workdir, "jobs")
+            }
+            if args.max_generations:
+                env["MAX_CONCURRENT_GENERATIONS"] = str(args.max_generations)
+            for server in args.server or sorted(TOOLS):
+                project_path = os.path.join(workdir, server)
+                os.makedirs(project_path, exist_ok=True)
+                client = StdioClient(server, env)
+                await client.start()
+                try:
+                    await client.initialize(args.timeout)
+                    for concurrency in args.concurrency:
+                        result = await run_level(client, stub, server, concurrency, args.requests, project_path, args.template_type, args.timeout)
+                        results.append(result)
+                        print(json.dumps(result, ensure_ascii=False), flush=True)
+                finally:
+                    await client.close()
+    finally:
+        stub.stop()
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline throughput and latency benchmark of the MCP tools")
+    parser.add_argument("--server", choices=sorted(TOOLS), action="append", help="Server to benchmark (default all)")
+    parser.add_argument("--concurrency", type=lambda v: [int(c) for c in v.split(",")], default=[1, 4, 16], help="Comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=32, help="Tool calls per concurrency level")
+    parser.add_argument("--template-type", default="requirement_doc", help="Template used for document generation")
+    parser.add_argument("--max-generations", type=int, default=0, help="MAX_CONCURRENT_GENERATIONS for the doc server (default server setting)")
+    parser.add_argument("--cache", action="store_true", help="Keep the result cache enabled")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait for each tool call")
+    parser.add_argument("--output", help="Also write all results to this JSON file")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""基准测试用的最小MCP stdio客户端
+
+像编辑器一样通过stdio启动服务进程，支持同时发出多个请求（按JSON-RPC的id匹配响应）。
+"""
+
+import os
+import sys
+import json
+import asyncio
+import itertools
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVERS = {
+    "doc-gen": os.path.join(ROOT, "doc-gen-server"),
+    "prompt-gen": os.path.join(ROOT, "prompt_gen_server")
+}
+PROTOCOL_VERSION = "2025-03-26"
+# 单行响应的最大长度，生成的提示词内容会直接包含在响应中
+READ_LIMIT = 16 * 1024 * 1024
+
+class MCPError(Exception):
+    """Raised when the server answers a request with a JSON-RPC error"""
+
+class StdioClient:
+    """MCP client talking to a server process over stdin/stdout"""
+
+    def __init__(self, name: str, env: dict = None):
+        """
+        Args:
+            name: Server name, a key of SERVERS
+            env: Extra environment variables for the server process
+        """
+        self.name = name
+        self.env = {**os.environ, "MCP_TRANSPORT": "stdio", **(env or {})}
+        self.proc = None
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._reader = None
+
+    async def start(self) -> None:
+        """Launch the server process"""
+        self.proc = await asyncio.create_subprocess_exec(
+            sys.executable, "server.py",
+            cwd=SERVERS[self.name],
+            env=self.env,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            limit=READ_LIMIT
+        )
+        self._reader = asyncio.ensure_future(self._read())
+
+    async def _read(self) -> None:
+        while True:
+            line = await self.proc.stdout.readline()
+            if not line:
+                break
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            future = self._pending.pop(message.get("id"), None)
+            if future and not future.done():
+                future.set_result(message)
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError(f"{self.name} server closed stdout"))
+        self._pending.clear()
+
+    async def _send(self, message: dict) -> None:
+        self.proc.stdin.write((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+        await self.proc.stdin.drain()
+
+    async def request(self, method: str, params: dict, timeout: float = None) -> dict:
+        """Send a request and wait for its result
+
+        Args:
+            method: JSON-RPC method
+            params: Request parameters
+            timeout: Seconds to wait for the response (optional)
+
+        Returns:
+            dict: The result of the response
+        """
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        await self._send({"jsonrpc": "2.0", "id": request_id, "method": method, "params": params})
+        response = await asyncio.wait_for(future, timeout)
+        if "error" in response:
+            raise MCPError(response["error"].get("message", str(response["error"])))
+        return response["result"]
+
+    async def notify(self, method: str, params: dict = None) -> None:
+        message = {"jsonrpc": "2.0", "method": method}
+        if params is not None:
+            message["params"] = params
+        await self._send(message)
+
+    async def initialize(self, timeout: float = None) -> dict:
+        """Run the MCP handshake"""
+        result = await self.request("initialize", {
+            "protocolVersion": PROTOCOL_VERSION,
+            "capabilities": {},
+            "clientInfo": {"name": "benchmark", "version": "1.0"}
+        }, timeout)
+        await self.notify("notifications/initialized")
+        return result
+
+    async def list_tools(self, timeout: float = None) -> list:
+        return (await self.request("tools/list", {}, timeout)).get("tools", [])
+
+    async def call_tool(self, name: str, arguments: dict, timeout: float = None) -> dict:
+        """Call a tool and decode the JSON text it returns
+
+        Returns:
+            dict: The tool's JSON response, {"success": False, ...} if the call failed
+        """
+        result = await self.request("tools/call", {"name": name, "arguments": arguments}, timeout)
+        for item in result.get("content", []):
+            if item.get("type") == "text":
+                try:
+                    return json.loads(item["text"])
+                except ValueError:
+                    return {"success": not result.get("isError"), "error": item["text"]}
+        return {"success": not result.get("isError"), "error": None}
+
+    async def close(self) -> None:
+        """Stop the server process"""
+        if self.proc and self.proc.returncode is None:
+            self.proc.kill()
+        if self.proc:
+            await self.proc.wait()
+        if self._reader:
+            await asyncio.gather(self._reader, return_exceptions=True)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+MCP服务冷启动基准测试
+
+像编辑器一样通过stdio启动 doc-gen-server 和 prompt_gen_server，测量从进程启动到
+initialize 和 tools/list 返回的时间，并检查加载服务模块时没有导入OpenAI SDK、
+tiktoken 等只在生成时才需要的依赖。超过预算或导入了这些依赖时以非零状态退出，
+可在CI中防止启动变慢。
+
+    python benchmarks/startup.py --runs 5 --budget-ms 200
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mcp_client import StdioClient, SERVERS
+
+# 不应在启动时导入的模块
+HEAVY_MODULES = ("openai", "requests", "tiktoken")
+
+async def measure(name: str, timeout: float) -> dict:
+    """Start one server over stdio and time the MCP handshake
+
+    Args:
+        name: Server name, a key of SERVERS
+        timeout: Seconds to wait for each response
+
+    Returns:
+        dict: initialize and tools/list latency in milliseconds, and the number of tools
+    """
+    client = StdioClient(name)
+    started = time.perf_counter()
+    await client.start()
+    try:
+        await client.initialize(timeout)
+        initialized = time.perf_counter()
+        tools = await client.list_tools(timeout)
+        listed = time.perf_counter()
+    finally:
+        await client.close()
+    return {
+        "initialize_ms": (initialized - started) * 1000,
+        "list_tools_ms": (listed - started) * 1000,
+        "tools": len(tools)
+    }
+
+def imported_modules(name: str) -> set:
+    """Heavy modules a server has imported once its module is loaded, before any tool call"""
+    code = (
+        "import sys\n"
+        "sys.path.insert(0, '.')\n"
+        "import server\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=SERVERS[name],
+        stdin=subprocess.DEVNULL,
+        capture_output=True,
+        text=True,
+        check=True
+    ).stdout.strip()
+    return set(filter(None, output.split(",")))
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure MCP server cold start over stdio")
+    parser.add_argument("--runs", type=int, default=5, help="Number of cold starts per server")
+    parser.add_argument("--budget-ms", type=float, default=200, help="Maximum median time until tools/list answers")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for each response")
+    parser.add_argument("--server", choices=sorted(SERVERS), action="append", help="Server to measure (default all)")
+    args = parser.parse_args()
+
+    failed = False
+    for name in args.server or sorted(SERVERS):
+        runs = [asyncio.run(measure(name, args.timeout)) for _ in range(args.runs)]
+        initialize = statistics.median(r["initialize_ms"] for r in runs)
+        list_tools = statistics.median(r["list_tools_ms"] for r in runs)
+        heavy = imported_modules(name)
+        over_budget = list_tools > args.budget_ms
+        failed = failed or over_budget or bool(heavy)
+        print(json.dumps({
+            "server": name,
+            "runs": args.runs,
+            "tools": runs[-1]["tools"],
+            "initialize_ms": round(initialize, 1),
+            "list_tools_ms": round(list_tools, 1),
+            "budget_ms": args.budget_ms,
+            "over_budget": over_budget,
+            "imported_at_startup": sorted(heavy)
+        }, ensure_ascii=False))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+本地模拟的OpenAI兼容chat completions服务
+
+用于在没有网络和API额度的机器上测量服务的吞吐和延迟，只依赖标准库。支持：
+- 首token延迟和流式输出速度（token/秒），非流式请求按相同速度等待后一次返回
+- 按比例注入500错误和带 Retry-After 的429
+- 请求内容包含 "JSON" 时返回 {"title", "content"} 格式的JSON，供提示词生成服务解析；
+  批量请求（包含 "prompts" 数组格式）按请求中的 [序号] 返回每个条目
+- 记录每个请求的到达、首字节和完成时间，用于计算服务自身在各阶段的开销
+- 模拟服务商的提示词前缀缓存：与之前的请求相同的前缀（至少1024 token，按128 token取整）
+  在 usage.prompt_tokens_details.cached_tokens 中报告
+
+    python benchmarks/stub_openai.py --port 9000 --latency 0.3 --token-rate 200
+"""
+
+import re
+import json
+import time
+import hashlib
+import random
+import argparse
+import threading
+from dataclasses import dataclass, field
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 基准测试请求在描述中携带的标记，用于把上游请求对应到发出它的工具调用
+BENCH_ID_PATTERN = re.compile(r"bench-id:(\w+)")
+BATCH_INDEX_PATTERN = re.compile(r"^\s*\[(\d+)\]", re.MULTILINE)
+FILLER = "The module exposes a small, well defined interface and keeps its state private. "
+# 模拟的前缀缓存按4个字符一个token计算，最短1024 token，按128 token取整
+PREFIX_BLOCK_CHARS = 128 * 4
+PREFIX_MIN_CHARS = 1024 * 4
+
+@dataclass
+class StubConfig:
+    """Behaviour of the stub server"""
+
+    latency: float = 0.2
+    token_rate: float = 200.0
+    output_tokens: int = 200
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    retry_after: float = 1.0
+
+@dataclass
+class StubStats:
+    """Counters and per-request timings recorded by the stub server"""
+
+    requests: int = 0
+    completed: int = 0
+    errors: int = 0
+    throttled: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    # 之前请求的前缀哈希，用于模拟前缀缓存
+    prefixes: set = field(default_factory=set)
+    # bench-id -> [(arrived, first_byte, finished), ...]
+    timings: dict = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "completed": self.completed,
+                "errors": self.errors,
+                "throttled": self.throttled,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens
+            }
+
+    def reset(self) -> None:
+        with self.lock:
+            self.requests = self.completed = self.errors = self.throttled = 0
+            self.prompt_tokens = self.cached_tokens = 0
+            self.timings.clear()
+
+def _text(tokens: int, json_mode: bool, batch_indexes: list = None) -> str:
+    words = (FILLER * (tokens // len(FILLER.split()) + 1)).split()[:tokens]
+    body = " ".join(words)
+    if batch_indexes:
+        size = max(1, len(words) // len(batch_indexes))
+        return json.dumps({"prompts": [
+            {"index": index, "title": f"Benchmark Prompt {index}", "content": " ".join(words[i * size:(i + 1) * size])}
+            for i, index in enumerate(batch_indexes)
+        ]}, ensure_ascii=False)
+    if json_mode:
+        return json.dumps({"title": "Benchmark Prompt", "content": body}, ensure_ascii=False)
+    return f"## Overview\n\n{body}\n"
+
+def _cached_chars(prompt: str, prefixes: set) -> int:
+    """Length of the prompt prefix already seen in an earlier request, in whole blocks (called with the stats lock held)"""
+    digest = hashlib.sha1()
+    cached = 0
+    for start in range(0, len(prompt) - PREFIX_BLOCK_CHARS + 1, PREFIX_BLOCK_CHARS):
+        digest.update(prompt[start:start + PREFIX_BLOCK_CHARS].encode("utf-8"))
+        key = digest.digest()
+        if key in prefixes:
+            cached = start + PREFIX_BLOCK_CHARS
+        else:
+            prefixes.add(key)
+    return cached if cached >= PREFIX_MIN_CHARS else 0
+
+def _chunks(text: str, tokens: int) -> list:
+    """Split text into roughly one chunk per token"""
+    size = max(1, len(text) // max(1, tokens))
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+def make_handler(config: StubConfig, stats: StubStats):
+    """Request handler class bound to a config and stats object"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _json(self, status: int, payload: dict, headers: dict = None) -> None:
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            arrived = time.perf_counter()
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+            with stats.lock:
+                stats.requests += 1
+            roll = random.random()
+            if roll < config.throttle_rate:
+                with stats.lock:
+                    stats.throttled += 1
+                self._json(429, {"error": {"message": "Rate limit exceeded", "type": "rate_limit"}}, {"Retry-After": str(config.retry_after)})
+                return
+            if roll < config.throttle_rate + config.error_rate:
+                with stats.lock:
+                    stats.errors += 1
+                self._json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+                return
+
+            prompt = "\n".join(str(m.get("content") or "") for m in body.get("messages", []))
+            prompt_tokens = len(prompt) // 4
+            tokens = min(config.output_tokens, int(body.get("max_tokens") or config.output_tokens))
+            batch_indexes = [int(index) for index in BATCH_INDEX_PATTERN.findall(prompt)] if '"prompts"' in prompt else None
+            text = _text(tokens, "JSON" in prompt, batch_indexes)
+            match = BENCH_ID_PATTERN.search(prompt)
+            model = body.get("model", "stub")
+            with stats.lock:
+                cached = _cached_chars(prompt, stats.prefixes) // 4
+                stats.prompt_tokens += prompt_tokens
+                stats.cached_tokens += cached
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": tokens,
+                "total_tokens": prompt_tokens + tokens,
+                "prompt_tokens_details": {"cached_tokens": cached}
+            }
+
+            time.sleep(config.latency)
+            first_byte = time.perf_counter()
+            if body.get("stream"):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                delay = 1.0 / config.token_rate if config.token_rate > 0 else 0
+                for piece in _chunks(text, tokens):
+                    chunk = {
+                        "id": "chatcmpl-stub",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    if delay:
+                        time.sleep(delay)
+                final = {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+                }
+                self.wfile.write(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    # 与OpenAI相同，用量放在一个没有choices的额外数据块中
+                    usage_chunk = {**final, "choices": [], "usage": usage}
+                    self.wfile.write(f"data: {json.dumps(usage_chunk)}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            else:
+                if config.token_rate > 0:
+                    time.sleep(tokens / config.token_rate)
+                self._json(200, {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                    "usage": usage
+                })
+            finished = time.perf_counter()
+            with stats.lock:
+                stats.completed += 1
+                if match:
+                    stats.timings.setdefault(match.group(1), []).append((arrived, first_byte, finished))
+
+    return Handler
+
+class StubServer:
+    """OpenAI-compatible stub server running in a background thread"""
+
+    def __init__(self, config: StubConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or StubConfig()
+        self.stats = StubStats()
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(self.config, self.stats))
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def add_config_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the stub behaviour options to a command line parser"""
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="Output tokens per second, 0 for instant")
+    parser.add_argument("--output-tokens", type=int, default=200, help="Tokens per completion (capped by max_tokens)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429")
+
+def config_from_args(args) -> StubConfig:
+    return StubConfig(
+        latency=args.latency,
+        token_rate=args.token_rate,
+        output_tokens=args.output_tokens,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after
+    )
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible chat completions stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    server = StubServer(config_from_args(args), args.host, args.port)
+    print(f"Stub OpenAI server listening on {server.url}, set API_URL to this address")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,15 @@
 提供与AI服务交互和文档生成的功能
 """
 
-from .gpt_service import generate_document
+from .gpt_service import agenerate_document, agenerate_sections
+from mcp_common.settings import LLMSettings
+from mcp_common.response_cache import ResponseCache
 
 __version__ = "0.1.0"
 
 __all__ = [
-    "generate_document"
+    "agenerate_document",
+    "agenerate_sections",
+    "LLMSettings",
+    "ResponseCache"
 ]
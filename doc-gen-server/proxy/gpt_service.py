@@ -1,53 +1,117 @@
 """GPT服务模块"""
 
 import os
-import requests
+import time
+import asyncio
 import logging
-import json
-from openai import OpenAI
+from contextlib import asynccontextmanager
 
-# 配置
-API_KEY = os.environ.get("API_KEY", "")
-MODEL = os.environ.get("MODEL", "gpt-4")
-API_URL = os.environ.get("API_URL", "https://api.openai.com/v1")
+from mcp_common.client_pool import get_async_client
+from mcp_common.rate_limit import estimate_request_tokens
+from mcp_common.tokens import estimate_tokens, TokenCounter
+from mcp_common.endpoints import acall_with_failover, astream_with_failover, HEDGE_DELAY
+from mcp_common.settings import LLMSettings
+from mcp_common.response_cache import ResponseCache, make_cache_key
+from .sections import split_sections, build_outline, join_sections
+from mcp_common.metrics import metrics, span, set_labels, record_usage, record_cancelled
+from mcp_common.budget import fit_messages, check_budget, charge
+
+# 同时进行的文档生成数量上限
+MAX_CONCURRENT_GENERATIONS = int(os.environ.get("MAX_CONCURRENT_GENERATIONS", "4"))
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
-def generate_document(title: str, template_content: str, description: str, additional_info: str = "", language: str = "en") -> str:
-    """Generate document content
+# 生成参数
+TEMPERATURE = 0.7
+MAX_TOKENS = 4000
+# 文档因长度被截断时自动续写，所有请求合计的输出token上限
+MAX_TOTAL_TOKENS = int(os.environ.get("MAX_TOTAL_TOKENS", "16000"))
+# 续写请求中携带的已生成内容末尾长度（字符）
+CONTINUATION_TAIL_CHARS = 3000
+# 检测续写内容与已有内容重复衔接的窗口长度（字符）
+SEAM_WINDOW = 500
+SEAM_MIN_OVERLAP = 10
+
+# 输入超出 MAX_INPUT_TOKENS 时依次压缩、截断的用户输入
+SHRINK_ORDER = ("additional_info", "upstream_context", "description")
+
+CONTINUATION_PROMPT = "The document above was cut off because of the output length limit. Continue writing exactly where it stopped. Do not repeat any text that was already written, do not restart the section, and do not add any preface."
+
+async def _gather_all(aws) -> list:
+    """Run awaitables concurrently like asyncio.gather, cancelling the rest as soon as one fails
+
+    Returns:
+        list: Results in the order of the awaitables
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        # 一个章节失败后其余章节的结果不再使用，取消它们以免继续占用并发名额和token
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+# 限制并发生成数量的信号量
+_generation_slots = asyncio.Semaphore(MAX_CONCURRENT_GENERATIONS)
+
+# 生成结果缓存
+response_cache = ResponseCache.from_env("doc-gen")
+
+@asynccontextmanager
+async def _generation_slot():
+    """Hold one of the MAX_CONCURRENT_GENERATIONS slots, timing the wait as the queue stage"""
+    with span("queue"):
+        await _generation_slots.acquire()
+    try:
+        yield
+    finally:
+        _generation_slots.release()
+
+# System prompt - same for all languages
+SYSTEM_PROMPT = "You are an experienced software architect and technical expert, skilled in system design, requirements analysis, and technical documentation. You emphasize modular design, front-end/back-end separation, and function decoupling, capable of producing professional, specific, and implementable technical solutions and development documents."
+
+def _request_details(title: str, description: str, additional_info: str, upstream_context: str) -> str:
+    """Variable part of a generation prompt, placed after all static content"""
+    related = ""
+    if upstream_context:
+        related = f"""
+        Related documents already written for this project (keep modules, data and interfaces consistent with them):
+        {upstream_context}
+        """
+    return f"""
+        Document Title: {title}
+        User Requirements: {description}
+        
+        Additional Information: {additional_info if additional_info else "None"}
+        {related}"""
+
+def build_messages(title: str, template_content: str, description: str, additional_info: str = "", language: str = "en", upstream_context: str = "") -> list:
+    """Build chat messages for document generation
+    
+    Everything that only depends on the template and language comes first and
+    the request itself last, so the messages of all requests for the same
+    template and language share a byte-identical prefix that providers can
+    serve from their prompt cache.
     
     Args:
         title: Document title
         template_content: Template content
         description: User requirements description
         additional_info: Additional information (optional)
+        language: Document language
+        upstream_context: Summaries of related documents this one must stay consistent with (optional)
         
     Returns:
-        str: Generated document content
+        list: Chat completion messages
     """
-    if not API_KEY:
-        logger.warning("API_KEY environment variable is not set")
-    
-    try:
-        # 创建OpenAI客户端，使用环境变量中的配置
-        client = OpenAI(
-            api_key=API_KEY,
-            base_url=API_URL
-        )
-        
-        logger.info(f"Using model: {MODEL}, API base URL: {API_URL}")
-
-        # Construct prompt with language instruction
-        prompt = f"""
-        Based on the user's requirements, please generate a professional product development document in {language} language:
-        
-        Document Title: {title}
-        User Requirements: {description}
-        
-        Additional Information: {additional_info if additional_info else "None"}
+    # 固定部分在前，标题、需求等可变部分在最后
+    prompt = f"""
+        Please generate a professional product development document in {language} language based on the user's requirements given at the end.
         
-        Please generate the document according to the template format below, and ensure the document content follows these principles:
+        Generate the document according to the template format below, and ensure the document content follows these principles:
         1. Strictly follow the layered structure of requirement documents, keeping clear separation between functional modules
         2. Ensure front-end and back-end separation, clearly distinguish front-end and back-end functions
         3. Database design should consider field definitions, table relationships, and index design
@@ -64,28 +128,390 @@ def generate_document(title: str, template_content: str, description: str, addit
         5. Separate functions according to user needs, ensuring good separation between functions
         6. When planning development, prioritize core functionality before considering peripheral features
         7. IMPORTANT: The entire document MUST be in {language} language
-        """
+        
+        The user's requirements:
+        {_request_details(title, description, additional_info, upstream_context)}"""
+
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
 
-        # System prompt - same for all languages
-        system_prompt = "You are an experienced software architect and technical expert, skilled in system design, requirements analysis, and technical documentation. You emphasize modular design, front-end/back-end separation, and function decoupling, capable of producing professional, specific, and implementable technical solutions and development documents."
+def build_section_messages(title: str, section_template: str, outline: str, description: str, additional_info: str = "", language: str = "en", upstream_context: str = "") -> list:
+    """Build chat messages for generating a single section of a document
+    
+    Like build_messages, the outline and section template come before the
+    request so that the same section of every document shares a cacheable prefix.
+    
+    Args:
+        title: Document title
+        section_template: Template text of the section to generate
+        outline: Headings of the whole document, shared by all sections
+        description: User requirements description
+        additional_info: Additional information (optional)
+        language: Document language
+        upstream_context: Summaries of related documents this one must stay consistent with (optional)
+        
+    Returns:
+        list: Chat completion messages
+    """
+    prompt = f"""
+        Please write ONE section of a professional product development document in {language} language based on the user's requirements given at the end.
         
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=4000
-        )
+        Outline of the whole document (the other sections are written separately, do not write them):
+        {outline}
         
-        document_content = response.choices[0].message.content
+        Write only the section below, following its template format:
         
-        # 添加标题
-        document_content = f"# {title}\n\n{document_content}"
+        {section_template}
         
-        return document_content
+        Notes:
+        1. Start with the section heading exactly as given and keep its subsection structure
+        2. Generated content should be professional, specific, and implementable, and consistent with the outline
+        3. If there are diagrams, please use Markdown or Mermaid format
+        4. Do not add a document title, preface, or content belonging to other sections
+        5. IMPORTANT: The entire section MUST be in {language} language
+        
+        The user's requirements:
+        {_request_details(title, description, additional_info, upstream_context)}"""
+
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+def _cache_key(messages: list, settings: LLMSettings) -> str:
+    """Cache key for a rendered request, the API key is deliberately left out"""
+    return make_cache_key(
+        messages=messages,
+        model=settings.model,
+        api_url=settings.api_url,
+        temperature=TEMPERATURE,
+        max_tokens=MAX_TOKENS
+    )
+
+def _continuation_messages(messages: list, content: str) -> list:
+    """Messages asking the model to resume a truncated document from its tail"""
+    tail = content[-CONTINUATION_TAIL_CHARS:]
+    if len(tail) < len(content):
+        tail = "...\n" + tail
+    return messages + [
+        {"role": "assistant", "content": tail},
+        {"role": "user", "content": CONTINUATION_PROMPT}
+    ]
+
+def _strip_overlap(previous: str, continuation: str) -> str:
+    """Drop the start of a continuation that repeats the end of previous text
     
+    Args:
+        previous: Text generated so far
+        continuation: Text returned by the continuation request
+        
+    Returns:
+        str: Continuation without the duplicated seam
+    """
+    window = previous[-SEAM_WINDOW:]
+    for size in range(min(len(window), len(continuation)), SEAM_MIN_OVERLAP - 1, -1):
+        if window.endswith(continuation[:size]):
+            return continuation[size:]
+    # 模型重新输出了被截断的最后一行
+    last_line = window.rsplit("\n", 1)[-1]
+    if len(last_line) >= SEAM_MIN_OVERLAP and continuation.startswith(last_line):
+        return continuation[len(last_line):]
+    return continuation
+
+def _remaining_tokens(used: int) -> int:
+    return min(MAX_TOKENS, MAX_TOTAL_TOKENS - used)
+
+def _output_tokens(usage, estimated: int) -> int:
+    """Output tokens of a call as reported by the provider, the estimate if it reported none"""
+    completion_tokens = getattr(usage, "completion_tokens", None)
+    return completion_tokens if completion_tokens is not None else estimated
+
+async def _complete(settings: LLMSettings, messages: list, prefix: str = "") -> str:
+    """Run a chat completion, continuing while the output is cut off by max_tokens
+    
+    With hedging enabled and fallback endpoints configured the completion is
+    streamed internally, so a slow first token can be hedged.
+    
+    Args:
+        settings: Request-scoped model/endpoint settings
+        messages: Chat completion messages
+        prefix: Content already generated earlier, the completion resumes after it
+        
+    Returns:
+        str: Full stitched completion text, including prefix
+    """
+    if HEDGE_DELAY > 0 and settings.fallbacks:
+        return await _stream_completion(settings, messages, None, prefix)
+    content = prefix
+    used = 0
+    request_messages = _continuation_messages(messages, content) if content else messages
+    while True:
+        max_tokens = _remaining_tokens(used)
+        await asyncio.to_thread(check_budget, estimate_request_tokens(request_messages, 0))
+        issued = False
+        
+        def create(endpoint: LLMSettings):
+            nonlocal issued
+            # 取得限流配额后才会调用，此时请求才真正发出
+            issued = True
+            return get_async_client(endpoint.api_url, endpoint.api_key).chat.completions.create(
+                model=endpoint.model,
+                messages=request_messages,
+                temperature=TEMPERATURE,
+                max_tokens=max_tokens
+            )
+        
+        with span("generation"):
+            try:
+                response, endpoint = await acall_with_failover(settings, estimate_request_tokens(request_messages, max_tokens), create)
+            except asyncio.CancelledError:
+                # 取消会中断进行中的HTTP请求，模型不再继续生成
+                record_cancelled(estimate_request_tokens(request_messages, 0), 0, max_tokens, issued)
+                logger.info("Upstream call cancelled")
+                raise
+        choice = response.choices[0]
+        text = choice.message.content or ""
+        received = _output_tokens(response.usage, estimate_tokens(text))
+        record_usage(response.usage, estimate_request_tokens(request_messages, 0), received)
+        # 按实际返回结果的端点的模型计费
+        await asyncio.to_thread(charge, response.usage, endpoint.model, estimate_request_tokens(request_messages, 0), received)
+        content += _strip_overlap(content, text) if content else text
+        used += received
+        if choice.finish_reason != "length" or _remaining_tokens(used) <= 0:
+            return content
+        logger.info("Output truncated after %s tokens, requesting continuation", used)
+        request_messages = _continuation_messages(messages, content)
+
+async def _stream_completion(settings: LLMSettings, messages: list, on_delta, prefix: str = "") -> str:
+    """Stream a chat completion to on_delta, continuing while the output is cut off
+    
+    The first SEAM_WINDOW characters of every continuation are held back until
+    the duplicated seam has been removed, the rest is passed on as it arrives.
+    
+    Args:
+        settings: Request-scoped model/endpoint settings
+        messages: Chat completion messages
+        on_delta: Async callback on_delta(text, token_count) (optional)
+        prefix: Content already generated earlier, the completion resumes after it
+        
+    Returns:
+        str: Full stitched completion text, including prefix
+    """
+    content = prefix
+    used = 0
+    request_messages = _continuation_messages(messages, content) if content else messages
+    while True:
+        # 续写时先缓存开头部分，去掉与已有内容重复的衔接后再输出
+        pending = "" if content else None
+        finish_reason = None
+        usage = None
+        first_token = None
+        request_used = used
+        output = TokenCounter()
+        endpoint = settings
+        issued = False
+        requested = time.perf_counter()
+        max_tokens = _remaining_tokens(used)
+        await asyncio.to_thread(check_budget, estimate_request_tokens(request_messages, 0))
+        
+        def create(endpoint: LLMSettings):
+            nonlocal issued
+            # 取得限流配额后才会调用，此时请求才真正发出
+            issued = True
+            return get_async_client(endpoint.api_url, endpoint.api_key).chat.completions.create(
+                model=endpoint.model,
+                messages=request_messages,
+                temperature=TEMPERATURE,
+                max_tokens=max_tokens,
+                stream=True,
+                # 最后一个数据块携带本次请求的实际用量
+                stream_options={"include_usage": True}
+            )
+        
+        stream = astream_with_failover(settings, estimate_request_tokens(request_messages, max_tokens), create)
+        try:
+            async for chunk, endpoint in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                finish_reason = choice.finish_reason or finish_reason
+                delta = choice.delta.content
+                if not delta:
+                    continue
+                if first_token is None:
+                    first_token = time.perf_counter()
+                    metrics.observe("first_token", first_token - requested)
+                # 生成过程中按收到的文本估算输出token数，结束后以服务商报告的用量为准
+                used = request_used + output.add(delta)
+                if pending is not None:
+                    pending += delta
+                    if len(pending) < SEAM_WINDOW:
+                        continue
+                    delta = _strip_overlap(content, pending)
+                    pending = None
+                content += delta
+                if on_delta:
+                    await on_delta(delta, used)
+        except asyncio.CancelledError:
+            record_cancelled(estimate_request_tokens(request_messages, 0), output.total, max_tokens, issued)
+            logger.info("Streamed upstream call cancelled after about %s tokens", output.total)
+            raise
+        finally:
+            # 关闭流，中断进行中的HTTP请求
+            await stream.aclose()
+        if pending:
+            delta = _strip_overlap(content, pending)
+            content += delta
+            if on_delta:
+                await on_delta(delta, used)
+        metrics.observe("generation", time.perf_counter() - (first_token or requested))
+        received = _output_tokens(usage, output.total)
+        used = request_used + received
+        record_usage(usage, estimate_request_tokens(request_messages, 0), received)
+        await asyncio.to_thread(charge, usage, endpoint.model, estimate_request_tokens(request_messages, 0), received)
+        if finish_reason != "length" or _remaining_tokens(used) <= 0:
+            return content
+        logger.info("Output truncated after %s tokens, requesting continuation", used)
+        request_messages = _continuation_messages(messages, content)
+
+async def agenerate_document(title: str, template_content: str, description: str, additional_info: str = "", language: str = "en", settings: LLMSettings = None, use_cache: bool = True, upstream_context: str = "", on_delta=None, resume_from: str = "") -> str:
+    """Generate document content without blocking the event loop
+    
+    At most MAX_CONCURRENT_GENERATIONS requests run at the same time, the rest
+    wait for a free slot. When on_delta is given the completion is streamed and
+    on_delta(text, token_count) is awaited for every chunk, starting with the
+    title line; a cached result is delivered as a single chunk. Output cut off
+    by max_tokens is continued automatically up to MAX_TOTAL_TOKENS.
+    
+    Args:
+        title: Document title
+        template_content: Template content
+        description: User requirements description
+        additional_info: Additional information (optional)
+        language: Document language
+        settings: Request-scoped model/endpoint settings (optional, default from environment)
+        use_cache: Whether to reuse a cached response for identical requests
+        upstream_context: Summaries of related documents this one must stay consistent with (optional)
+        on_delta: Async callback receiving streamed chunks (optional, enables streaming)
+        resume_from: Partial document from an interrupted generation to continue (optional)
+        
+    Returns:
+        str: Generated document content
+    """
+    settings = settings or LLMSettings.from_env()
+    if not settings.api_key:
+        logger.warning("API_KEY environment variable is not set")
+    set_labels(model=settings.model)
+    
+    with span("prompt_build"):
+        messages = fit_messages(build_messages, SHRINK_ORDER, title=title, template_content=template_content, description=description, additional_info=additional_info, language=language, upstream_context=upstream_context)
+        cache_key = _cache_key(messages, settings)
+    if use_cache and not resume_from:
+        cached = await asyncio.to_thread(response_cache.get, cache_key)
+        metrics.count("cache_hits" if cached is not None else "cache_misses")
+        if cached is not None:
+            logger.info("Cache hit for document: %s", title)
+            if on_delta:
+                await on_delta(cached, 0)
+            return cached
+    
+    # 续写中断的文档时去掉已有的标题行
+    header = f"# {title}\n\n"
+    prefix = resume_from[len(header):] if resume_from.startswith(header) else resume_from
+    
+    async with _generation_slot():
+        try:
+            logger.info("Using model: %s, API base URL: %s", settings.model, settings.api_url)
+            
+            if on_delta:
+                # 先输出标题和已有内容，再逐块输出生成内容
+                await on_delta(header + prefix, 0)
+                document_content = await _stream_completion(settings, messages, on_delta, prefix)
+            else:
+                document_content = await _complete(settings, messages, prefix)
+            
+            # 添加标题
+            document_content = f"{header}{document_content}"
+        
+        except Exception as e:
+            logger.error("Failed to call GPT service: %s", e)
+            raise Exception(f"Failed to call GPT service: {str(e)}")
+    
+    await asyncio.to_thread(response_cache.set, cache_key, document_content)
+    return document_content
+
+async def _agenerate_section(messages: list, heading: str, settings: LLMSettings, use_cache: bool) -> str:
+    """Generate one section, sharing the cache and concurrency slots with whole documents"""
+    cache_key = _cache_key(messages, settings)
+    if use_cache:
+        cached = await asyncio.to_thread(response_cache.get, cache_key)
+        metrics.count("cache_hits" if cached is not None else "cache_misses")
+        if cached is not None:
+            return cached
+    
+    async with _generation_slot():
+        section_content = (await _complete(settings, messages)).strip()
+    
+    # 确保章节以模板中的标题开头
+    if not section_content.startswith("#"):
+        section_content = f"{heading}\n\n{section_content}"
+    await asyncio.to_thread(response_cache.set, cache_key, section_content)
+    return section_content
+
+async def agenerate_sections(title: str, template_content: str, description: str, additional_info: str = "", language: str = "en", settings: LLMSettings = None, use_cache: bool = True, upstream_context: str = "", on_progress=None) -> str:
+    """Generate a document section by section, with all sections in parallel
+    
+    The template is split at its top-level (##) headings. Every section is
+    generated by its own request that shares the title, description and the
+    outline of the whole document, then the sections are joined in template
+    order, so latency is bounded by the slowest section. Each section request
+    takes one of the MAX_CONCURRENT_GENERATIONS slots.
+    
+    Args:
+        title: Document title
+        template_content: Template content
+        description: User requirements description
+        additional_info: Additional information (optional)
+        language: Document language
+        settings: Request-scoped model/endpoint settings (optional, default from environment)
+        use_cache: Whether to reuse cached responses for identical sections
+        upstream_context: Summaries of related documents this one must stay consistent with (optional)
+        on_progress: Async callback on_progress(done, total) called as sections complete (optional)
+        
+    Returns:
+        str: Generated document content
+    """
+    settings = settings or LLMSettings.from_env()
+    if not settings.api_key:
+        logger.warning("API_KEY environment variable is not set")
+    set_labels(model=settings.model)
+    
+    _, sections = split_sections(template_content)
+    if len(sections) < 2:
+        # 没有可拆分的章节时按整篇生成
+        return await agenerate_document(title, template_content, description, additional_info, language, settings, use_cache, upstream_context)
+    
+    outline = build_outline(sections)
+    logger.info("Generating %s sections in parallel for document: %s", len(sections), title)
+    done = 0
+    
+    async def generate(section) -> str:
+        nonlocal done
+        with span("prompt_build"):
+            messages = fit_messages(build_section_messages, SHRINK_ORDER, title=title, section_template=section.text, outline=outline, description=description, additional_info=additional_info, language=language, upstream_context=upstream_context)
+        section_content = await _agenerate_section(messages, section.heading, settings, use_cache)
+        done += 1
+        if on_progress:
+            await on_progress(done, len(sections))
+        return section_content
+    
+    try:
+        section_contents = await _gather_all(generate(section) for section in sections)
     except Exception as e:
-        logger.error(f"Failed to call GPT service: {str(e)}")
+        logger.error("Failed to call GPT service: %s", e)
         raise Exception(f"Failed to call GPT service: {str(e)}")
+    
+    return join_sections(title, section_contents)
@@ -0,0 +1,213 @@
+"""文档增量更新模块
+
+为每个生成的文档记录按章节计算的输入指纹（保存在项目的 .cursor-copilot/meta 目录中），
+更新文档时只重新生成输入发生变化的章节，其余章节沿用已有内容。
+
+additional_info 按行分配给章节：提到某个章节标题的行只影响该章节，
+没有提到任何章节的行视为全局信息，影响所有章节。
+
+流水线模式生成的文档还记录它依赖的上游文档类型，更新时按上游文档的当前内容
+重建上下文，上游文档变化后相关章节会重新生成。
+"""
+
+import os
+import json
+import asyncio
+import logging
+
+from mcp_common.settings import LLMSettings, STATE_FOLDER
+from mcp_common.response_cache import make_cache_key
+from .sections import split_sections, build_outline, join_sections
+from .gpt_service import build_section_messages, _agenerate_section, _gather_all, SHRINK_ORDER
+from mcp_common.budget import fit_messages
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+META_VERSION = 1
+
+def meta_path(project_path: str, save_path: str) -> str:
+    """Path of the fingerprint file of a generated document, inside the project state folder"""
+    relative = os.path.relpath(os.path.abspath(save_path), os.path.abspath(project_path))
+    return os.path.join(project_path, STATE_FOLDER, "meta", f"{relative}.meta.json")
+
+def _legacy_meta_path(save_path: str) -> str:
+    """Fingerprint file kept next to the document by earlier versions"""
+    directory, name = os.path.split(save_path)
+    return os.path.join(directory, f".{name}.meta.json")
+
+def load_meta(project_path: str, save_path: str) -> dict:
+    """Load the fingerprints recorded for a document, None if missing or unreadable"""
+    for path in (meta_path(project_path, save_path), _legacy_meta_path(save_path)):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError):
+            return None
+        return meta if meta.get("version") == META_VERSION else None
+    return None
+
+def save_meta(project_path: str, save_path: str, meta: dict) -> None:
+    """Write the fingerprint file of a document, replacing one left next to it by earlier versions"""
+    path = meta_path(project_path, save_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    _remove_quietly(_legacy_meta_path(save_path))
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def assign_additional_info(sections: list, additional_info: str) -> list:
+    """Pick the additional information lines relevant to each section
+
+    Args:
+        sections: Template sections from split_sections
+        additional_info: Additional information or requirements
+
+    Returns:
+        list: Relevant additional information text for each section
+    """
+    shared = []
+    targeted = [[] for _ in sections]
+    for line in (additional_info or "").splitlines():
+        if not line.strip():
+            continue
+        lowered = line.lower()
+        matched = [i for i, section in enumerate(sections) if section.key and section.key.lower() in lowered]
+        if matched:
+            for i in matched:
+                targeted[i].append(line)
+        else:
+            shared.append(line)
+    return ["\n".join(shared + lines) for lines in targeted]
+
+def section_fingerprints(sections: list, section_infos: list, title: str, description: str, language: str, upstream_context: str = "") -> list:
+    """Fingerprint the inputs each section is generated from
+
+    Args:
+        sections: Template sections from split_sections
+        section_infos: Relevant additional information for each section
+        title: Document title
+        description: User requirements description
+        language: Document language
+        upstream_context: Summaries of related documents (optional)
+
+    Returns:
+        list: One fingerprint per section
+    """
+    return [
+        make_cache_key(
+            title=title,
+            description=description,
+            language=language,
+            upstream_context=upstream_context,
+            section_template=section.text,
+            additional_info=info
+        )
+        for section, info in zip(sections, section_infos)
+    ]
+
+def record_document(project_path: str, save_path: str, template_type: str, template_content: str, document_content: str, title: str, description: str, additional_info: str, language: str, upstream_context: str = "", depends_on: list = ()) -> bool:
+    """Record section fingerprints for a freshly generated document
+
+    The fingerprints can only be recorded when the document has the same
+    number of top-level sections as its template; otherwise any stale
+    fingerprint file is removed so the next update regenerates everything.
+
+    Args:
+        project_path: Project root directory, the fingerprints are kept in its state folder
+        save_path: Path of the generated document
+        upstream_context: Summaries of related documents the document was generated with
+        depends_on: Template types of those related documents, used to rebuild the context on update
+
+    Returns:
+        bool: Whether fingerprints were recorded
+    """
+    _, template_sections = split_sections(template_content)
+    _, document_sections = split_sections(document_content)
+    if not template_sections or len(template_sections) != len(document_sections):
+        _remove_quietly(meta_path(project_path, save_path))
+        _remove_quietly(_legacy_meta_path(save_path))
+        return False
+    infos = assign_additional_info(template_sections, additional_info)
+    fingerprints = section_fingerprints(template_sections, infos, title, description, language, upstream_context)
+    save_meta(project_path, save_path, {
+        "version": META_VERSION,
+        "template_type": template_type,
+        "depends_on": list(depends_on),
+        "sections": [
+            {"template_heading": t.heading, "heading": d.heading, "fingerprint": fp}
+            for t, d, fp in zip(template_sections, document_sections, fingerprints)
+        ]
+    })
+    return True
+
+async def aupdate_document(project_path: str, save_path: str, template_type: str, title: str, template_content: str, description: str, existing_content: str, additional_info: str = "", language: str = "en", settings: LLMSettings = None, use_cache: bool = True, upstream_context: str = "") -> tuple:
+    """Regenerate only the sections of an existing document whose inputs changed
+
+    Args:
+        project_path: Project root directory holding the recorded fingerprints
+        save_path: Path of the existing document
+        template_type: Document template type
+        title: Document title
+        template_content: Template content
+        description: User requirements description
+        existing_content: Current content of the document
+        additional_info: Additional information (optional)
+        language: Document language
+        settings: Request-scoped model/endpoint settings (optional, default from environment)
+        use_cache: Whether to reuse cached responses for identical sections
+        upstream_context: Summaries of related documents (optional)
+
+    Returns:
+        tuple: (updated document content, headings of regenerated sections, headings of reused sections)
+    """
+    settings = settings or LLMSettings.from_env()
+    _, template_sections = split_sections(template_content)
+    if not template_sections:
+        raise ValueError("Template has no sections, incremental update is not possible")
+
+    infos = assign_additional_info(template_sections, additional_info)
+    fingerprints = section_fingerprints(template_sections, infos, title, description, language, upstream_context)
+
+    # 记录的指纹与已有文档的章节一一对应，标题不一致说明文档被手动改过结构
+    meta = await asyncio.to_thread(load_meta, project_path, save_path) or {}
+    recorded = meta.get("sections", [])
+    preamble, document_sections = split_sections(existing_content)
+    if len(recorded) != len(template_sections) or len(document_sections) != len(recorded):
+        recorded = []
+
+    outline = build_outline(template_sections)
+    section_contents = [None] * len(template_sections)
+    pending = []
+    for i, (section, fingerprint) in enumerate(zip(template_sections, fingerprints)):
+        entry = recorded[i] if recorded else None
+        if (entry and entry["template_heading"] == section.heading and entry["fingerprint"] == fingerprint
+                and entry["heading"] == document_sections[i].heading):
+            section_contents[i] = document_sections[i].text
+        else:
+            pending.append(i)
+
+    logger.info("Updating document %s: regenerating %s of %s sections", save_path, len(pending), len(template_sections))
+
+    async def generate(i: int) -> None:
+        section = template_sections[i]
+        messages = fit_messages(build_section_messages, SHRINK_ORDER, title=title, section_template=section.text, outline=outline, description=description, additional_info=infos[i], language=language, upstream_context=upstream_context)
+        section_contents[i] = await _agenerate_section(messages, section.heading, settings, use_cache)
+
+    try:
+        await _gather_all(generate(i) for i in pending)
+    except Exception as e:
+        logger.error("Failed to call GPT service: %s", e)
+        raise Exception(f"Failed to call GPT service: {str(e)}")
+
+    document_content = join_sections(title, section_contents, preamble)
+    regenerated = [template_sections[i].heading for i in pending]
+    reused = [s.heading for i, s in enumerate(template_sections) if i not in pending]
+    return document_content, regenerated, reused
@@ -0,0 +1,136 @@
+"""文档依赖流水线模块
+
+按模板之间的依赖关系（有向无环图）调度文档生成：
+相互独立的文档并行生成，下游文档在上游完成后基于其摘要生成。
+"""
+
+import re
+import asyncio
+import logging
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 模板依赖关系：键依赖于值中列出的模板
+TEMPLATE_DEPENDENCIES = {
+    "requirement_doc": [],
+    "function_list": ["requirement_doc"],
+    "development_architecture": ["requirement_doc", "function_list"],
+    "frontend_features": ["function_list"],
+    "backend_features": ["function_list"],
+    "database_design": ["requirement_doc", "function_list"],
+    "server_api": ["requirement_doc", "function_list"],
+    "api_dependencies": ["server_api"],
+    "plugin_dependencies": ["development_architecture"],
+    "feature_document": ["requirement_doc", "function_list"],
+    "development_plan": ["requirement_doc", "function_list", "development_architecture", "database_design", "server_api"]
+}
+
+# 每个上游文档摘要的最大字符数
+SUMMARY_MAX_CHARS = 1500
+
+def summarize_document(content: str, max_chars: int = SUMMARY_MAX_CHARS) -> str:
+    """Build a compact outline of a generated document
+
+    Keeps headings and the first line of text under each heading, skipping code
+    blocks, tables and comments, so downstream prompts stay small.
+
+    Args:
+        content: Generated document content
+        max_chars: Maximum length of the summary
+
+    Returns:
+        str: Compact summary
+    """
+    lines = []
+    in_code = False
+    need_text = False
+    for line in content.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            in_code = not in_code
+            continue
+        if in_code or not stripped or stripped.startswith(("|", "<!--")):
+            continue
+        if stripped.startswith("#"):
+            lines.append(stripped)
+            need_text = True
+        elif need_text:
+            lines.append(re.sub(r"\s+", " ", stripped)[:200])
+            need_text = False
+    summary = "\n".join(lines)
+    if len(summary) > max_chars:
+        summary = summary[:max_chars].rsplit("\n", 1)[0] + "\n..."
+    return summary
+
+def build_upstream_context(upstream: dict) -> str:
+    """Render upstream document summaries for a downstream prompt
+
+    Args:
+        upstream: Mapping of template type to generated document content
+
+    Returns:
+        str: Context text, empty if there is no upstream document
+    """
+    parts = []
+    for template_type, content in upstream.items():
+        parts.append(f"[{template_type}]\n{summarize_document(content)}")
+    return "\n\n".join(parts)
+
+def check_acyclic(nodes: list, dependencies: dict) -> None:
+    """Raise ValueError if the dependencies among nodes contain a cycle"""
+    visiting, done = set(), set()
+
+    def visit(node, path):
+        if node in done:
+            return
+        if node in visiting:
+            raise ValueError(f"Template dependency cycle: {' -> '.join(path + [node])}")
+        visiting.add(node)
+        for dep in dependencies.get(node, []):
+            if dep in nodes:
+                visit(dep, path + [node])
+        visiting.discard(node)
+        done.add(node)
+
+    for node in nodes:
+        visit(node, [])
+
+async def run_pipeline(nodes: list, run_node, dependencies: dict = None, external: dict = None) -> dict:
+    """Run nodes as a DAG, starting each one as soon as its dependencies finish
+
+    Args:
+        nodes: Template types to generate
+        run_node: Coroutine function run_node(node, upstream) returning the
+            document content, upstream maps dependency names to their content
+        dependencies: Dependency graph (default TEMPLATE_DEPENDENCIES)
+        external: Content of dependencies that are not part of this run,
+            e.g. documents generated earlier
+
+    Returns:
+        dict: Node name to its content, or to the exception it raised.
+        A failed dependency does not block its dependents, they are generated
+        with the remaining upstream context.
+    """
+    dependencies = TEMPLATE_DEPENDENCIES if dependencies is None else dependencies
+    external = external or {}
+    check_acyclic(nodes, dependencies)
+    tasks = {}
+
+    async def run(node):
+        upstream = {}
+        for dep in dependencies.get(node, []):
+            if dep in tasks:
+                try:
+                    upstream[dep] = await asyncio.shield(tasks[dep])
+                except Exception:
+                    logger.warning("Dependency %s of %s failed, generating without it", dep, node)
+            elif dep in external:
+                upstream[dep] = external[dep]
+        return await run_node(node, upstream)
+
+    # 先创建全部任务，依赖通过await其他任务实现
+    for node in nodes:
+        tasks[node] = asyncio.ensure_future(run(node))
+    results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+    return dict(zip(tasks, results))
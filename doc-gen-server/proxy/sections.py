@@ -0,0 +1,91 @@
+"""文档分节模块
+
+按二级标题（## ）把模板或文档拆分为顶层章节，用于按章节并行生成和增量更新。
+"""
+
+import re
+from dataclasses import dataclass
+
+SECTION_HEADING = re.compile(r"^##\s+\S")
+OUTLINE_HEADING = re.compile(r"^#{2,4}\s+\S")
+
+@dataclass
+class Section:
+    """A top-level section: its heading line and the text below it"""
+
+    heading: str
+    body: str
+
+    @property
+    def text(self) -> str:
+        return f"{self.heading}\n{self.body}".rstrip() + "\n"
+
+    @property
+    def key(self) -> str:
+        """Heading text without the leading hashes and numbering, used to match sections"""
+        title = self.heading.lstrip("#").strip()
+        return re.sub(r"^[\d.]+\s*", "", title)
+
+def split_sections(content: str) -> tuple:
+    """Split markdown into the preamble and its top-level (##) sections
+
+    Headings inside fenced code blocks are ignored.
+
+    Args:
+        content: Markdown text
+
+    Returns:
+        tuple: (preamble text before the first section, list of Section)
+    """
+    preamble = []
+    sections = []
+    in_code = False
+    for line in content.splitlines():
+        if line.strip().startswith("```"):
+            in_code = not in_code
+        if not in_code and SECTION_HEADING.match(line):
+            sections.append(Section(heading=line.rstrip(), body=""))
+        elif sections:
+            sections[-1].body += line + "\n"
+        else:
+            preamble.append(line)
+    return "\n".join(preamble).strip(), sections
+
+def build_outline(sections: list) -> str:
+    """List the section and subsection headings of a template
+
+    Args:
+        sections: Sections from split_sections
+
+    Returns:
+        str: One heading per line
+    """
+    lines = []
+    for section in sections:
+        lines.append(section.heading)
+        in_code = False
+        for line in section.body.splitlines():
+            if line.strip().startswith("```"):
+                in_code = not in_code
+            elif not in_code and OUTLINE_HEADING.match(line):
+                lines.append(line.rstrip())
+    return "\n".join(lines)
+
+def join_sections(title: str, sections: list, preamble: str = "") -> str:
+    """Reassemble a document from its title and generated section texts
+
+    Args:
+        title: Document title
+        sections: Generated section texts in document order
+        preamble: Text of an existing document before its first section (optional),
+            kept below the title; its own title line is replaced
+
+    Returns:
+        str: Full document
+    """
+    lines = preamble.strip().splitlines()
+    if lines and lines[0].startswith("# "):
+        lines = lines[1:]
+    intro = "\n".join(lines).strip()
+    parts = [f"# {title}"] + ([intro] if intro else []) + [section.strip() for section in sections if section.strip()]
+    return "\n\n".join(parts) + "\n"
@@ -0,0 +1,185 @@
+"""模板注册表模块
+
+第一次使用时一次性加载模板目录，缓存预编译的模板（精简HTML注释和示例代码、
+提取章节大纲、预先计算token数），并按修改时间检查自动热加载。
+除内置模板目录外，还可以通过 DOC_GEN_TEMPLATE_DIRS 指定自定义模板目录，
+放入其中的 .md 文件按文件名（不含扩展名）作为模板类型使用。
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from dataclasses import dataclass
+
+from .sections import split_sections, build_outline
+from mcp_common.tokens import estimate_tokens
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 模板中HTML注释的处理方式：condense（精简为括号说明）/ strip（删除）/ keep（保留）
+TEMPLATE_COMMENTS = os.environ.get("TEMPLATE_COMMENTS", "condense").lower()
+# 检查模板文件变化的最小间隔（秒）
+TEMPLATE_RELOAD_INTERVAL = float(os.environ.get("TEMPLATE_RELOAD_INTERVAL", "2"))
+# 精简模式下示例代码块保留的最大行数
+CODE_BLOCK_MAX_LINES = 8
+
+COMMENT_PATTERN = re.compile(r"<!--\s*(.*?)\s*-->", re.S)
+
+@dataclass
+class CompiledTemplate:
+    """A template prepared for prompting"""
+
+    name: str
+    path: str
+    mtime: float
+    raw: str
+    content: str
+    outline: str
+    token_count: int
+    raw_token_count: int
+
+def _shorten_code_blocks(content: str, max_lines: int) -> str:
+    """Keep only the first lines of long fenced code blocks"""
+    output = []
+    block = None
+    for line in content.splitlines():
+        if line.strip().startswith("```"):
+            if block is None:
+                block = [line]
+                continue
+            if len(block) - 1 > max_lines:
+                block = block[:max_lines + 1] + ["  ..."]
+            output.extend(block + [line])
+            block = None
+        elif block is not None:
+            block.append(line)
+        else:
+            output.append(line)
+    if block is not None:
+        output.extend(block)
+    return "\n".join(output)
+
+def compile_template(content: str, comments: str = TEMPLATE_COMMENTS) -> str:
+    """Trim a template before it is sent as prompt tokens
+
+    Args:
+        content: Raw template content
+        comments: How to handle HTML guidance comments (condense/strip/keep)
+
+    Returns:
+        str: Compiled template content
+    """
+    if comments == "keep":
+        return content
+    if comments == "strip":
+        content = COMMENT_PATTERN.sub("", content)
+    else:
+        content = COMMENT_PATTERN.sub(lambda m: f"({' '.join(m.group(1).split())})" if m.group(1) else "", content)
+        content = _shorten_code_blocks(content, CODE_BLOCK_MAX_LINES)
+    # 去掉行尾空白并合并多余的空行
+    content = "\n".join(line.rstrip() for line in content.splitlines())
+    content = re.sub(r"\n{3,}", "\n\n", content)
+    return content.strip() + "\n"
+
+class TemplateRegistry:
+    """In-memory registry of compiled templates with mtime based hot reload"""
+
+    def __init__(self, directories: list, reload_interval: float = TEMPLATE_RELOAD_INTERVAL):
+        """
+        Args:
+            directories: Template directories, later directories override earlier ones
+            reload_interval: Minimum seconds between checks for changed files
+        """
+        self.directories = directories
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._templates = {}
+        # 第一次使用时加载，不拖慢服务启动
+        self._checked = float("-inf")
+
+    @classmethod
+    def from_env(cls, builtin_dir: str) -> "TemplateRegistry":
+        """Build a registry of the built-in templates plus DOC_GEN_TEMPLATE_DIRS
+
+        Templates are loaded on first use, not here.
+
+        Args:
+            builtin_dir: Directory of the built-in templates
+
+        Returns:
+            TemplateRegistry: Registry over the template directories
+        """
+        extra = [d for d in os.environ.get("DOC_GEN_TEMPLATE_DIRS", "").split(os.pathsep) if d]
+        return cls([builtin_dir] + extra)
+
+    def _scan(self) -> dict:
+        """Map template names to (path, mtime) for all template files"""
+        found = {}
+        for directory in self.directories:
+            if not os.path.isdir(directory):
+                continue
+            for entry in os.scandir(directory):
+                if entry.is_file() and entry.name.endswith(".md"):
+                    found[entry.name[:-3]] = (entry.path, entry.stat().st_mtime)
+        return found
+
+    def _compile(self, name: str, path: str, mtime: float) -> CompiledTemplate:
+        with open(path, 'r', encoding='utf-8') as f:
+            raw = f.read()
+        content = compile_template(raw)
+        _, sections = split_sections(content)
+        return CompiledTemplate(
+            name=name,
+            path=path,
+            mtime=mtime,
+            raw=raw,
+            content=content,
+            outline=build_outline(sections),
+            token_count=estimate_tokens(content),
+            raw_token_count=estimate_tokens(raw)
+        )
+
+    def refresh(self, force: bool = False) -> None:
+        """Reload added, changed or removed template files
+
+        Args:
+            force: Check the directories even if the reload interval has not passed
+        """
+        now = time.monotonic()
+        if not force and now - self._checked < self.reload_interval:
+            return
+        with self._lock:
+            self._checked = now
+            found = self._scan()
+            templates = {}
+            for name, (path, mtime) in found.items():
+                current = self._templates.get(name)
+                if current and current.path == path and current.mtime == mtime:
+                    templates[name] = current
+                    continue
+                try:
+                    templates[name] = self._compile(name, path, mtime)
+                    logger.info("Loaded template %s: %s -> %s tokens", name, templates[name].raw_token_count, templates[name].token_count)
+                except (OSError, UnicodeDecodeError) as e:
+                    # 跳过无法读取或不是UTF-8编码的模板，不影响其他模板
+                    logger.error("Failed to load template %s: %s", path, e)
+            self._templates = templates
+
+    def get(self, name: str) -> CompiledTemplate:
+        """Get a compiled template by type, None if it does not exist"""
+        self.refresh()
+        return self._templates.get(name)
+
+    def names(self) -> list:
+        """Names of all available templates"""
+        self.refresh()
+        return sorted(self._templates)
+
+    def templates(self) -> list:
+        """All available compiled templates, ordered by name"""
+        self.refresh()
+        templates = self._templates
+        return [templates[name] for name in sorted(templates)]
@@ -1,116 +1,659 @@
 import os
+import sys
+import time
+import asyncio
 import logging
 from sys import stdin, stdout
 import json
-import requests
-from fastmcp import FastMCP
+from fastmcp import FastMCP, Context
 import mcp.types as types
-from proxy.gpt_service import generate_document
-from pathlib import Path
+
+# 两个服务共用的 mcp_common 包在仓库根目录
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from proxy.gpt_service import agenerate_document, agenerate_sections, response_cache, MAX_TOKENS
+from proxy.pipeline import run_pipeline, build_upstream_context, TEMPLATE_DEPENDENCIES
+from proxy.incremental import aupdate_document, record_document, load_meta
+from proxy.template_registry import TemplateRegistry
+from mcp_common.client_pool import pool_lifespan
+from mcp_common.settings import LLMSettings, STATE_FOLDER
+from mcp_common.singleflight import SingleFlight, normalize_key
+from mcp_common.jobs import JobQueue, JobQueueFull, FINISHED_STATES
+from mcp_common.rate_limit import limiter_stats
+from mcp_common.endpoints import endpoint_stats
+from mcp_common.transport import SharedLifespan, run_server, project_allowed
+from mcp_common.metrics import metrics, span, trace, traced
+from mcp_common.budget import budgeted, project_scope, ledger_for, budget_status, PROJECT_BUDGET_DAYS
+from mcp_common.library import Library, LIBRARY_FOLDERS
+from mcp_common.similar_cache import SimilarCache, make_scope
+from mcp_common.tool_docs import describe_tools
+from contextlib import asynccontextmanager
 
 # 配置
 TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), "templates")
 DOC_SAVE_FOLDER = "doc"  # 相对于项目根目录的路径
+# 流式生成时进度通知的最小间隔（秒）
+PROGRESS_INTERVAL = float(os.environ.get("PROGRESS_INTERVAL", "0.5"))
+# 流式生成时缓存的输出达到该字符数或距上次写入超过该间隔（秒）后写入文件
+STREAM_FLUSH_CHARS = 4096
+STREAM_FLUSH_INTERVAL = float(os.environ.get("STREAM_FLUSH_INTERVAL", "1"))
+# 批量生成时默认的并发数
+DOCUMENT_SET_WORKERS = int(os.environ.get("DOCUMENT_SET_WORKERS", "4"))
+
 
 # 从环境变量中获取配置
 API_KEY = os.environ.get("API_KEY", "")
 MODEL = os.environ.get("MODEL", "gpt-4")
 API_URL = os.environ.get("API_URL", "https://api.openai.com/v1")
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 # stdin和stdout配置
 stdin.reconfigure(encoding='utf-8')
 stdout.reconfigure(encoding='utf-8')
 
+# 模板注册表：第一次使用时加载，模板文件变化时自动重新加载
+template_registry = TemplateRegistry.from_env(TEMPLATES_DIR)
+
+# 导出的Prometheus指标名前缀
+metrics.namespace = "doc_gen"
+
+# 合并相同输入的并发生成请求
+inflight = SingleFlight()
+
+# 相似请求缓存，换一种说法描述的重复请求复用之前的结果
+similar_cache = SimilarCache.from_env("doc-gen")
+
+# 项目 prompts/ 和 doc/ 目录的检索索引
+library = Library.from_env("doc-gen")
+
+# 后台任务队列，任务状态保存在项目的 .cursor-copilot/jobs/doc-gen 目录
+job_queue = JobQueue("doc-gen", os.path.join(STATE_FOLDER, "jobs", "doc-gen"), runners={
+    "document": lambda **params: _create_document(**params)
+})
+
+@asynccontextmanager
+async def server_lifespan(server):
+    """Start the background job workers, stop them and close pooled clients on shutdown"""
+    async with pool_lifespan(server) as state:
+        metrics.start_exporter()
+        # 启动时加载模板，工具调用时只需检查文件变化
+        await asyncio.to_thread(template_registry.refresh, True)
+        await job_queue.start()
+        try:
+            yield state
+        finally:
+            await job_queue.stop()
+            library.close()
+            similar_cache.close()
+
+# 网络模式下所有客户端会话共享同一个生命周期
+lifespan = SharedLifespan(server_lifespan)
+
 # 创建FastMCP实例
-mcp = FastMCP("doc-gen")
+mcp = FastMCP("doc-gen", lifespan=lifespan.session)
+
+def _write_file(path: str, content: str) -> None:
+    """Write text content to a file"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+def _read_file(path: str) -> str:
+    """Read text content from a file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def _partial_path(save_path: str) -> str:
+    """Path of the temporary file a streamed document is written to"""
+    directory, name = os.path.split(save_path)
+    return os.path.join(directory, f".{name}.part")
+
+async def _stream_to_file(save_path: str, generate, ctx: Context = None) -> str:
+    """Stream generated chunks into a temporary file and move it into place
+    
+    The chunks are appended to a hidden .part file next to save_path while
+    progress notifications with the token count are sent to the client. They
+    are buffered and written on a worker thread every STREAM_FLUSH_CHARS
+    characters or STREAM_FLUSH_INTERVAL seconds, not on the event loop. The
+    file is atomically renamed to save_path once generation completes; if it
+    fails the partial file is kept, if the request is cancelled it is removed.
+    
+    Args:
+        save_path: Final path of the document
+        generate: Coroutine function generate(on_delta) returning the full content
+        ctx: MCP request context used for progress notifications (optional)
+        
+    Returns:
+        str: Generated document content
+    """
+    part_path = _partial_path(save_path)
+    f = await asyncio.to_thread(open, part_path, 'w', encoding='utf-8')
+    last_report = 0.0
+    buffer = []
+    buffered = 0
+    last_flush = time.monotonic()
+    writing = None
+    
+    def write(text: str) -> None:
+        f.write(text)
+        f.flush()
+    
+    async def flush() -> None:
+        nonlocal buffered, last_flush, writing
+        last_flush = time.monotonic()
+        if not buffer:
+            return
+        text = "".join(buffer)
+        buffer.clear()
+        buffered = 0
+        # 取消不会中断线程中的写入，屏蔽取消并保留任务，关闭文件前等它结束
+        writing = asyncio.ensure_future(asyncio.to_thread(write, text))
+        await asyncio.shield(writing)
+    
+    async def close() -> None:
+        if writing is not None:
+            await asyncio.gather(writing, return_exceptions=True)
+        await asyncio.to_thread(f.close)
+    
+    async def report(tokens: int) -> None:
+        try:
+            await ctx.report_progress(progress=tokens, total=MAX_TOKENS)
+        except Exception as e:
+            logger.debug("Failed to send progress notification: %s", e)
+    
+    async def on_delta(text: str, tokens: int) -> None:
+        nonlocal last_report, buffered
+        buffer.append(text)
+        buffered += len(text)
+        now = time.monotonic()
+        if buffered >= STREAM_FLUSH_CHARS or now - last_flush >= STREAM_FLUSH_INTERVAL:
+            await flush()
+        if ctx and now - last_report >= PROGRESS_INTERVAL:
+            last_report = now
+            await report(tokens)
+    
+    try:
+        document_content = await generate(on_delta)
+        await flush()
+    except asyncio.CancelledError:
+        # 客户端取消或断开后没有人需要这份部分内容
+        await close()
+        try:
+            await asyncio.to_thread(os.remove, part_path)
+        except OSError:
+            pass
+        logger.info("Generation cancelled, removed partial document: %s", part_path)
+        raise
+    except Exception:
+        # 保留已生成的部分内容，之后可以续写
+        try:
+            await flush()
+        finally:
+            await close()
+        raise
+    await close()
+    
+    with span("file_write"):
+        await asyncio.to_thread(os.replace, part_path, save_path)
+    if ctx:
+        await report(MAX_TOKENS)
+    return document_content
+
+async def _generate_and_save(title: str, template_content: str, description: str, project_path: str, save_path: str, additional_info: str, language: str, settings: LLMSettings, use_cache: bool, upstream_context: str = "", depends_on: list = (), stream: bool = False, ctx: Context = None, resume: bool = False, parallel_sections: bool = False, template_type: str = "") -> tuple:
+    """Generate one document from a template and save it
+    
+    Args:
+        title: Document title
+        template_content: Compiled template content
+        description: A simple description of the product or feature
+        project_path: Project root directory
+        save_path: Path of the generated document
+        additional_info: Additional information or requirements
+        language: Document language
+        settings: Request-scoped model/endpoint settings
+        use_cache: Whether to reuse a cached result for an identical request
+        upstream_context: Summaries of related documents to stay consistent with (optional)
+        depends_on: Template types of the related documents, recorded so updates can rebuild the context
+        stream: Stream the completion into a temporary file with progress notifications
+        ctx: MCP request context used for progress notifications (optional)
+        resume: Continue the partial file left by an interrupted streamed generation
+        parallel_sections: Generate the template's top-level sections concurrently
+        template_type: Document template type, recorded with the section fingerprints
+        
+    Returns:
+        tuple: (path of the saved document, document content)
+    """
+    # 续写之前流式生成中断时留下的部分文件
+    resume_from = ""
+    part_path = _partial_path(save_path)
+    if stream and resume and os.path.exists(part_path):
+        resume_from = await asyncio.to_thread(_read_file, part_path)
+        logger.info("Resuming partial document: %s", part_path)
+    
+    async def generate(on_delta=None) -> str:
+        # 调用GPT服务生成文档（异步，不阻塞其他工具调用）
+        return await agenerate_document(
+            title=title,
+            template_content=template_content,
+            description=description,
+            additional_info=additional_info,
+            language=language,
+            settings=settings,
+            use_cache=use_cache,
+            upstream_context=upstream_context,
+            on_delta=on_delta,
+            resume_from=resume_from
+        )
+    
+    if parallel_sections:
+        # 按章节并行生成，每完成一个章节发送一次进度通知
+        if stream:
+            logger.info("Streaming is not used when generating sections in parallel")
+        
+        async def on_progress(done: int, total: int) -> None:
+            if ctx:
+                try:
+                    await ctx.report_progress(progress=done, total=total)
+                except Exception as e:
+                    logger.debug("Failed to send progress notification: %s", e)
+        
+        document_content = await agenerate_sections(
+            title=title,
+            template_content=template_content,
+            description=description,
+            additional_info=additional_info,
+            language=language,
+            settings=settings,
+            use_cache=use_cache,
+            upstream_context=upstream_context,
+            on_progress=on_progress
+        )
+        with span("file_write"):
+            await asyncio.to_thread(_write_file, save_path, document_content)
+    elif stream:
+        # 流式写入临时文件，完成后原子替换
+        document_content = await _stream_to_file(save_path, generate, ctx)
+    else:
+        document_content = await generate()
+        # 保存文档
+        with span("file_write"):
+            await asyncio.to_thread(_write_file, save_path, document_content)
+    
+    # 记录各章节的输入指纹，供之后增量更新使用
+    await asyncio.to_thread(record_document, project_path, save_path, template_type, template_content, document_content, title, description, additional_info, language, upstream_context, depends_on)
+    
+    logger.info("Document saved: %s", save_path)
+    return save_path, document_content
+
+def _retitle(content: str, title: str) -> str:
+    """Replace the title line of a generated document"""
+    first_line, _, rest = content.partition("\n")
+    if first_line.startswith("# "):
+        return f"# {title}\n{rest}"
+    return f"# {title}\n\n{content}"
+
+async def _similar_result(match: dict, title: str, template_type: str, template_content: str, description: str, project_path: str, save_path: str, additional_info: str, language: str) -> dict:
+    """Tool response for a request matching an earlier, similar one
+    
+    In return mode the earlier document is saved under the new title, in offer
+    mode nothing is written and the earlier document is only reported.
+    
+    Returns:
+        dict: Tool response with success, error, document and the similar request
+    """
+    similar = {
+        "similarity": match["similarity"],
+        "request": match["request"],
+        "path": match["path"],
+        "created": match["created"]
+    }
+    if similar_cache.mode == "offer":
+        return {
+            "success": True,
+            "error": None,
+            "message": "A very similar document was generated before, no new document was created. Use its content, or call again with use_cache set to false to generate a new one.",
+            "document": None,
+            "similar": {**similar, "content": match["value"]}
+        }
+    
+    document_content = _retitle(match["value"], title)
+    with span("file_write"):
+        await asyncio.to_thread(_write_file, save_path, document_content)
+    await asyncio.to_thread(record_document, project_path, save_path, template_type, template_content, document_content, title, description, additional_info, language, "")
+    logger.info("Document saved from a similar request (similarity %s): %s", match["similarity"], save_path)
+    return {
+        "success": True,
+        "error": None,
+        "message": "I have created the document file from a very similar earlier request. You don't need to create it again; if it does not fit, call again with use_cache set to false to generate a new one.",
+        "document": {
+            "path": save_path,
+            "title": title,
+            "template_type": template_type,
+            "coalesced": False
+        },
+        "similar": similar
+    }
+
+async def _update_and_save(title: str, template_type: str, template_content: str, description: str, project_path: str, save_path: str, additional_info: str, language: str, settings: LLMSettings, use_cache: bool) -> tuple:
+    """Regenerate the changed sections of an existing document and save it
+    
+    Args:
+        title: Document title
+        template_type: Document template type
+        template_content: Compiled template content
+        description: A simple description of the product or feature
+        project_path: Project root directory
+        save_path: Path of the existing document
+        additional_info: Additional information or requirements
+        language: Document language
+        settings: Request-scoped model/endpoint settings
+        use_cache: Whether to reuse cached results for identical sections
+        
+    Returns:
+        tuple: (headings of regenerated sections, headings of reused sections)
+    """
+    existing_content = await asyncio.to_thread(_read_file, save_path)
+    # 流水线模式生成的文档按上游文档的当前内容重建上下文，与生成时一致
+    meta = await asyncio.to_thread(load_meta, project_path, save_path) or {}
+    upstream = {}
+    for dep in meta.get("depends_on", []):
+        dep_path = os.path.join(project_path, DOC_SAVE_FOLDER, f"{dep}.md")
+        if os.path.exists(dep_path):
+            upstream[dep] = await asyncio.to_thread(_read_file, dep_path)
+    upstream_context = build_upstream_context(upstream)
+    
+    document_content, regenerated, reused = await aupdate_document(
+        project_path=project_path,
+        save_path=save_path,
+        template_type=template_type,
+        title=title,
+        template_content=template_content,
+        description=description,
+        existing_content=existing_content,
+        additional_info=additional_info,
+        language=language,
+        settings=settings,
+        use_cache=use_cache,
+        upstream_context=upstream_context
+    )
+    
+    if regenerated:
+        with span("file_write"):
+            await asyncio.to_thread(_write_file, save_path, document_content)
+    await asyncio.to_thread(record_document, project_path, save_path, template_type, template_content, document_content, title, description, additional_info, language, upstream_context, list(upstream))
+    
+    logger.info("Document updated: %s, %s sections regenerated", save_path, len(regenerated))
+    return regenerated, reused
 
 @mcp.tool("use_description")
 async def list_tools():
-    """列出所有可用的工具及其参数"""
+    """List all available tools and their parameters"""
+    # 由工具函数的签名和文档字符串生成，与实际注册的参数保持一致
     return {
-        "tools": [
-            {
-                "name": "Generate document",
-                "description": "Generate document based on user requirements and select template",
-                "parameters": {
-                    "title": {
-                        "type": "string",
-                        "description": "Document title",
-                        "required": True
-                    },
-                    "template_type": {
-                        "type": "string",
-                        "description": "Document template type (requirement_doc/function_list/development_architecture/frontend_features/backend_features/database_design/server_api/api_dependencies/plugin_dependencies/development_plan/feature_document)",
-                        "required": True
-                    },
-                    "description": {
-                        "type": "string",
-                        "description": "A simple description of the product or feature, AI will generate the document based on this description",
-                        "required": True
-                    },
-                    "file_name": {
-                        "type": "string",
-                        "description": "File name for generated document (without path, with extension)",
-                        "required": True
-                    },
-                    "project_path": {
-                        "type": "string",
-                        "description": "Project root directory path (required)",
-                        "required": True
-                    },
-                    "additional_info": {
-                        "type": "string",
-                        "description": "Additional information or requirements (optional)",
-                        "required": False
-                    },
-                    "model": {
-                        "type": "string",
-                        "description": "AI model name (optional, default to configured model)",
-                        "required": False
-                    },
-                    "api_base_url": {
-                        "type": "string",
-                        "description": "API base URL (optional, default to configured URL)",
-                        "required": False
-                    },
-                    "language": {
-                        "type": "string",
-                        "description": "Document language (e.g., en, zh, ja, etc.)",
-                        "required": False
-                    }
+        "tools": describe_tools([
+            ("generate_document", create_document),
+            ("generate_document_set", create_document_set),
+            ("submit_document_job", submit_document_job),
+            ("job_status", job_status),
+            ("job_result", job_result),
+            ("cancel_job", cancel_job),
+            ("list_templates", list_templates),
+            ("search_library", search_library),
+            ("token_usage", token_usage),
+            ("cache_stats", cache_stats),
+            ("server_stats", server_stats)
+        ])
+    }
+
+@traced("generate_document", label_args=("template_type",))
+@budgeted()
+async def _create_document(title: str, template_type: str, description: str, file_name: str, project_path: str, additional_info: str = "", model: str = None, api_base_url: str = None, language: str = "en", use_cache: bool = True, stream: bool = False, resume: bool = False, parallel_sections: bool = False, update: bool = False, ctx: Context = None) -> dict:
+    """Validate a document request, generate the document and save it into doc/
+    
+    Returns:
+        dict: Tool response with success, error and document information
+    """
+    logger.info("Received document generation request: %s - %s", title, template_type)
+    
+    # Validate parameters
+    if not title or not template_type or not description:
+        error_msg = "Title, template type, and description cannot be empty"
+        logger.error(error_msg)
+        return {
+            "success": False,
+            "error": error_msg,
+            "document": None
+        }
+    
+    # 验证project_path
+    if not project_path or not os.path.exists(project_path):
+        error_msg = f"Project path does not exist: {project_path}"
+        logger.error(error_msg)
+        return {
+            "success": False,
+            "error": error_msg,
+            "document": None
+        }
+    if not project_allowed(project_path):
+        error_msg = f"Project path is outside the allowed project roots: {project_path}"
+        logger.error(error_msg)
+        return {
+            "success": False,
+            "error": error_msg,
+            "document": None
+        }
+    
+    # Create save directory
+    doc_dir = os.path.join(project_path, DOC_SAVE_FOLDER)
+    if not os.path.exists(doc_dir):
+        os.makedirs(doc_dir)
+        logger.info("Created document save directory: %s", doc_dir)
+    
+    # Check file name
+    if not os.path.splitext(file_name)[1]:
+        file_name = f"{file_name}.md"
+        logger.info("File name does not have an extension, using default extension: %s", file_name)
+    
+    # 从模板注册表获取预编译的模板
+    with span("template_load"):
+        template = await asyncio.to_thread(template_registry.get, template_type)
+    if not template:
+        available = await asyncio.to_thread(template_registry.names)
+        error_msg = f"Unsupported template type: {template_type}, available: {', '.join(available)}"
+        logger.error(error_msg)
+        return {
+            "success": False,
+            "error": error_msg,
+            "document": None
+        }
+    
+    try:
+        # If provided model or API URL, apply them to this request only
+        settings = LLMSettings.from_env().override(model=model, api_base_url=api_base_url)
+        if model:
+            logger.info("Using custom model: %s", model)
+        
+        if api_base_url:
+            logger.info("Using custom API base URL: %s", api_base_url)
+        
+        save_path = os.path.join(doc_dir, file_name)
+        # 只有已有文档并记录了章节指纹时才按章节增量更新，否则按请求的方式整篇生成
+        update_existing = False
+        if update and os.path.exists(save_path):
+            meta = await asyncio.to_thread(load_meta, project_path, save_path) or {}
+            update_existing = bool(meta.get("sections"))
+        # 相同输入且写同一文件的并发请求共享一次生成
+        flight_key = normalize_key(
+            save_path=os.path.abspath(save_path),
+            title=title,
+            template_type=template_type,
+            description=description,
+            additional_info=additional_info,
+            language=language,
+            model=settings.model,
+            api_url=settings.api_url,
+            use_cache=use_cache,
+            update=update_existing,
+            parallel_sections=parallel_sections,
+            resume=stream and resume
+        )
+        if update_existing:
+            # 只重新生成输入发生变化的章节
+            (regenerated, reused), coalesced = await inflight.do(flight_key, lambda: _update_and_save(
+                title=title,
+                template_type=template_type,
+                template_content=template.content,
+                description=description,
+                project_path=project_path,
+                save_path=save_path,
+                additional_info=additional_info,
+                language=language,
+                settings=settings,
+                use_cache=use_cache
+            ))
+            return {
+                "success": True,
+                "error": None,
+                "message": f"I have updated the document file, {len(regenerated)} of {len(regenerated) + len(reused)} sections were regenerated. You don't need to create it again.",
+                "document": {
+                    "path": save_path,
+                    "title": title,
+                    "template_type": template_type,
+                    "regenerated_sections": regenerated,
+                    "reused_sections": reused,
+                    "coalesced": coalesced
                 }
             }
-        ]
-    }
+        
+        # 相同模板和语言下足够相似的历史请求，直接复用或提示之前的结果
+        similar_scope = make_scope(kind="document", template_type=template_type, language=language)
+        similar_request = f"{title}\n{description}\n{additional_info}".strip()
+        use_similar = use_cache and not (stream and resume)
+        if use_similar:
+            with span("similar_lookup"):
+                match = await asyncio.to_thread(similar_cache.lookup, similar_scope, similar_request)
+            if match:
+                return await _similar_result(match, title, template_type, template.content, description, project_path, save_path, additional_info, language)
+        
+        (save_path, document_content), coalesced = await inflight.do(flight_key, lambda: _generate_and_save(
+            title=title,
+            template_content=template.content,
+            description=description,
+            project_path=project_path,
+            save_path=save_path,
+            additional_info=additional_info,
+            language=language,
+            settings=settings,
+            use_cache=use_cache,
+            stream=stream,
+            ctx=ctx,
+            resume=resume,
+            parallel_sections=parallel_sections,
+            template_type=template_type
+        ))
+        if use_similar and not coalesced:
+            await asyncio.to_thread(similar_cache.add, similar_scope, similar_request, document_content, save_path)
+        
+        # Return result
+        return {
+            "success": True,
+            "error": None,
+            "message": "I have created the document file. You don't need to create it again, but instead check if other documents need to be created and call the MCP service again.",
+            "document": {
+                "path": save_path,
+                "title": title,
+                "template_type": template_type,
+                "coalesced": coalesced
+            }
+        }
+        
+    except Exception as e:
+        error_msg = f"Failed to generate document: {str(e)}"
+        logger.error(error_msg)
+        result = {
+            "success": False,
+            "error": error_msg,
+            "document": None
+        }
+        # 流式生成失败时保留已生成的部分内容
+        part_path = _partial_path(os.path.join(doc_dir, file_name))
+        if stream and os.path.exists(part_path):
+            result["partial_path"] = part_path
+        return result
 
 @mcp.tool("generate_document")
-async def create_document(title: str, template_type: str, description: str, file_name: str, project_path: str, additional_info: str = "", model: str = None, api_base_url: str = None, language: str = "en") -> list[types.TextContent]:
+async def create_document(title: str, template_type: str, description: str, file_name: str, project_path: str, additional_info: str = "", model: str = None, api_base_url: str = None, language: str = "en", use_cache: bool = True, stream: bool = False, resume: bool = False, parallel_sections: bool = False, update: bool = False, ctx: Context = None) -> list[types.TextContent]:
     """Generate product document
     
     Args:
         title: Document title
-        template_type: Document template type (requirement_doc/function_list/development_architecture/frontend_features/backend_features/database_design/server_api/api_dependencies/plugin_dependencies/development_plan/feature_document)
+        template_type: Document template type (requirement_doc/function_list/development_architecture/frontend_features/backend_features/database_design/server_api/api_dependencies/plugin_dependencies/development_plan/feature_document, or the name of a custom template)
         description: A simple description of the product or feature, AI will generate the document based on this description
         file_name: File name for generated document (without path, with extension)
         project_path: Project root directory path
         additional_info: Additional information or requirements (optional)
+        model: AI model name (optional, default to configured model)
+        api_base_url: API base URL (optional, default to configured URL)
         language: Document language (e.g., en, zh, ja, etc.)
+        use_cache: Reuse a cached result for an identical (or, with the similar cache enabled, very similar) request, set False to force regeneration
+        stream: Stream the document into doc/ while it is generated, sending progress notifications
+        resume: With stream, continue the partial file left by an interrupted generation instead of starting over
+        parallel_sections: Split the template at its top-level headings and generate all sections concurrently
+        update: If the document already exists with recorded section fingerprints, only regenerate the sections whose inputs changed
         
     Returns:
         List: List of TextContent objects containing the generated document
     """
-    logger.info(f"Received document generation request: {title} - {template_type}")
+    result = await _create_document(
+        title=title,
+        template_type=template_type,
+        description=description,
+        file_name=file_name,
+        project_path=project_path,
+        additional_info=additional_info,
+        model=model,
+        api_base_url=api_base_url,
+        language=language,
+        use_cache=use_cache,
+        stream=stream,
+        resume=resume,
+        parallel_sections=parallel_sections,
+        update=update,
+        ctx=ctx
+    )
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps(result, ensure_ascii=False)
+        )
+    ]
+
+@mcp.tool("submit_document_job")
+async def submit_document_job(title: str, template_type: str, description: str, file_name: str, project_path: str, additional_info: str = "", model: str = None, api_base_url: str = None, language: str = "en", use_cache: bool = True, parallel_sections: bool = False, update: bool = False) -> list[types.TextContent]:
+    """Queue a document generation in the background and return a job ID immediately
     
-    # Validate parameters
-    if not title or not template_type or not description:
-        error_msg = "Title, template type, and description cannot be empty"
+    Use this instead of generate_document for long documents that may exceed the client timeout,
+    then poll job_status and fetch the document information with job_result.
+    
+    Args:
+        title: Document title
+        template_type: Document template type, see generate_document
+        description: A simple description of the product or feature, AI will generate the document based on this description
+        file_name: File name for generated document (without path, with extension)
+        project_path: Project root directory path
+        additional_info: Additional information or requirements (optional)
+        model: AI model name (optional, default to configured model)
+        api_base_url: API base URL (optional, default to configured URL)
+        language: Document language (e.g., en, zh, ja, etc.)
+        use_cache: Reuse a cached result for an identical (or, with the similar cache enabled, very similar) request, set False to force regeneration
+        parallel_sections: Split the template at its top-level headings and generate all sections concurrently
+        update: If the document already exists with recorded section fingerprints, only regenerate the sections whose inputs changed
+        
+    Returns:
+        List: List of TextContent objects containing the queued job
+    """
+    if not project_path or not os.path.exists(project_path) or not project_allowed(project_path):
+        error_msg = f"Project path does not exist or is not allowed: {project_path}"
         logger.error(error_msg)
         return [
             types.TextContent(
@@ -118,56 +661,185 @@ async def create_document(title: str, template_type: str, description: str, file
                 text=json.dumps({
                     "success": False,
                     "error": error_msg,
-                    "document": None
+                    "job": None
                 }, ensure_ascii=False)
             )
         ]
     
-    # 验证project_path
-    if not project_path or not os.path.exists(project_path):
-        error_msg = f"Project path does not exist: {project_path}"
-        logger.error(error_msg)
+    try:
+        job = await job_queue.submit("document", project_path, {
+            "title": title,
+            "template_type": template_type,
+            "description": description,
+            "file_name": file_name,
+            "project_path": project_path,
+            "additional_info": additional_info,
+            "model": model,
+            "api_base_url": api_base_url,
+            "language": language,
+            "use_cache": use_cache,
+            "parallel_sections": parallel_sections,
+            "update": update
+        })
+    except JobQueueFull as e:
+        logger.error(str(e))
         return [
             types.TextContent(
                 type="text",
                 text=json.dumps({
                     "success": False,
-                    "error": error_msg,
-                    "document": None
+                    "error": str(e),
+                    "job": None
                 }, ensure_ascii=False)
             )
         ]
     
-    # Create save directory
-    doc_dir = os.path.join(project_path, DOC_SAVE_FOLDER)
-    if not os.path.exists(doc_dir):
-        os.makedirs(doc_dir)
-        logger.info(f"Created document save directory: {doc_dir}")
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({
+                "success": True,
+                "error": None,
+                "message": "The document job has been queued. Call job_status with the job ID to check its progress, and job_result to get the document once it has finished.",
+                "job": job_queue.summary(job)
+            }, ensure_ascii=False)
+        )
+    ]
+
+def _job_not_found(job_id: str) -> list[types.TextContent]:
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({
+                "success": False,
+                "error": f"Job not found: {job_id}",
+                "job": None
+            }, ensure_ascii=False)
+        )
+    ]
+
+@mcp.tool("job_status")
+async def job_status(job_id: str) -> list[types.TextContent]:
+    """Show the status of a background job (queued/running/cancelling/succeeded/failed/cancelled)
     
-    # Check file name
-    if not os.path.splitext(file_name)[1]:
-        file_name = f"{file_name}.md"
-        logger.info(f"File name does not have an extension, using default extension: {file_name}")
-    
-    # 获取模板类型对应的模板文件
-    template_map = {
-        # 新文档架构模板
-        "requirement_doc": "requirement_doc.md",
-        "function_list": "function_list.md",
-        "development_architecture": "development_architecture.md",
-        "frontend_features": "frontend_features.md",
-        "backend_features": "backend_features.md",
-        "database_design": "database_design.md",
-        "server_api": "server_api.md",
-        "api_dependencies": "api_dependencies.md",
-        "plugin_dependencies": "plugin_dependencies.md",
-        "development_plan": "development_plan.md",
-        "feature_document": "feature_document.md"
-    }
+    Args:
+        job_id: Job ID returned by submit_document_job
+        
+    Returns:
+        List: List of TextContent objects containing the job status
+    """
+    job = job_queue.get(job_id)
+    if not job:
+        return _job_not_found(job_id)
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({
+                "success": True,
+                "error": None,
+                "job": job_queue.summary(job)
+            }, ensure_ascii=False)
+        )
+    ]
+
+@mcp.tool("job_result")
+async def job_result(job_id: str) -> list[types.TextContent]:
+    """Get the result of a finished background job
+    
+    Args:
+        job_id: Job ID returned by submit_document_job
+        
+    Returns:
+        List: List of TextContent objects containing the job and the generate_document result
+    """
+    job = job_queue.get(job_id)
+    if not job:
+        return _job_not_found(job_id)
+    finished = job["status"] in FINISHED_STATES
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({
+                "success": finished,
+                "error": None if finished else f"Job is still {job['status']}, check again later",
+                "job": job_queue.summary(job),
+                "result": job["result"]
+            }, ensure_ascii=False)
+        )
+    ]
+
+@mcp.tool("cancel_job")
+async def cancel_job(job_id: str) -> list[types.TextContent]:
+    """Cancel a queued or running background job
+    
+    Args:
+        job_id: Job ID returned by submit_document_job
+        
+    Returns:
+        List: List of TextContent objects containing the job status
+    """
+    job = job_queue.cancel(job_id)
+    if not job:
+        return _job_not_found(job_id)
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({
+                "success": True,
+                "error": None,
+                "job": job_queue.summary(job)
+            }, ensure_ascii=False)
+        )
+    ]
+
+@mcp.tool("generate_document_set")
+async def create_document_set(title: str, description: str, project_path: str, template_types: list[str] | str = "all", additional_info: str = "", model: str = None, api_base_url: str = None, language: str = "en", use_cache: bool = True, max_workers: int = DOCUMENT_SET_WORKERS, pipeline: bool = False, parallel_sections: bool = False) -> list[types.TextContent]:
+    """Generate a set of product documents for one project concurrently
+    
+    In pipeline mode documents are generated in template dependency order
+    (e.g. server_api after requirement_doc and function_list), independent
+    documents still run in parallel and each document receives summaries of
+    the documents it depends on.
+    
+    Args:
+        title: Product or project name, used as the prefix of each document title
+        template_types: List of document template types, or "all" for every template
+        description: A simple description of the product or feature, AI will generate the documents based on this description
+        project_path: Project root directory path
+        additional_info: Additional information or requirements (optional)
+        model: AI model name (optional, default to configured model)
+        api_base_url: API base URL (optional, default to configured URL)
+        language: Document language (e.g., en, zh, ja, etc.)
+        use_cache: Reuse cached results for identical requests, set False to force regeneration
+        max_workers: Maximum number of documents generated at the same time
+        pipeline: Generate in dependency order, feeding upstream summaries into downstream documents
+        parallel_sections: Generate the top-level sections of each document concurrently
+        
+    Returns:
+        List: List of TextContent objects containing the per-document status summary
+    """
+    logger.info("Received document set generation request: %s - %s", title, template_types)
     
-    template_file = template_map.get(template_type)
-    if not template_file:
-        error_msg = f"Unsupported template type: {template_type}"
+    available = await asyncio.to_thread(template_registry.names)
+    if template_types == "all" or not template_types:
+        template_types = available
+    elif isinstance(template_types, str):
+        template_types = [t.strip() for t in template_types.split(",") if t.strip()]
+    template_types = list(dict.fromkeys(template_types))
+    
+    # Validate parameters
+    error_msg = None
+    if not title or not description:
+        error_msg = "Title and description cannot be empty"
+    elif not project_path or not os.path.exists(project_path):
+        error_msg = f"Project path does not exist: {project_path}"
+    elif not project_allowed(project_path):
+        error_msg = f"Project path is outside the allowed project roots: {project_path}"
+    else:
+        unsupported = [t for t in template_types if t not in available]
+        if unsupported:
+            error_msg = f"Unsupported template type: {', '.join(unsupported)}"
+    if error_msg:
         logger.error(error_msg)
         return [
             types.TextContent(
@@ -175,79 +847,233 @@ async def create_document(title: str, template_type: str, description: str, file
                 text=json.dumps({
                     "success": False,
                     "error": error_msg,
-                    "document": None
+                    "documents": None
                 }, ensure_ascii=False)
             )
         ]
     
-    template_path = os.path.join(TEMPLATES_DIR, template_file)
+    # Create save directory
+    doc_dir = os.path.join(project_path, DOC_SAVE_FOLDER)
+    os.makedirs(doc_dir, exist_ok=True)
     
-    try:
-        # Check if template file exists, create default template if not
-        if not os.path.exists(template_path):
-            logger.warning(f"Template file does not exist: {template_path}, using default template")
-            # Here you can add logic to create a default template based on template_type
-            # For simplicity, skipping this step for now
-            error_msg = f"Template file does not exist: {template_file}"
-            return [
-                types.TextContent(
-                    type="text",
-                    text=json.dumps({
+    settings = LLMSettings.from_env().override(model=model, api_base_url=api_base_url)
+    workers = asyncio.Semaphore(max(1, max_workers))
+    summary = {}
+    
+    async def generate_one(template_type: str, upstream: dict) -> str:
+        doc_title = f"{title} - {template_type.replace('_', ' ').title()}"
+        with trace("generate_document_set", template_type=template_type):
+            with span("template_load"):
+                template = await asyncio.to_thread(template_registry.get, template_type)
+            started = time.monotonic()
+            async with workers:
+                try:
+                    save_path, document_content = await _generate_and_save(
+                        title=doc_title,
+                        template_content=template.content,
+                        description=description,
+                        project_path=project_path,
+                        save_path=os.path.join(doc_dir, f"{template_type}.md"),
+                        additional_info=additional_info,
+                        language=language,
+                        settings=settings,
+                        use_cache=use_cache,
+                        upstream_context=build_upstream_context(upstream),
+                        depends_on=list(upstream),
+                        parallel_sections=parallel_sections,
+                        template_type=template_type
+                    )
+                    summary[template_type] = {
+                        "template_type": template_type,
+                        "success": True,
+                        "error": None,
+                        "path": save_path,
+                        "title": doc_title,
+                        "depends_on": list(upstream),
+                        "elapsed": round(time.monotonic() - started, 2)
+                    }
+                    return document_content
+                except Exception as e:
+                    logger.error("Failed to generate document %s: %s", template_type, e)
+                    summary[template_type] = {
+                        "template_type": template_type,
                         "success": False,
-                        "error": error_msg,
-                        "document": None
-                    }, ensure_ascii=False)
-                )
-            ]
-        
-        # 读取模板内容
-        with open(template_path, 'r', encoding='utf-8') as f:
-            template_content = f.read()
-        
-        # If provided model or API URL, update environment variables
-        if model:
-            os.environ["MODEL"] = model
-            logger.info(f"Using custom model: {model}")
-        
-        if api_base_url:
-            os.environ["API_URL"] = api_base_url
-            logger.info(f"Using custom API base URL: {api_base_url}")
-        
-        # 调用GPT服务生成文档
-        document_content = generate_document(
-            title=title,
-            template_content=template_content,
-            description=description,
-            additional_info=additional_info,
-            language=language
+                        "error": f"Failed to generate document: {str(e)}",
+                        "path": None,
+                        "title": doc_title,
+                        "depends_on": list(upstream),
+                        "elapsed": round(time.monotonic() - started, 2)
+                    }
+                    raise
+    
+    # 并发生成，每个文档完成后立即写入文件，用量记入项目的账本
+    with project_scope(project_path):
+        if pipeline:
+            # 不在本次生成范围内的上游文档，如果之前已经生成过，也作为上下文
+            external = {}
+            for template_type in template_types:
+                for dep in TEMPLATE_DEPENDENCIES.get(template_type, []):
+                    dep_path = os.path.join(doc_dir, f"{dep}.md")
+                    if dep not in template_types and dep not in external and os.path.exists(dep_path):
+                        external[dep] = await asyncio.to_thread(_read_file, dep_path)
+            outcomes = await run_pipeline(template_types, generate_one, external=external)
+        else:
+            outcomes = dict(zip(template_types, await asyncio.gather(*(generate_one(t, {}) for t in template_types), return_exceptions=True)))
+    # 在写入结果之前就失败的文档（例如模板在校验后被删除）也要出现在结果中
+    results = [summary.get(t, {
+        "template_type": t,
+        "success": False,
+        "error": f"Failed to generate document: {outcomes.get(t)}",
+        "path": None,
+        "title": f"{title} - {t.replace('_', ' ').title()}",
+        "depends_on": [],
+        "elapsed": None
+    }) for t in template_types]
+    succeeded = sum(1 for r in results if r["success"])
+    
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({
+                "success": succeeded == len(results),
+                "error": None if succeeded == len(results) else f"{len(results) - succeeded} of {len(results)} documents failed",
+                "message": f"I have created {succeeded} of {len(results)} document files. You don't need to create them again.",
+                "documents": results
+            }, ensure_ascii=False)
         )
+    ]
+
+@mcp.tool("list_templates")
+async def list_templates() -> list[types.TextContent]:
+    """List available document templates with their outline and prompt token count
+    
+    Returns:
+        List: List of TextContent objects containing the templates
+    """
+    templates = []
+    for template in await asyncio.to_thread(template_registry.templates):
+        templates.append({
+            "template_type": template.name,
+            "path": template.path,
+            "token_count": template.token_count,
+            "raw_token_count": template.raw_token_count,
+            "outline": template.outline
+        })
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({
+                "success": True,
+                "error": None,
+                "templates": templates
+            }, ensure_ascii=False)
+        )
+    ]
+
+@mcp.tool("cache_stats")
+async def cache_stats() -> list[types.TextContent]:
+    """Show hit/miss statistics and size of the generation result cache, hit rate and lookup latency of the similar request cache, how often concurrent identical requests were coalesced, and the upstream rate limit and endpoint health state
+    
+    Returns:
+        List: List of TextContent objects containing the cache statistics
+    """
+    stats = await asyncio.to_thread(response_cache.stats)
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({
+                "success": True,
+                "error": None,
+                "cache": stats,
+                "similar_cache": await asyncio.to_thread(similar_cache.stats),
+                "coalescing": inflight.stats(),
+                "rate_limits": limiter_stats(),
+                "endpoints": endpoint_stats()
+            }, ensure_ascii=False)
+        )
+    ]
+
+@mcp.tool("server_stats")
+async def server_stats() -> list[types.TextContent]:
+    """Show per-stage timings (template load, prompt build, queue, rate limit, first token, generation, file write), request/error/token/cache/retry counters per template type and model, and the most recent requests
+    
+    Returns:
+        List: List of TextContent objects containing the server statistics
+    """
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({
+                "success": True,
+                "error": None,
+                **metrics.stats(),
+                "jobs": job_queue.stats()
+            }, ensure_ascii=False)
+        )
+    ]
+
+@mcp.tool("token_usage")
+async def token_usage(project_path: str, days: int = PROJECT_BUDGET_DAYS) -> list[types.TextContent]:
+    """Show the token usage and cost recorded for a project, per model and per day, and how much of its token budget is left
+    
+    Args:
+        project_path: Project root directory path
+        days: Number of days to report, 0 for all recorded usage
         
-        # 保存文档
-        save_path = os.path.join(doc_dir, file_name)
-        with open(save_path, 'w', encoding='utf-8') as f:
-            f.write(document_content)
-        
-        logger.info(f"Document saved: {save_path}")
-        
-        # Return result
+    Returns:
+        List: List of TextContent objects containing the usage summary
+    """
+    if not project_path or not os.path.exists(project_path) or not project_allowed(project_path):
+        error_msg = f"Project path does not exist or is not allowed: {project_path}"
+        logger.error(error_msg)
         return [
             types.TextContent(
                 type="text",
                 text=json.dumps({
-                    "success": True,
-                    "error": None,
-                    "message": "I have created the document file. You don't need to create it again, but instead check if other documents need to be created and call the MCP service again.",
-                    "document": {
-                        "path": save_path,
-                        "title": title,
-                        "template_type": template_type
-                    }
+                    "success": False,
+                    "error": error_msg,
+                    "usage": None
                 }, ensure_ascii=False)
             )
         ]
+    
+    ledger = ledger_for(project_path)
+    usage = await asyncio.to_thread(ledger.summary, days)
+    budget = await asyncio.to_thread(budget_status, ledger)
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({
+                "success": True,
+                "error": None,
+                "usage": usage,
+                "budget": budget
+            }, ensure_ascii=False)
+        )
+    ]
+
+@mcp.tool("search_library")
+async def search_library(query: str, project_path: str, folder: str = "all", limit: int = 10, refresh: bool = False) -> list[types.TextContent]:
+    """Search the existing prompts and documents of a project (prompts/ and doc/) by title and content, ranked by BM25
+    
+    Args:
+        query: Search text, Chinese and English may be mixed
+        project_path: Project root directory path
+        folder: Folder to search, all, prompts or doc
+        limit: Maximum number of results
+        refresh: Rescan the folders even if they were scanned recently
         
-    except Exception as e:
-        error_msg = f"Failed to generate document: {str(e)}"
+    Returns:
+        List: List of TextContent objects containing the matching files and index statistics
+    """
+    error_msg = None
+    if not project_path or not os.path.exists(project_path) or not project_allowed(project_path):
+        error_msg = f"Project path does not exist or is not allowed: {project_path}"
+    elif folder != "all" and folder not in LIBRARY_FOLDERS:
+        error_msg = f"Unknown folder: {folder}, must be all, {' or '.join(LIBRARY_FOLDERS)}"
+    elif not query or not query.strip():
+        error_msg = "Query must not be empty"
+    if error_msg:
         logger.error(error_msg)
         return [
             types.TextContent(
@@ -255,15 +1081,34 @@ async def create_document(title: str, template_type: str, description: str, file
                 text=json.dumps({
                     "success": False,
                     "error": error_msg,
-                    "document": None
+                    "results": []
                 }, ensure_ascii=False)
             )
         ]
+    
+    with span("library_search"):
+        found = await asyncio.to_thread(library.search, project_path, query, max(1, limit), None if folder == "all" else folder, refresh)
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({
+                "success": True,
+                "error": None,
+                **found
+            }, ensure_ascii=False)
+        )
+    ]
 
 if __name__ == "__main__":
+    # 配置日志
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
     # Print current configuration
-    logger.info(f"Starting product document generation service...")
-    logger.info(f"API key status: {'Set' if API_KEY else 'Not set'}")
-    logger.info(f"Using model: {MODEL}")
-    logger.info(f"API base URL: {API_URL}")
-    mcp.run()
+    logger.info("Starting product document generation service...")
+    logger.info("API key status: %s", 'Set' if API_KEY else 'Not set')
+    logger.info("Using model: %s", MODEL)
+    logger.info("API base URL: %s", API_URL)
+    logger.info("Max concurrent generations: %s", os.environ.get('MAX_CONCURRENT_GENERATIONS', '4'))
+    run_server(mcp, lifespan)
@@ -0,0 +1,6 @@
+"""两个MCP服务共用的模块
+
+文档生成服务（doc-gen-server）和提示词生成服务（prompt_gen_server）都从这里导入
+客户端连接池、限流与故障转移、结果缓存、后台任务、指标、Token预算和检索等模块，
+各服务只保留自己的生成逻辑（proxy 包）。服务启动时把仓库根目录加入 sys.path。
+"""
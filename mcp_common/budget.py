@@ -0,0 +1,379 @@
+"""Token预算与用量记账模块
+
+发送请求前用本地tokenizer（tokens.py）估算输入token数，不必等一次往返才发现问题：
+- 单个请求的输入超过 MAX_INPUT_TOKENS 时，先压缩用户提供的可变输入（多余空白、重复的长行），
+  仍然超出时按调用方给出的顺序截断（文档的 additional_info、提示词的 rules 最先），
+  模板等固定部分本身就超出时直接拒绝。
+- 设置 PROJECT_TOKEN_BUDGET 后，项目最近 PROJECT_BUDGET_DAYS 天的用量加上本次请求的
+  估算输入超过预算时，拒绝发送请求。
+
+每次上游调用的实际用量（response.usage，缺失时使用估算值）按天和模型记入项目的用量账本
+.cursor-copilot/usage.json（两个服务共用），TOKEN_PRICES 配置了模型单价时同时记录费用。当前项目通过 contextvars
+在调用链中传递。
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from .tokens import estimate_tokens, truncate_tokens
+from .rate_limit import estimate_request_tokens
+from .metrics import metrics, cached_tokens
+from .settings import STATE_FOLDER
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 单个请求的输入token上限，0表示不限制
+MAX_INPUT_TOKENS = int(os.environ.get("MAX_INPUT_TOKENS", "32000"))
+# 每个项目在统计周期内的token预算（输入+输出），0表示不限制
+PROJECT_TOKEN_BUDGET = int(os.environ.get("PROJECT_TOKEN_BUDGET", "0"))
+# 项目预算的统计周期（天）
+PROJECT_BUDGET_DAYS = int(os.environ.get("PROJECT_BUDGET_DAYS", "30"))
+# 模型单价，JSON格式 {"模型名": [输入单价, 输出单价, 缓存输入单价]}，单位为每百万token，按最长前缀匹配模型名，
+# 缓存输入单价可以省略，省略时按输入单价计算
+TOKEN_PRICES = {}
+try:
+    TOKEN_PRICES = json.loads(os.environ.get("TOKEN_PRICES", "") or "{}")
+except ValueError as e:
+    # 配置错误时只是不记录费用，不影响服务启动
+    logger.warning("Ignoring invalid TOKEN_PRICES: %s", e)
+if not isinstance(TOKEN_PRICES, dict):
+    logger.warning("Ignoring invalid TOKEN_PRICES: expected a JSON object")
+    TOKEN_PRICES = {}
+
+# 用量账本，相对于项目根目录的路径
+USAGE_FILE = os.path.join(STATE_FOLDER, "usage.json")
+LEDGER_VERSION = 1
+# 账本保留的天数
+LEDGER_RETENTION_DAYS = 400
+
+# 只去掉较长的重复行，短行（如代码里的括号）本来就可能重复
+COMPRESS_MIN_DUPLICATE = 40
+# 截断时为截断说明预留的token数
+TRUNCATION_MARGIN = 32
+TRUNCATION_NOTE = "\n[... {tokens} tokens truncated to fit the input budget]"
+
+class BudgetExceeded(Exception):
+    """Raised before sending a request that does not fit a token budget"""
+
+def price(model: str, prompt_tokens: int, completion_tokens: int, cached: int = 0) -> float:
+    """Cost of a call from TOKEN_PRICES, None if the model has no configured price
+
+    cached of the prompt tokens were served from the provider's prompt cache
+    and are charged at the cached input price if one is configured.
+    """
+    matches = [name for name in TOKEN_PRICES if model == name or model.startswith(name)]
+    if not matches:
+        return None
+    prices = TOKEN_PRICES[max(matches, key=len)]
+    input_price, output_price = prices[0], prices[1]
+    cached_price = prices[2] if len(prices) > 2 else input_price
+    return ((prompt_tokens - cached) * input_price + cached * cached_price + completion_tokens * output_price) / 1_000_000
+
+def _day(offset_days: int = 0) -> str:
+    return time.strftime("%Y-%m-%d", time.localtime(time.time() - offset_days * 86400))
+
+def _empty_totals() -> dict:
+    return {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "estimated_requests": 0, "cost": 0.0}
+
+def _add(totals: dict, entry: dict) -> None:
+    for name in ("requests", "prompt_tokens", "completion_tokens", "cached_tokens", "estimated_requests"):
+        totals[name] += entry.get(name, 0)
+    totals["cost"] = round(totals["cost"] + entry.get("cost", 0.0), 6)
+
+class UsageLedger:
+    """Token usage and cost of one project, aggregated per day and model in a JSON file
+
+    The parsed file is kept in memory and only read again when its modification
+    time or size changes, so budget checks do not parse the file on every call
+    while updates from other server processes working on the same project are
+    still picked up before each write.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Path of the ledger file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = None
+        # 读取时文件的 (mtime_ns, size)
+        self._stamp = None
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self) -> dict:
+        """Return the ledger, re-reading the file only if it changed (called with lock held)"""
+        stamp = self._stat()
+        if self._data is not None and stamp == self._stamp:
+            return self._data
+        data = None
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            pass
+        if not isinstance(data, dict) or data.get("version") != LEDGER_VERSION:
+            data = {"version": LEDGER_VERSION, "days": {}}
+        self._data = data
+        self._stamp = stamp
+        return data
+
+    def record(self, model: str, prompt_tokens: int, completion_tokens: int, estimated: bool = False, cached: int = 0) -> None:
+        """Add the usage of one upstream call
+
+        Args:
+            model: Model name
+            prompt_tokens: Input tokens
+            completion_tokens: Output tokens
+            estimated: Whether the counts are estimates because the provider reported no usage
+            cached: Input tokens served from the provider's prompt cache
+        """
+        cost = price(model, prompt_tokens, completion_tokens, cached)
+        with self._lock:
+            data = self._load()
+            days = data["days"]
+            entry = days.setdefault(_day(), {}).setdefault(model, _empty_totals())
+            entry["requests"] += 1
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["cached_tokens"] = entry.get("cached_tokens", 0) + cached
+            entry["estimated_requests"] += int(estimated)
+            if cost is not None:
+                entry["cost"] = round(entry["cost"] + cost, 6)
+            oldest = _day(LEDGER_RETENTION_DAYS)
+            for day in [day for day in days if day < oldest]:
+                del days[day]
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+            self._stamp = self._stat()
+
+    def summary(self, days: int = PROJECT_BUDGET_DAYS) -> dict:
+        """Usage of the last days days, 0 for everything recorded
+
+        Returns:
+            dict: Totals, and the same totals per model and per day
+        """
+        first = _day(days - 1) if days > 0 else ""
+        total = _empty_totals()
+        by_model = {}
+        by_day = {}
+        with self._lock:
+            recorded = self._load()["days"]
+        for day, models in sorted(recorded.items()):
+            if day < first:
+                continue
+            for model, entry in models.items():
+                _add(total, entry)
+                _add(by_model.setdefault(model, _empty_totals()), entry)
+                _add(by_day.setdefault(day, _empty_totals()), entry)
+        for totals in [total, *by_model.values(), *by_day.values()]:
+            totals["total_tokens"] = totals["prompt_tokens"] + totals["completion_tokens"]
+            # 输入token中命中服务商提示词缓存的比例
+            totals["cached_ratio"] = round(totals["cached_tokens"] / totals["prompt_tokens"], 4) if totals["prompt_tokens"] else 0.0
+        return {"days": days, "total": total, "by_model": by_model, "by_day": by_day}
+
+    def spent(self, days: int = PROJECT_BUDGET_DAYS) -> int:
+        """Input and output tokens used in the last days days"""
+        return self.summary(days)["total"]["total_tokens"]
+
+_ledgers = {}
+_ledgers_lock = threading.Lock()
+
+def ledger_for(project_path: str) -> UsageLedger:
+    """The shared ledger of a project"""
+    path = os.path.join(os.path.realpath(project_path), USAGE_FILE)
+    with _ledgers_lock:
+        ledger = _ledgers.get(path)
+        if ledger is None:
+            ledger = _ledgers[path] = UsageLedger(path)
+        return ledger
+
+def budget_status(ledger: UsageLedger) -> dict:
+    """Configured limits and how much of the project budget is left"""
+    status = {
+        "max_input_tokens": MAX_INPUT_TOKENS,
+        "project_token_budget": PROJECT_TOKEN_BUDGET,
+        "window_days": PROJECT_BUDGET_DAYS
+    }
+    if PROJECT_TOKEN_BUDGET > 0:
+        spent = ledger.spent()
+        status["spent"] = spent
+        status["remaining"] = max(0, PROJECT_TOKEN_BUDGET - spent)
+    return status
+
+class BudgetScope:
+    """Project a tool call charges its usage to, and how its inputs were shortened"""
+
+    def __init__(self, ledger: UsageLedger):
+        self.ledger = ledger
+        # 字段名 -> compressed / truncated
+        self.adjustments = {}
+
+_scope = contextvars.ContextVar("budget_scope", default=None)
+
+@contextmanager
+def project_scope(project_path: str):
+    """Charge upstream calls made inside the block, including from tasks started in it, to a project"""
+    scope = BudgetScope(ledger_for(project_path))
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+
+def budgeted(project_arg: str = "project_path"):
+    """Decorator running an async tool function inside the scope of its project
+
+    A returned dict gets an input_adjustments entry when inputs had to be shortened.
+
+    Args:
+        project_arg: Keyword argument holding the project root directory
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            project_path = kwargs.get(project_arg)
+            if not project_path:
+                return await fn(*args, **kwargs)
+            with project_scope(project_path) as scope:
+                result = await fn(*args, **kwargs)
+            if isinstance(result, dict) and scope.adjustments:
+                result["input_adjustments"] = scope.adjustments
+            return result
+        return wrapper
+    return decorator
+
+def compress_text(text: str) -> str:
+    """Drop redundant whitespace and repeated long lines, which cost tokens without adding information"""
+    lines = []
+    seen = set()
+    for line in text.splitlines():
+        indent = line[:len(line) - len(line.lstrip())]
+        line = indent + re.sub(r"[ \t]{2,}", " ", line.strip())
+        if not line.strip():
+            if lines and not lines[-1]:
+                continue
+            line = ""
+        elif len(line) >= COMPRESS_MIN_DUPLICATE:
+            if line in seen:
+                continue
+            seen.add(line)
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+def fit_messages(build, shrink_order: tuple, limit: int = MAX_INPUT_TOKENS, **fields) -> list:
+    """Build chat messages, shortening user inputs that push them over the input token limit
+
+    The fields in shrink_order are first compressed, then truncated one after
+    another, the first field first, until the estimated input fits.
+
+    Args:
+        build: Message builder called as build(**fields)
+        shrink_order: Names of the user-provided fields that may be shortened
+        limit: Input token limit, 0 for no limit
+        **fields: Arguments of build
+
+    Returns:
+        list: Chat completion messages within limit
+
+    Raises:
+        BudgetExceeded: The prompt does not fit even with the fields shortened
+    """
+    messages = build(**fields)
+    tokens = estimate_request_tokens(messages, 0)
+    if limit <= 0 or tokens <= limit:
+        return messages
+    original = tokens
+    adjustments = {}
+    for name in shrink_order:
+        text = fields.get(name) or ""
+        compressed = compress_text(text)
+        if compressed != text:
+            fields[name] = compressed
+            adjustments[name] = "compressed"
+    messages = build(**fields)
+    tokens = estimate_request_tokens(messages, 0)
+    for name in shrink_order:
+        text = fields.get(name) or ""
+        if tokens <= limit:
+            break
+        if not text:
+            continue
+        size = estimate_tokens(text)
+        keep = max(0, size - (tokens - limit) - TRUNCATION_MARGIN)
+        fields[name] = truncate_tokens(text, keep) + TRUNCATION_NOTE.format(tokens=size - keep) if keep else ""
+        adjustments[name] = "truncated"
+        messages = build(**fields)
+        tokens = estimate_request_tokens(messages, 0)
+    if tokens > limit:
+        metrics.count("budget_rejections")
+        raise BudgetExceeded(f"The prompt needs about {tokens} input tokens even with {', '.join(shrink_order)} shortened, MAX_INPUT_TOKENS is {limit}")
+    logger.warning("Prompt input shortened from %s to %s tokens: %s", original, tokens, adjustments)
+    metrics.count("inputs_shortened")
+    scope = _scope.get()
+    if scope is not None:
+        for name, kind in adjustments.items():
+            if scope.adjustments.get(name) != "truncated":
+                scope.adjustments[name] = kind
+    return messages
+
+def check_budget(estimated_input: int) -> None:
+    """Refuse a request that would take the current project over PROJECT_TOKEN_BUDGET
+
+    Checks whether the ledger file changed, call it through asyncio.to_thread from async code.
+
+    Args:
+        estimated_input: Estimated input tokens of the request
+
+    Raises:
+        BudgetExceeded: The project has used up its budget
+    """
+    scope = _scope.get()
+    if scope is None or PROJECT_TOKEN_BUDGET <= 0:
+        return
+    spent = scope.ledger.spent()
+    if spent + estimated_input > PROJECT_TOKEN_BUDGET:
+        metrics.count("budget_rejections")
+        raise BudgetExceeded(f"Project token budget exceeded: {spent} of {PROJECT_TOKEN_BUDGET} tokens used in the last {PROJECT_BUDGET_DAYS} days, this request needs about {estimated_input} more")
+
+def charge(usage, model: str, estimated_in: int = 0, estimated_out: int = 0) -> None:
+    """Record the usage of an upstream call in the current project's ledger
+
+    Writes the ledger, call it through asyncio.to_thread from async code.
+
+    Args:
+        usage: response.usage, None if the provider did not report it
+        model: Model the request was sent to
+        estimated_in: Estimated prompt tokens, used when usage is missing
+        estimated_out: Estimated output tokens, used when usage is missing
+    """
+    scope = _scope.get()
+    if scope is None:
+        return
+    if usage is not None:
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        cached = cached_tokens(usage)
+    else:
+        prompt_tokens, completion_tokens, cached = estimated_in, estimated_out, 0
+    try:
+        scope.ledger.record(model, prompt_tokens, completion_tokens, estimated=usage is None, cached=cached)
+    except OSError as e:
+        logger.warning("Failed to record token usage in %s: %s", scope.ledger.path, e)
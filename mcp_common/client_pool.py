@@ -0,0 +1,120 @@
+"""LLM客户端连接池模块
+
+按 (api_url, api_key) 缓存长期存活的OpenAI客户端，复用keep-alive连接，
+避免每次请求都重新建立连接池、TLS握手和DNS解析。
+OpenAI SDK 在第一次创建客户端时才导入，服务启动和MCP握手不需要加载它。
+"""
+
+import os
+import asyncio
+import logging
+import threading
+from typing import TYPE_CHECKING
+from contextlib import asynccontextmanager
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+# 连接池配置
+POOL_MAX_CONNECTIONS = int(os.environ.get("LLM_POOL_MAX_CONNECTIONS", "20"))
+POOL_MAX_KEEPALIVE = int(os.environ.get("LLM_POOL_MAX_KEEPALIVE", "10"))
+POOL_KEEPALIVE_EXPIRY = float(os.environ.get("LLM_POOL_KEEPALIVE_EXPIRY", "60"))
+CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", "10"))
+REQUEST_TIMEOUT = float(os.environ.get("LLM_REQUEST_TIMEOUT", "300"))
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_async_clients = {}
+# 正在后台关闭的客户端任务，保留引用避免被回收
+_closing = set()
+
+def _limits():
+    import httpx
+    return httpx.Limits(
+        max_connections=POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=POOL_MAX_KEEPALIVE,
+        keepalive_expiry=POOL_KEEPALIVE_EXPIRY
+    )
+
+def _timeout():
+    import httpx
+    return httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT)
+
+async def _aclose(client) -> None:
+    try:
+        await client.close()
+    except Exception as e:
+        logger.warning("Failed to close async client: %s", e)
+
+def _discard(loop, client) -> None:
+    """Close a pooled client created in another event loop without blocking
+
+    The client is closed on its own loop while that loop is running, otherwise
+    in the background on the running loop. A client whose loop is already
+    closed is dropped, its connections closed with the loop.
+    """
+    if loop.is_closed():
+        return
+    if loop.is_running():
+        asyncio.run_coroutine_threadsafe(_aclose(client), loop)
+        return
+    task = asyncio.get_running_loop().create_task(_aclose(client))
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+def get_async_client(api_url: str, api_key: str) -> "AsyncOpenAI":
+    """Get the shared asynchronous client for an endpoint
+
+    Async connection pools are bound to the event loop that created them, so a
+    client is rebuilt when called from a different loop and the old one closed.
+
+    Args:
+        api_url: API base URL
+        api_key: API key
+
+    Returns:
+        AsyncOpenAI: Client reusing a pooled HTTP connection
+    """
+    key = (api_url, api_key)
+    loop = asyncio.get_running_loop()
+    with _lock:
+        entry = _async_clients.get(key)
+        if entry is None or entry[0] is not loop:
+            if entry is not None:
+                # 旧客户端的连接属于另一个事件循环，关闭它以免连接泄漏
+                _discard(*entry)
+            import httpx
+            from openai import AsyncOpenAI
+            client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=api_url,
+                timeout=_timeout(),
+                # 重试由 rate_limit 统一处理，避免与客户端自带的重试叠加
+                max_retries=0,
+                http_client=httpx.AsyncClient(limits=_limits(), timeout=_timeout())
+            )
+            _async_clients[key] = (loop, client)
+            logger.info("Created pooled async client for %s", api_url)
+            return client
+        return entry[1]
+
+async def aclose_clients() -> None:
+    """Close all pooled clients, those of other event loops on their own loop"""
+    with _lock:
+        entries = list(_async_clients.values())
+        _async_clients.clear()
+    for loop, client in entries:
+        if loop is not asyncio.get_running_loop():
+            _discard(loop, client)
+            continue
+        await _aclose(client)
+
+@asynccontextmanager
+async def pool_lifespan(server):
+    """Server lifespan that closes pooled clients on shutdown"""
+    try:
+        yield {}
+    finally:
+        await aclose_clients()
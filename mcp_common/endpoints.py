@@ -0,0 +1,301 @@
+"""多端点故障转移模块
+
+配置了多个API端点（API_ENDPOINTS）时：
+- 记录每个端点的健康状况，连续失败达到阈值后熔断，一段时间后放行一个探测请求
+- 按配置顺序或权重选择端点，请求失败时转移到下一个端点
+- 可选的对冲请求（只用于流式请求）：主端点在 HEDGE_DELAY 秒内没有返回第一个token时，
+  向下一个端点发出相同的请求，采用先返回的结果，取消另一个
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+
+from .settings import LLMSettings
+from .rate_limit import acall_with_limits, astream_with_limits, is_retryable, MAX_RETRIES
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 端点选择策略：ordered（按顺序）/ weighted（按权重随机）
+ENDPOINT_STRATEGY = os.environ.get("ENDPOINT_STRATEGY", "ordered").lower()
+# 等待第一个token超过该时间（秒）后向下一个端点发出对冲请求，0表示不对冲
+HEDGE_DELAY = float(os.environ.get("HEDGE_DELAY", "0"))
+# 连续失败多少次后熔断，熔断多久（秒）后放行探测请求
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "3"))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get("CIRCUIT_RESET_TIMEOUT", "30"))
+# 还有备用端点时，每个端点的重试次数
+FAILOVER_RETRIES = int(os.environ.get("FAILOVER_RETRIES", "1"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# 说明端点本身不可用（而不是请求有问题）的状态码
+ENDPOINT_ERROR_STATUS = (401, 403, 404)
+
+_END = object()
+
+def should_fail_over(error: Exception) -> bool:
+    """Whether another endpoint may succeed where this one failed"""
+    if is_retryable(error):
+        return True
+    import openai
+    return isinstance(error, openai.APIStatusError) and error.status_code in ENDPOINT_ERROR_STATUS
+
+class EndpointHealth:
+    """Health and circuit breaker state of one endpoint"""
+
+    def __init__(self, api_url: str):
+        self.api_url = api_url
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.latency = None
+        self.stats = {"successes": 0, "failures": 0, "hedges": 0, "hedge_wins": 0}
+
+    def available(self, now: float) -> bool:
+        """Whether a request may be sent, moves an expired open circuit to half-open"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and now - self.opened_at >= CIRCUIT_RESET_TIMEOUT:
+            self.state = HALF_OPEN
+            self.probing = False
+        return self.state == HALF_OPEN and not self.probing
+
+    def record_success(self, latency: float) -> None:
+        self.stats["successes"] += 1
+        self.consecutive_failures = 0
+        self.probing = False
+        if self.state != CLOSED:
+            logger.info("Endpoint %s recovered", self.api_url)
+        self.state = CLOSED
+        # 首token延迟的指数滑动平均
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+
+    def record_failure(self, now: float) -> None:
+        self.stats["failures"] += 1
+        self.consecutive_failures += 1
+        self.probing = False
+        if self.state == HALF_OPEN or self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD:
+            if self.state != OPEN:
+                logger.warning("Circuit opened for endpoint %s after %s failures", self.api_url, self.consecutive_failures)
+            self.state = OPEN
+            self.opened_at = now
+
+    def record_abandoned(self) -> None:
+        """The request was cancelled, e.g. it lost a hedge"""
+        self.probing = False
+
+    def info(self) -> dict:
+        return {
+            **self.stats,
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "latency": round(self.latency, 3) if self.latency is not None else None
+        }
+
+_health = {}
+_health_lock = threading.Lock()
+
+def _health_for(api_url: str) -> EndpointHealth:
+    """Health of an endpoint, must hold _health_lock"""
+    health = _health.get(api_url)
+    if health is None:
+        health = _health[api_url] = EndpointHealth(api_url)
+    return health
+
+def endpoint_stats() -> dict:
+    """Health of all endpoints that have been used"""
+    with _health_lock:
+        return {api_url: health.info() for api_url, health in _health.items()}
+
+def select_endpoints(settings: LLMSettings) -> list:
+    """Endpoints to try for a request, in order
+
+    Endpoints with an open circuit are skipped; if every circuit is open the
+    endpoints are tried anyway rather than failing without a request.
+    """
+    endpoints = settings.endpoints()
+    if len(endpoints) == 1:
+        return endpoints
+    if ENDPOINT_STRATEGY == "weighted":
+        # 按权重随机排序（权重越大越可能排在前面）
+        endpoints.sort(key=lambda e: random.random() ** (1.0 / max(e.weight, 1e-6)), reverse=True)
+    now = time.monotonic()
+    with _health_lock:
+        available = []
+        for endpoint in endpoints:
+            if _health_for(endpoint.api_url).available(now):
+                available.append(endpoint)
+    if not available:
+        logger.warning("All endpoints have an open circuit, trying them anyway")
+        return endpoints
+    return available
+
+def _retries(endpoints: list, index: int) -> int:
+    return FAILOVER_RETRIES if index < len(endpoints) - 1 else MAX_RETRIES
+
+def _record_attempt(endpoint: LLMSettings) -> float:
+    """Mark a half-open endpoint as being probed, returns the start time"""
+    with _health_lock:
+        health = _health_for(endpoint.api_url)
+        if health.state == HALF_OPEN:
+            health.probing = True
+    return time.monotonic()
+
+def _record_success(endpoint: LLMSettings, started: float) -> None:
+    with _health_lock:
+        _health_for(endpoint.api_url).record_success(time.monotonic() - started)
+
+def _record_failure(endpoint: LLMSettings) -> None:
+    with _health_lock:
+        _health_for(endpoint.api_url).record_failure(time.monotonic())
+
+def _record_abandoned(endpoint: LLMSettings) -> None:
+    with _health_lock:
+        _health_for(endpoint.api_url).record_abandoned()
+
+def _record_outcome(endpoint: LLMSettings, error: Exception) -> None:
+    """Count a failed request against the endpoint only if the endpoint is to blame
+
+    Errors caused by the request itself (e.g. 400 for an oversized prompt)
+    would fail on every endpoint and must not open the circuit of a healthy one.
+    """
+    if should_fail_over(error):
+        _record_failure(endpoint)
+    else:
+        _record_abandoned(endpoint)
+
+def _count(endpoint: LLMSettings, name: str) -> None:
+    with _health_lock:
+        _health_for(endpoint.api_url).stats[name] += 1
+
+async def acall_with_failover(settings: LLMSettings, tokens: int, create):
+    """Make a request, failing over to the next endpoint when one is unavailable
+
+    Non-streamed requests are not hedged: there is no first token to tell a
+    slow endpoint from a long answer, so a hedge would only pay for the same
+    completion twice. Callers that want hedging use astream_with_failover.
+
+    Args:
+        settings: Request settings including the fallback endpoints
+        tokens: Estimated tokens the request consumes
+        create: Function create(endpoint) returning an awaitable making one request to an endpoint
+
+    Returns:
+        tuple: (response, endpoint) of the first endpoint that succeeded
+    """
+    endpoints = select_endpoints(settings)
+    for i, endpoint in enumerate(endpoints):
+        started = _record_attempt(endpoint)
+        try:
+            response = await acall_with_limits(endpoint.api_url, tokens, lambda: create(endpoint), _retries(endpoints, i))
+        except Exception as e:
+            _record_outcome(endpoint, e)
+            if i == len(endpoints) - 1 or not should_fail_over(e):
+                raise
+            logger.warning("Endpoint %s failed (%s), failing over to %s", endpoint.api_url, e, endpoints[i + 1].api_url)
+            continue
+        except BaseException:
+            _record_abandoned(endpoint)
+            raise
+        _record_success(endpoint, started)
+        return response, endpoint
+
+async def astream_with_failover(settings: LLMSettings, tokens: int, create):
+    """Stream chunks from the first endpoint that produces a token
+
+    Endpoints are failed over until one produces its first chunk; with
+    HEDGE_DELAY set, the next endpoint is also tried when the first chunk is
+    late. Errors after the first chunk are raised.
+
+    Args:
+        settings: Request settings including the fallback endpoints
+        tokens: Estimated tokens the request consumes
+        create: Function create(endpoint) returning an awaitable stream
+
+    Yields:
+        tuple: (chunk, endpoint) for the stream chunks of the winning endpoint
+    """
+    chunks = _ahedged(settings, tokens, create)
+    try:
+        async for chunk, endpoint in chunks:
+            yield chunk, endpoint
+    finally:
+        # 调用方提前结束（如请求被取消）时立即取消上游请求，而不是等到垃圾回收
+        await chunks.aclose()
+
+async def _ahedged(settings: LLMSettings, tokens: int, create):
+    endpoints = select_endpoints(settings)
+    events = asyncio.Queue()
+    attempts = {}
+
+    async def attempt(index: int) -> None:
+        endpoint = endpoints[index]
+        retries = _retries(endpoints, index)
+        try:
+            async with astream_with_limits(endpoint.api_url, tokens, lambda: create(endpoint), retries) as chunks:
+                async for chunk in chunks:
+                    await events.put((index, chunk))
+            await events.put((index, _END))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await events.put((index, e))
+
+    def launch(index: int) -> None:
+        attempts[index] = (asyncio.ensure_future(attempt(index)), _record_attempt(endpoints[index]))
+
+    launch(0)
+    next_index = 1
+    winner = None
+    try:
+        while True:
+            hedge = winner is None and HEDGE_DELAY > 0 and next_index < len(endpoints)
+            try:
+                index, item = await asyncio.wait_for(events.get(), HEDGE_DELAY) if hedge else await events.get()
+            except asyncio.TimeoutError:
+                logger.info("No first token from %s after %ss, hedging with %s", endpoints[next_index - 1].api_url, HEDGE_DELAY, endpoints[next_index].api_url)
+                _count(endpoints[next_index], "hedges")
+                launch(next_index)
+                next_index += 1
+                continue
+
+            if winner is not None and index != winner:
+                continue
+            if isinstance(item, Exception):
+                _record_outcome(endpoints[index], item)
+                if index == winner:
+                    raise item
+                attempts.pop(index)
+                if attempts:
+                    continue
+                if next_index >= len(endpoints) or not should_fail_over(item):
+                    raise item
+                logger.warning("Endpoint %s failed (%s), failing over to %s", endpoints[index].api_url, item, endpoints[next_index].api_url)
+                launch(next_index)
+                next_index += 1
+                continue
+
+            if winner is None:
+                # 第一个返回结果的端点胜出，取消其他请求
+                winner = index
+                _record_success(endpoints[index], attempts[index][1])
+                if index > 0 and len(attempts) > 1:
+                    _count(endpoints[index], "hedge_wins")
+                for other, (task, _) in list(attempts.items()):
+                    if other != index:
+                        task.cancel()
+                        _record_abandoned(endpoints[other])
+                        attempts.pop(other)
+            if item is _END:
+                return
+            yield item, endpoints[index]
+    finally:
+        for task, _ in attempts.values():
+            task.cancel()
@@ -0,0 +1,334 @@
+"""后台任务队列模块
+
+长时间的生成任务提交后立即返回任务ID，由固定数量的后台worker执行，
+调用方通过任务ID查询状态、获取结果或取消任务。
+
+任务状态保存在项目目录下（每个任务一个JSON文件），服务重启后
+未完成的任务会重新排队。不同项目的任务轮流执行，一个项目提交大量
+任务不会让其他项目一直等待。
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from collections import deque
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 同时执行的后台任务数
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+# 每个项目最多排队的任务数
+JOB_MAX_QUEUED = int(os.environ.get("JOB_MAX_QUEUED", "100"))
+# 已结束任务的保留时间（秒）
+JOB_RETENTION = float(os.environ.get("JOB_RETENTION", str(7 * 24 * 3600)))
+
+QUEUED = "queued"
+RUNNING = "running"
+# 已请求取消、等待执行该任务的worker结束
+CANCELLING = "cancelling"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+class JobQueueFull(Exception):
+    """Raised when a project already has the maximum number of queued jobs"""
+
+def _write_json(path: str, data: dict) -> None:
+    """Write a JSON file atomically"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def _read_json(path: str):
+    """Read a JSON file, None if missing or unreadable"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+class JobQueue:
+    """Bounded background worker pool with persisted jobs and round-robin scheduling across projects"""
+
+    def __init__(self, name: str, state_folder: str, runners: dict, workers: int = JOB_WORKERS, max_queued: int = JOB_MAX_QUEUED, retention: float = JOB_RETENTION, registry_dir: str = None):
+        """
+        Args:
+            name: Service name, used for the default registry directory
+            state_folder: Folder inside each project where job files are kept
+            runners: Maps a job kind to a coroutine function taking the job parameters and returning a result dict
+            workers: Number of jobs executed at the same time
+            max_queued: Maximum number of queued jobs per project
+            retention: Seconds finished jobs are kept before they are pruned
+            registry_dir: Directory of the file listing projects with jobs (default ~/.cache/<name>)
+        """
+        self.state_folder = state_folder
+        self.runners = runners
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.retention = retention
+        registry_dir = registry_dir or os.environ.get("JOB_STATE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", name)
+        self.registry_path = os.path.join(registry_dir, f"{name}-job-projects.json")
+        self._jobs = {}
+        self._pending = {}
+        self._running = {}
+        # 各项目最近一次被调度的序号，用于轮流调度
+        self._served = {}
+        self._tick = 0
+        self._workers = []
+        self._wakeup = None
+        self._loop = None
+        self._stopping = False
+
+    # ---- 持久化 ----
+
+    def _jobs_dir(self, project_path: str) -> str:
+        return os.path.join(project_path, self.state_folder)
+
+    def _job_path(self, job: dict) -> str:
+        return os.path.join(self._jobs_dir(job["project_path"]), f"{job['id']}.json")
+
+    def _save(self, job: dict) -> None:
+        try:
+            os.makedirs(self._jobs_dir(job["project_path"]), exist_ok=True)
+            _write_json(self._job_path(job), job)
+        except OSError as e:
+            logger.error("Failed to save job %s: %s", job['id'], e)
+
+    def _register_project(self, project_path: str) -> None:
+        projects = _read_json(self.registry_path) or []
+        if project_path in projects:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.registry_path), exist_ok=True)
+            _write_json(self.registry_path, projects + [project_path])
+        except OSError as e:
+            logger.error("Failed to update job registry: %s", e)
+
+    def _restore(self) -> list:
+        """Load persisted jobs of all registered projects, returns unfinished jobs in submission order"""
+        now = time.time()
+        projects = []
+        unfinished = []
+        for project_path in _read_json(self.registry_path) or []:
+            jobs_dir = self._jobs_dir(project_path)
+            if not os.path.isdir(jobs_dir):
+                continue
+            projects.append(project_path)
+            try:
+                entries = list(os.scandir(jobs_dir))
+            except OSError as e:
+                logger.error("Failed to list jobs in %s: %s", jobs_dir, e)
+                continue
+            for entry in entries:
+                if not entry.name.endswith(".json"):
+                    continue
+                job = _read_json(entry.path)
+                if not isinstance(job, dict) or "id" not in job or "status" not in job:
+                    logger.warning("Skipping unreadable job file %s", entry.path)
+                    continue
+                if job["status"] in FINISHED_STATES:
+                    if now - (job.get("finished_at") or now) > self.retention:
+                        try:
+                            os.remove(entry.path)
+                        except OSError as e:
+                            logger.warning("Failed to remove expired job %s: %s", entry.path, e)
+                        continue
+                else:
+                    unfinished.append(job)
+                self._jobs[job["id"]] = job
+        # 清理已经没有任务的项目
+        try:
+            os.makedirs(os.path.dirname(self.registry_path), exist_ok=True)
+            _write_json(self.registry_path, projects)
+        except OSError as e:
+            logger.error("Failed to update job registry: %s", e)
+        return sorted(unfinished, key=lambda job: job.get("created_at") or 0)
+
+    # ---- 调度 ----
+
+    def _enqueue(self, job: dict) -> None:
+        self._pending.setdefault(job["project_path"], deque()).append(job["id"])
+
+    def _next_job(self) -> dict:
+        """Take the next queued job from the project that was served least recently"""
+        while self._pending:
+            project_path = min(self._pending, key=lambda path: self._served.get(path, 0))
+            queue = self._pending[project_path]
+            job_id = queue.popleft()
+            if not queue:
+                del self._pending[project_path]
+            job = self._jobs.get(job_id)
+            if job and job["status"] == QUEUED:
+                self._tick += 1
+                self._served[project_path] = self._tick
+                return job
+        return None
+
+    async def start(self) -> None:
+        """Restore persisted jobs and start the workers in the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._workers:
+            return
+        self._loop = loop
+        self._stopping = False
+        self._wakeup = asyncio.Condition()
+        self._pending.clear()
+        for job in await asyncio.to_thread(self._restore):
+            if job["status"] == CANCELLING:
+                # 取消请求在服务停止前没有完成，不再执行
+                job["status"] = CANCELLED
+                job["finished_at"] = time.time()
+                await asyncio.to_thread(self._save, job)
+                continue
+            if job["status"] == RUNNING:
+                logger.info("Requeueing job %s interrupted by a restart", job['id'])
+                job["status"] = QUEUED
+                job["started_at"] = None
+            self._enqueue(job)
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        logger.info("Started %s job workers, %s jobs queued", self.workers, sum(len(q) for q in self._pending.values()))
+
+    async def stop(self) -> None:
+        """Stop the workers, running jobs stay persisted as running and are requeued on the next start"""
+        self._stopping = True
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _worker(self) -> None:
+        while True:
+            async with self._wakeup:
+                job = self._next_job()
+                while job is None:
+                    await self._wakeup.wait()
+                    job = self._next_job()
+            await self._run(job)
+
+    async def _run(self, job: dict) -> None:
+        job["status"] = RUNNING
+        job["started_at"] = time.time()
+        await asyncio.to_thread(self._save, job)
+        logger.info("Running job %s (%s) for %s", job['id'], job['kind'], job['project_path'])
+
+        task = asyncio.ensure_future(self.runners[job["kind"]](**job["params"]))
+        self._running[job["id"]] = task
+        try:
+            result = await task
+            job["result"] = result
+            if result.get("success", True):
+                job["status"] = SUCCEEDED
+            else:
+                job["status"] = FAILED
+                job["error"] = result.get("error")
+        except asyncio.CancelledError:
+            if self._stopping:
+                # 服务停止，保持running状态，下次启动时重新排队
+                task.cancel()
+                raise
+            job["status"] = CANCELLED
+        except Exception as e:
+            logger.error("Job %s failed: %s", job['id'], e)
+            job["status"] = FAILED
+            job["error"] = str(e)
+        finally:
+            self._running.pop(job["id"], None)
+        job["finished_at"] = time.time()
+        await asyncio.to_thread(self._save, job)
+        logger.info("Job %s %s in %.1fs", job['id'], job['status'], job['finished_at'] - job['started_at'])
+
+    # ---- 对外接口 ----
+
+    async def submit(self, kind: str, project_path: str, params: dict) -> dict:
+        """Queue a job and return it immediately
+
+        Args:
+            kind: Job kind, one of the runner names
+            project_path: Project root directory, job state is saved inside it
+            params: Keyword arguments for the runner
+
+        Returns:
+            dict: The queued job
+        """
+        if kind not in self.runners:
+            raise ValueError(f"Unknown job kind: {kind}")
+        await self.start()
+        project_path = os.path.abspath(project_path)
+        queued = len(self._pending.get(project_path, ()))
+        if queued >= self.max_queued:
+            raise JobQueueFull(f"Project already has {queued} queued jobs, the limit is {self.max_queued}")
+
+        job = {
+            "id": uuid.uuid4().hex[:16],
+            "kind": kind,
+            "project_path": project_path,
+            "params": params,
+            "status": QUEUED,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+            "result": None
+        }
+        self._jobs[job["id"]] = job
+        await asyncio.to_thread(self._save, job)
+        await asyncio.to_thread(self._register_project, project_path)
+        async with self._wakeup:
+            self._enqueue(job)
+            self._wakeup.notify()
+        logger.info("Queued job %s (%s) for %s", job['id'], kind, project_path)
+        return job
+
+    def get(self, job_id: str) -> dict:
+        """Get a job by ID, None if it does not exist"""
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> dict:
+        """Cancel a queued or running job
+
+        A queued job is cancelled immediately; a running job is cancelling
+        until its worker has stopped it and recorded it as cancelled.
+
+        Returns:
+            dict: The job, None if it does not exist
+        """
+        job = self._jobs.get(job_id)
+        if not job or job["status"] in FINISHED_STATES + (CANCELLING,):
+            return job
+        task = self._running.get(job_id)
+        if task:
+            # 由执行该任务的worker记录取消状态
+            job["status"] = CANCELLING
+            self._save(job)
+            task.cancel()
+        else:
+            queue = self._pending.get(job["project_path"])
+            if queue and job_id in queue:
+                queue.remove(job_id)
+                if not queue:
+                    del self._pending[job["project_path"]]
+            job["status"] = CANCELLED
+            job["finished_at"] = time.time()
+            self._save(job)
+        logger.info("Cancelled job %s", job_id)
+        return job
+
+    def summary(self, job: dict) -> dict:
+        """Public view of a job without its parameters and result"""
+        info = {key: job[key] for key in ("id", "kind", "status", "project_path", "created_at", "started_at", "finished_at", "error")}
+        if job["status"] == QUEUED:
+            info["queued_jobs"] = sum(len(queue) for queue in self._pending.values())
+        return info
+
+    def stats(self) -> dict:
+        """Return the number of jobs in each state"""
+        counts = {state: 0 for state in (QUEUED, RUNNING, CANCELLING) + FINISHED_STATES}
+        for job in self._jobs.values():
+            counts[job["status"]] += 1
+        return {**counts, "workers": self.workers}
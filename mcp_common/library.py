@@ -0,0 +1,336 @@
+"""文档与提示词库检索模块
+
+为项目的 prompts/ 和 doc/ 目录建立持久化的倒排索引（SQLite，保存在 LIBRARY_INDEX_DIR），
+按 BM25 对标题和正文打分，标题中的词按 TITLE_WEIGHT 倍计算。分词兼顾中英文混合内容：
+英文和数字按单词切分，中日韩文字按相邻两个字（bigram）切分，不需要词典。
+
+检索前按文件的修改时间和大小增量更新索引，只重新索引新增或变化的文件并删除已不存在的文件；
+两次扫描间隔小于 LIBRARY_RESCAN_INTERVAL 时直接使用现有索引，数万个文件的库也能在
+毫秒级返回结果。
+"""
+
+import os
+import re
+import math
+import time
+import heapq
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import Counter
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 被索引的目录，相对于项目根目录
+LIBRARY_FOLDERS = ("prompts", "doc")
+LIBRARY_EXTENSIONS = (".md", ".txt")
+# 两次扫描目录之间的最小间隔（秒）
+LIBRARY_RESCAN_INTERVAL = float(os.environ.get("LIBRARY_RESCAN_INTERVAL", "2"))
+# 每个文件最多索引的字节数
+LIBRARY_MAX_FILE_BYTES = 1024 * 1024
+INDEX_VERSION = "1"
+
+# BM25参数
+K1 = 1.2
+B = 0.75
+TITLE_WEIGHT = 3.0
+SNIPPET_CHARS = 160
+
+TOKEN_PATTERN = re.compile(r"[0-9a-z]+|[぀-ヿ㐀-䶿一-鿿가-힯]+")
+ASCII_PATTERN = re.compile(r"[0-9a-z]")
+
+def tokenize(text: str) -> list:
+    """Split text into search terms
+
+    Latin words and numbers are kept whole, runs of CJK characters are split
+    into overlapping character pairs, so no dictionary is needed.
+
+    Args:
+        text: Text to split
+
+    Returns:
+        list: Terms in order of appearance
+    """
+    terms = []
+    for run in TOKEN_PATTERN.findall(unicodedata.normalize("NFKC", text).lower()):
+        if ASCII_PATTERN.match(run) or len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+def _split_title(text: str, path: str) -> tuple:
+    """Title from the first level-1 heading, or the file name, and the rest of the text"""
+    stripped = text.lstrip()
+    if stripped.startswith("# "):
+        line, _, body = stripped.partition("\n")
+        return line[2:].strip(), body
+    return os.path.splitext(os.path.basename(path))[0], text
+
+def _read(path: str) -> str:
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return f.read(LIBRARY_MAX_FILE_BYTES)
+
+def _snippet(text: str, terms: list) -> str:
+    """Part of text around the first query term it contains"""
+    lowered = unicodedata.normalize("NFKC", text).lower()
+    positions = [p for p in (lowered.find(term) for term in terms) if p >= 0]
+    start = max(0, min(positions) - SNIPPET_CHARS // 4) if positions else 0
+    snippet = " ".join(text[start:start + SNIPPET_CHARS].split())
+    return ("..." if start else "") + snippet
+
+class LibraryIndex:
+    """Persistent BM25 index of the prompts/ and doc/ files of one project"""
+
+    def __init__(self, project_path: str, db_path: str, rescan_interval: float = LIBRARY_RESCAN_INTERVAL):
+        """
+        Args:
+            project_path: Project root directory
+            db_path: Path of the SQLite index file
+            rescan_interval: Minimum seconds between two scans of the directories
+        """
+        self.project_path = os.path.realpath(project_path)
+        self.db_path = db_path
+        self.rescan_interval = rescan_interval
+        self._lock = threading.Lock()
+        self._conn = None
+        self._scanned = float("-inf")
+        # 文件ID -> (加权长度, 目录)，用于计算BM25
+        self._lengths = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is not None:
+            return self._conn
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        try:
+            conn = self._open()
+        except sqlite3.DatabaseError as e:
+            logger.warning("Rebuilding unreadable library index %s: %s", self.db_path, e)
+            os.remove(self.db_path)
+            conn = self._open()
+        self._conn = conn
+        return conn
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row and row[0] != INDEX_VERSION:
+            conn.executescript("DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS postings;")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE,
+                folder TEXT,
+                mtime REAL,
+                size INTEGER,
+                title TEXT,
+                length REAL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT,
+                file_id INTEGER,
+                tf REAL,
+                PRIMARY KEY (term, file_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_file ON postings (file_id);
+        """)
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (INDEX_VERSION,))
+        conn.commit()
+        return conn
+
+    def _walk(self) -> dict:
+        """Relative path -> (folder, mtime, size) of every library file on disk"""
+        found = {}
+        for folder in LIBRARY_FOLDERS:
+            root = os.path.join(self.project_path, folder)
+            for directory, dirs, files in os.walk(root):
+                # 跳过隐藏目录和 .part 等隐藏文件
+                dirs[:] = [d for d in dirs if not d.startswith(".")]
+                for name in files:
+                    if name.startswith(".") or not name.lower().endswith(LIBRARY_EXTENSIONS):
+                        continue
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    found[os.path.relpath(path, self.project_path)] = (folder, stat.st_mtime, stat.st_size)
+        return found
+
+    def refresh(self, force: bool = False) -> dict:
+        """Bring the index up to date with the files on disk
+
+        Args:
+            force: Scan even if the last scan was less than rescan_interval ago
+
+        Returns:
+            dict: Number of files indexed and removed, and the scan time in milliseconds
+        """
+        with self._lock:
+            return self._refresh(force)
+
+    def _refresh(self, force: bool) -> dict:
+        if not force and time.monotonic() - self._scanned < self.rescan_interval:
+            return {"indexed": 0, "removed": 0, "scan_ms": 0.0}
+        started = time.perf_counter()
+        conn = self._connect()
+        on_disk = self._walk()
+        known = {path: (file_id, mtime, size) for file_id, path, mtime, size in conn.execute("SELECT id, path, mtime, size FROM files")}
+        removed = [known[path][0] for path in known if path not in on_disk]
+        changed = [path for path, (_, mtime, size) in on_disk.items() if path not in known or known[path][1:] != (mtime, size)]
+
+        if removed or changed:
+            with conn:
+                for file_id in removed:
+                    conn.execute("DELETE FROM postings WHERE file_id = ?", (file_id,))
+                    conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+                for path in changed:
+                    self._index_file(conn, path, on_disk[path], known.get(path, (None,))[0])
+            self._lengths = None
+            logger.info("Library index of %s: %s files indexed, %s removed", self.project_path, len(changed), len(removed))
+        self._scanned = time.monotonic()
+        return {"indexed": len(changed), "removed": len(removed), "scan_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+    def _index_file(self, conn: sqlite3.Connection, path: str, entry: tuple, file_id: int) -> None:
+        folder, mtime, size = entry
+        try:
+            text = _read(os.path.join(self.project_path, path))
+        except OSError as e:
+            logger.warning("Failed to index %s: %s", path, e)
+            return
+        title, body = _split_title(text, path)
+        title_terms = tokenize(title)
+        body_terms = tokenize(body)
+        weights = Counter(body_terms)
+        for term in title_terms:
+            weights[term] += TITLE_WEIGHT
+        length = len(body_terms) + TITLE_WEIGHT * len(title_terms)
+        if file_id is None:
+            file_id = conn.execute(
+                "INSERT INTO files (path, folder, mtime, size, title, length) VALUES (?, ?, ?, ?, ?, ?)",
+                (path, folder, mtime, size, title, length)
+            ).lastrowid
+        else:
+            conn.execute("DELETE FROM postings WHERE file_id = ?", (file_id,))
+            conn.execute(
+                "UPDATE files SET folder = ?, mtime = ?, size = ?, title = ?, length = ? WHERE id = ?",
+                (folder, mtime, size, title, length, file_id)
+            )
+        conn.executemany("INSERT INTO postings (term, file_id, tf) VALUES (?, ?, ?)", [(term, file_id, tf) for term, tf in weights.items()])
+
+    def search(self, query: str, limit: int = 10, folder: str = None, refresh: bool = False) -> dict:
+        """Rank library files against a query with BM25
+
+        Args:
+            query: Search text, Chinese and English may be mixed
+            limit: Maximum number of results
+            folder: Only search this folder (prompts or doc), None for both
+            refresh: Rescan the directories even if they were scanned recently
+
+        Returns:
+            dict: Results with path, folder, title, score, snippet and modification time, plus index statistics
+        """
+        with self._lock:
+            index_stats = self._refresh(refresh)
+            started = time.perf_counter()
+            conn = self._connect()
+            if self._lengths is None:
+                self._lengths = {file_id: (length, file_folder) for file_id, length, file_folder in conn.execute("SELECT id, length, folder FROM files")}
+            lengths = self._lengths
+            count = len(lengths)
+            average = sum(length for length, _ in lengths.values()) / count if count else 0.0
+
+            terms = list(dict.fromkeys(tokenize(query)))
+            scores = {}
+            for term in terms:
+                postings = conn.execute("SELECT file_id, tf FROM postings WHERE term = ?", (term,)).fetchall()
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for file_id, tf in postings:
+                    length, file_folder = lengths.get(file_id, (average, None))
+                    if folder and file_folder != folder:
+                        continue
+                    norm = K1 * (1 - B + B * length / average) if average else K1
+                    scores[file_id] = scores.get(file_id, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+            top = heapq.nlargest(max(1, limit), scores.items(), key=lambda item: item[1])
+            rows = {}
+            if top:
+                placeholders = ",".join("?" * len(top))
+                rows = {row[0]: row[1:] for row in conn.execute(f"SELECT id, path, folder, title, mtime FROM files WHERE id IN ({placeholders})", [file_id for file_id, _ in top])}
+            query_ms = (time.perf_counter() - started) * 1000
+
+        results = []
+        for file_id, score in top:
+            path, file_folder, title, mtime = rows[file_id]
+            full_path = os.path.join(self.project_path, path)
+            try:
+                snippet = _snippet(_split_title(_read(full_path), path)[1], [t for t in terms if t])
+            except OSError:
+                continue
+            results.append({
+                "path": full_path,
+                "folder": file_folder,
+                "title": title,
+                "score": round(score, 4),
+                "snippet": snippet,
+                "modified": mtime
+            })
+        return {
+            "results": results,
+            "index": {
+                "files": count,
+                **index_stats,
+                "query_ms": round(query_ms, 2)
+            }
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+class Library:
+    """Library indexes of every project a server process searches"""
+
+    def __init__(self, index_dir: str):
+        """
+        Args:
+            index_dir: Directory holding one index file per project
+        """
+        self.index_dir = index_dir
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, name: str) -> "Library":
+        """Build from LIBRARY_INDEX_DIR, default ~/.cache/<name>/library"""
+        default_dir = os.path.join(os.path.expanduser("~"), ".cache", name, "library")
+        return cls(os.environ.get("LIBRARY_INDEX_DIR", default_dir))
+
+    def index(self, project_path: str) -> LibraryIndex:
+        """The index of a project, created on first use"""
+        project_path = os.path.realpath(project_path)
+        with self._lock:
+            index = self._indexes.get(project_path)
+            if index is None:
+                digest = hashlib.sha1(project_path.encode("utf-8")).hexdigest()[:16]
+                index = self._indexes[project_path] = LibraryIndex(project_path, os.path.join(self.index_dir, f"{digest}.sqlite3"))
+            return index
+
+    def search(self, project_path: str, query: str, limit: int = 10, folder: str = None, refresh: bool = False) -> dict:
+        """Search the prompts/ and doc/ files of a project, see LibraryIndex.search"""
+        return self.index(project_path).search(query, limit, folder, refresh)
+
+    def close(self) -> None:
+        with self._lock:
+            for index in self._indexes.values():
+                index.close()
+            self._indexes.clear()
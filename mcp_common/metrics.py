@@ -0,0 +1,368 @@
+"""请求指标模块
+
+每个工具调用对应一个请求记录（RequestTrace），通过 contextvars 在调用链中传递，
+各阶段（模板加载、构造提示词、排队、限流、首token、生成、写文件）的耗时累加到
+当前请求并汇总到进程级的统计中。计数器按 template_type 和 model 分组，记录
+请求数、错误数、输入/输出token数、缓存命中和重试次数，以及服务商提示词缓存命中的输入
+token数（usage.prompt_tokens_details.cached_tokens）。
+
+统计结果可以通过 server_stats 工具查看，也可以导出为Prometheus文本格式：
+METRICS_PROMETHEUS_FILE 指定定期写入的文件，METRICS_PORT 指定提供 /metrics 的端口。
+"""
+
+import os
+import time
+import asyncio
+import logging
+import functools
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# Prometheus导出
+METRICS_PROMETHEUS_FILE = os.environ.get("METRICS_PROMETHEUS_FILE", "")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+# 写入Prometheus文件的最小间隔（秒）
+METRICS_WRITE_INTERVAL = float(os.environ.get("METRICS_WRITE_INTERVAL", "5"))
+# server_stats 中保留的最近请求数
+METRICS_RECENT_REQUESTS = int(os.environ.get("METRICS_RECENT_REQUESTS", "50"))
+# 每个阶段保留的耗时样本数，用于计算分位数
+METRICS_SAMPLES = 1000
+
+QUANTILES = (0.5, 0.95, 0.99)
+LABEL_NAMES = ("template_type", "model")
+
+_current = contextvars.ContextVar("request_trace", default=None)
+
+class RequestTrace:
+    """Stage timings and outcome of one tool call"""
+
+    def __init__(self, tool: str, labels: dict):
+        self.tool = tool
+        self.labels = {name: labels.get(name) or "" for name in LABEL_NAMES}
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.stages = {}
+        # 上游报告的 prompt / completion / cached token数
+        self.tokens = {}
+        self.status = "ok"
+        self.error = None
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_tokens(self, kind: str, count: int) -> None:
+        self.tokens[kind] = self.tokens.get(kind, 0) + count
+
+    def fail(self, error: str) -> None:
+        self.status = "error"
+        self.error = error
+
+    def cancel(self) -> None:
+        self.status = "cancelled"
+
+    def info(self) -> dict:
+        return {
+            "tool": self.tool,
+            **self.labels,
+            "started": self.started,
+            "duration": round(self.duration, 4) if self.duration is not None else None,
+            "stages": {stage: round(seconds, 4) for stage, seconds in self.stages.items()},
+            "tokens": dict(self.tokens),
+            "status": self.status,
+            "error": self.error
+        }
+
+def _quantile(ordered: list, q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(labels) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+
+class Metrics:
+    """Process-wide counters and stage timing summaries"""
+
+    def __init__(self, namespace: str):
+        """
+        Args:
+            namespace: Prefix of the exported Prometheus metric names, the server sets its own before serving
+        """
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        # (name, ((label, value), ...)) -> value
+        self._counters = {}
+        # stage -> [count, sum, recent samples]
+        self._stages = {}
+        self._recent = deque(maxlen=METRICS_RECENT_REQUESTS)
+        self._written = 0.0
+        self._writer = None
+        self._exporter = None
+
+    def count(self, name: str, amount: float = 1, **labels) -> None:
+        """Add to a counter, labelled with the current request's template_type and model
+
+        Args:
+            name: Counter name
+            amount: Amount to add
+            **labels: Extra labels
+        """
+        request = _current.get()
+        if request is not None:
+            labels = {**request.labels, **labels}
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """Record the duration of a stage for the current request and the process summary"""
+        request = _current.get()
+        if request is not None:
+            request.add(stage, seconds)
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = self._stages[stage] = [0, 0.0, deque(maxlen=METRICS_SAMPLES)]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2].append(seconds)
+
+    def finish(self, request: RequestTrace) -> None:
+        """Record a finished request"""
+        request.duration = time.perf_counter() - request._start
+        labels = {**request.labels, "tool": request.tool, "status": request.status}
+        key = ("requests", tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            self._recent.append(request)
+        self.observe("total", request.duration)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Request %s finished in %.3fs: %s", request.tool, request.duration, request.info())
+        if METRICS_PROMETHEUS_FILE:
+            self._write_in_background(METRICS_PROMETHEUS_FILE)
+
+    def _write_in_background(self, path: str) -> None:
+        """Write the Prometheus file on a background thread if the interval has passed
+
+        finish() runs on the event loop, so the file is not written there; at
+        most one write runs at a time, requests finishing meanwhile skip it.
+        """
+        with self._lock:
+            if time.monotonic() - self._written < METRICS_WRITE_INTERVAL or (self._writer and self._writer.is_alive()):
+                return
+            self._written = time.monotonic()
+            self._writer = threading.Thread(target=self.write_prometheus, args=(path,), name="metrics-writer", daemon=True)
+            self._writer.start()
+
+    def stats(self) -> dict:
+        """Counters, stage percentiles and the most recent requests"""
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            stages = {}
+            for stage, (count, total, samples) in self._stages.items():
+                ordered = sorted(samples)
+                stages[stage] = {
+                    "count": count,
+                    "total_s": round(total, 4),
+                    **{f"p{int(q * 100)}_s": round(_quantile(ordered, q), 4) for q in QUANTILES}
+                }
+            recent = [request.info() for request in self._recent]
+        return {"counters": counters, "stages": stages, "recent_requests": recent}
+
+    def prometheus(self) -> str:
+        """Metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            names = sorted({name for name, _ in self._counters})
+            for name in names:
+                metric = f"{self.namespace}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for (counter, labels), value in sorted(self._counters.items()):
+                    if counter == name:
+                        lines.append(f"{metric}{{{_labels(labels)}}} {value}")
+            metric = f"{self.namespace}_stage_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for stage, (count, total, samples) in sorted(self._stages.items()):
+                ordered = sorted(samples)
+                for q in QUANTILES:
+                    lines.append(f'{metric}{{stage="{stage}",quantile="{q}"}} {_quantile(ordered, q):.6f}')
+                lines.append(f'{metric}_sum{{stage="{stage}"}} {total:.6f}')
+                lines.append(f'{metric}_count{{stage="{stage}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        """Write the Prometheus metrics to a file atomically"""
+        self._written = time.monotonic()
+        try:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.prometheus())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Failed to write metrics file %s: %s", path, e)
+
+    def start_exporter(self, port: int = METRICS_PORT, host: str = METRICS_HOST) -> None:
+        """Serve /metrics on a background thread, does nothing if port is 0 or already serving"""
+        if not port or self._exporter is not None:
+            return
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                data = metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        try:
+            self._exporter = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            logger.warning("Failed to start metrics endpoint on port %s: %s", port, e)
+            return
+        self._exporter.daemon_threads = True
+        threading.Thread(target=self._exporter.serve_forever, daemon=True).start()
+        logger.info("Serving Prometheus metrics on http://%s:%s/metrics", host, port)
+
+# 各服务启动时设置自己的 namespace（doc_gen / prompt_gen）
+metrics = Metrics("mcp")
+
+@contextmanager
+def trace(tool: str, **labels):
+    """Track one tool call, stages and counters recorded inside are attributed to it
+
+    Tasks started inside the block inherit the request through contextvars.
+
+    Args:
+        tool: Tool name
+        **labels: template_type and model, if known
+
+    Yields:
+        RequestTrace: The request being tracked
+    """
+    request = RequestTrace(tool, labels)
+    token = _current.set(request)
+    try:
+        yield request
+    except asyncio.CancelledError:
+        request.cancel()
+        raise
+    except BaseException as e:
+        request.fail(str(e) or type(e).__name__)
+        raise
+    finally:
+        _current.reset(token)
+        metrics.finish(request)
+
+def traced(tool: str, label_args: tuple = (), **labels):
+    """Decorator tracking every call of an async tool function
+
+    A returned dict with success False marks the request as failed.
+
+    Args:
+        tool: Tool name
+        label_args: Keyword arguments of the function used as labels, e.g. ("template_type",)
+        **labels: Fixed labels
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            request_labels = {**labels, **{name: kwargs.get(name) for name in label_args}}
+            with trace(tool, **request_labels) as request:
+                result = await fn(*args, **kwargs)
+                if isinstance(result, dict) and result.get("success") is False:
+                    request.fail(result.get("error"))
+                return result
+        return wrapper
+    return decorator
+
+def set_labels(**labels) -> None:
+    """Set labels of the current request once they are known, e.g. the model"""
+    request = _current.get()
+    if request is not None:
+        request.labels.update({name: value for name, value in labels.items() if name in LABEL_NAMES and value})
+
+@contextmanager
+def span(stage: str):
+    """Time a stage of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe(stage, time.perf_counter() - started)
+
+def cached_tokens(usage) -> int:
+    """Prompt tokens served from the provider's prompt cache, 0 if not reported
+
+    Args:
+        usage: response.usage, None if the provider did not report it
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        return details.get("cached_tokens") or 0
+    return getattr(details, "cached_tokens", 0) or 0
+
+def record_usage(usage, estimated_in: int = 0, estimated_out: int = 0) -> None:
+    """Count input, output and prompt-cached tokens of an upstream call
+
+    Args:
+        usage: response.usage, None if the provider did not report it
+        estimated_in: Estimated prompt tokens, used when usage is missing
+        estimated_out: Estimated output tokens, used when usage is missing
+    """
+    if usage is not None:
+        tokens = {
+            "in": getattr(usage, "prompt_tokens", 0) or 0,
+            "out": getattr(usage, "completion_tokens", 0) or 0,
+            "cached": cached_tokens(usage)
+        }
+        for kind, count in tokens.items():
+            metrics.count(f"tokens_{kind}", count)
+    else:
+        tokens = {"in": estimated_in, "out": estimated_out}
+        metrics.count("tokens_in", estimated_in, estimated="true")
+        metrics.count("tokens_out", estimated_out, estimated="true")
+    request = _current.get()
+    if request is not None:
+        for kind, count in tokens.items():
+            request.add_tokens(kind, count)
+
+def record_cancelled(estimated_in: int, received_out: int, max_out: int, issued: bool = True) -> None:
+    """Count an upstream call aborted because its tool call was cancelled
+
+    The prompt and the output received so far were paid for without producing
+    a result (tokens_wasted), the rest of max_out was never generated
+    (tokens_saved). A call cancelled while still waiting for a rate limiter
+    slot was never sent, so nothing was paid and the whole call was saved.
+
+    Args:
+        estimated_in: Estimated prompt tokens of the call
+        received_out: Output tokens received before the call was aborted
+        max_out: Output token limit of the call
+        issued: Whether the request had been sent to an endpoint
+    """
+    metrics.count("upstream_cancelled")
+    if not issued:
+        metrics.count("tokens_saved", estimated_in + max_out)
+        return
+    metrics.count("tokens_wasted", estimated_in + received_out)
+    metrics.count("tokens_saved", max(0, max_out - received_out))
@@ -0,0 +1,395 @@
+"""上游限流与重试模块
+
+按API端点共享的限流器：
+- 令牌桶限制每分钟请求数和每分钟token数，请求按预估token数预占额度，完成后按实际用量退还
+- AIMD并发控制：遇到429时并发上限减半，请求成功时缓慢增加
+- 429、5xx、超时和连接错误按带抖动的指数退避重试，优先遵循 Retry-After，
+  服务端要求等待时该端点的所有请求一起暂停，避免重试风暴
+"""
+
+import os
+import time
+import random
+import asyncio
+import inspect
+import logging
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+
+from .tokens import estimate_tokens, TokenCounter
+from .metrics import metrics, span
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 每个端点每分钟的请求数和token数上限，0表示不限制
+RPM_LIMIT = int(os.environ.get("LLM_RPM_LIMIT", "0"))
+TPM_LIMIT = int(os.environ.get("LLM_TPM_LIMIT", "0"))
+# 每个端点同时进行的请求数范围，初始为上限，遇到429时减小
+MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "16"))
+MIN_CONCURRENCY = int(os.environ.get("LLM_MIN_CONCURRENCY", "1"))
+# 重试次数和退避时间（秒）
+MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "5"))
+RETRY_BASE_DELAY = float(os.environ.get("LLM_RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.environ.get("LLM_RETRY_MAX_DELAY", "60"))
+# 两次减小并发上限之间的最小间隔（秒），同一波429只减一次
+DECREASE_INTERVAL = 2.0
+
+RETRYABLE_STATUS = (408, 409, 429, 500, 502, 503, 504)
+
+class TokenBucket:
+    """Token bucket refilled continuously, reservations may overdraw it and wait for the refill"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take amount from the bucket and return how long to wait before using it"""
+        self._refill()
+        self.level -= min(amount, self.capacity)
+        return max(0.0, -self.level / self.rate)
+
+    def refund(self, amount: float) -> None:
+        """Give back an unused part of a reservation"""
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+def retry_after(error: Exception) -> float:
+    """Seconds the server asked us to wait, None if it did not say"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def is_retryable(error: Exception) -> bool:
+    """Whether a failed request is worth retrying"""
+    # 出错时客户端已经创建，OpenAI SDK 已经导入
+    import openai
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code in RETRYABLE_STATUS
+
+def estimate_request_tokens(messages: list, max_tokens: int) -> int:
+    """Tokens a chat request may consume: the prompt plus the output limit"""
+    return sum(estimate_tokens(message.get("content") or "") for message in messages) + max_tokens
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+class _SlotWaiter:
+    """A request waiting for a concurrency slot, granted is set once _wake handed it one"""
+
+    __slots__ = ("loop", "future", "granted")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, future: asyncio.Future):
+        self.loop = loop
+        self.future = future
+        self.granted = False
+
+class EndpointLimiter:
+    """Shared request/token rate limits and adaptive concurrency for one API endpoint"""
+
+    def __init__(self, api_url: str, rpm: int = RPM_LIMIT, tpm: int = TPM_LIMIT, max_concurrency: int = MAX_CONCURRENCY, min_concurrency: int = MIN_CONCURRENCY):
+        self.api_url = api_url
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._waiters = deque()
+        self._stats = {"requests": 0, "retries": 0, "throttled": 0, "failures": 0}
+
+    # ---- 并发槽位 ----
+
+    def _try_take_slot(self) -> bool:
+        if self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return True
+        return False
+
+    def _wake(self) -> None:
+        """Hand the free slots to waiters in arrival order, must hold the lock"""
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.future.done():
+                # 已经取消的等待者不占用槽位
+                continue
+            self.in_flight += 1
+            waiter.granted = True
+            try:
+                waiter.loop.call_soon_threadsafe(_resolve, waiter.future)
+            except RuntimeError:
+                # 等待者所在的事件循环已经关闭
+                self.in_flight -= 1
+                waiter.granted = False
+
+    async def _take_slot(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            # 有人排队时不插队，空出的槽位由 _wake 按顺序交给等待者
+            if not self._waiters and self._try_take_slot():
+                return
+            waiter = _SlotWaiter(loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    # 槽位已经交给了这个等待者，转交给下一个
+                    self.in_flight -= 1
+                    self._wake()
+                elif waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            raise
+
+    def _release_slot(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self._wake()
+
+    # ---- 额度 ----
+
+    def _reserve(self, tokens: int) -> float:
+        """Reserve rate limit budget and return how long to wait for it"""
+        with self._lock:
+            self._stats["requests"] += 1
+            wait = max(0.0, self.blocked_until - time.monotonic())
+            if self.requests:
+                wait = max(wait, self.requests.reserve(1))
+            if self.tokens:
+                wait = max(wait, self.tokens.reserve(tokens))
+            return wait
+
+    def settle(self, reserved: int, used: int = None) -> None:
+        """Return the unused part of a token reservation once the real usage is known"""
+        if self.tokens and used is not None and used < reserved:
+            with self._lock:
+                self.tokens.refund(reserved - used)
+
+    async def acquire(self, tokens: int) -> None:
+        """Wait for rate limit budget and a concurrency slot"""
+        with span("rate_limit"):
+            wait = self._reserve(tokens)
+            try:
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                await self._take_slot()
+            except asyncio.CancelledError:
+                # 请求没有发出，退还预占的额度
+                self.settle(tokens, 0)
+                raise
+
+    def release(self) -> None:
+        self._release_slot()
+
+    # ---- 反馈 ----
+
+    def on_success(self) -> None:
+        """Additive increase: about one more slot per window of successful requests"""
+        with self._lock:
+            if self.limit < self.max_concurrency:
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+                self._wake()
+
+    def on_error(self, error: Exception, attempt: int, retries: int = MAX_RETRIES) -> float:
+        """Record a failed attempt
+
+        Args:
+            error: The exception raised by the request
+            attempt: Number of retries already made
+            retries: Maximum number of retries for this request
+
+        Returns:
+            float: Seconds to wait before retrying, None if the error should be raised
+        """
+        if not is_retryable(error) or attempt >= retries:
+            with self._lock:
+                self._stats["failures"] += 1
+            metrics.count("upstream_errors")
+            return None
+        requested = retry_after(error)
+        delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+        metrics.count("retries")
+        with self._lock:
+            self._stats["retries"] += 1
+            now = time.monotonic()
+            if getattr(error, "status_code", None) == 429:
+                self._stats["throttled"] += 1
+                # 乘性减小，同一波429只减一次
+                if now - self._last_decrease >= DECREASE_INTERVAL:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self._last_decrease = now
+                    logger.warning("Rate limited by %s, concurrency limit lowered to %s", self.api_url, int(self.limit))
+            if requested is not None:
+                # 服务端指定了等待时间，该端点的所有请求一起暂停
+                delay = requested + random.uniform(0, RETRY_BASE_DELAY)
+                self.blocked_until = max(self.blocked_until, now + requested)
+        logger.warning("Request to %s failed (%s), retry %s/%s in %.1fs", self.api_url, error, attempt + 1, retries, delay)
+        return delay
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "concurrency_limit": int(self.limit),
+                "in_flight": self.in_flight
+            }
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(api_url: str) -> EndpointLimiter:
+    """Get the shared limiter of an endpoint"""
+    with _limiters_lock:
+        limiter = _limiters.get(api_url)
+        if limiter is None:
+            limiter = _limiters[api_url] = EndpointLimiter(api_url)
+        return limiter
+
+def limiter_stats() -> dict:
+    """Statistics of all endpoint limiters"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.api_url: limiter.stats() for limiter in limiters}
+
+def _usage_tokens(response) -> int:
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+async def acall_with_limits(api_url: str, tokens: int, create, retries: int = MAX_RETRIES):
+    """Make a request under the endpoint limits, retrying transient failures
+
+    Args:
+        api_url: API base URL, limits are shared per endpoint
+        tokens: Estimated tokens the request consumes
+        create: Function returning an awaitable making one request
+        retries: Maximum number of retries
+
+    Returns:
+        The response returned by create
+    """
+    limiter = get_limiter(api_url)
+    attempt = 0
+    while True:
+        await limiter.acquire(tokens)
+        try:
+            response = await create()
+        except Exception as e:
+            delay = limiter.on_error(e, attempt, retries)
+            if delay is None:
+                raise
+        else:
+            limiter.on_success()
+            limiter.settle(tokens, _usage_tokens(response))
+            return response
+        finally:
+            limiter.release()
+        attempt += 1
+        await asyncio.sleep(delay)
+
+async def _close_stream(stream) -> None:
+    """Close the HTTP response of a stream, aborting the upstream generation if it is still running"""
+    close = getattr(stream, "close", None)
+    if close is None:
+        return
+    try:
+        result = close()
+        if inspect.isawaitable(result):
+            await result
+    except Exception as e:
+        logger.debug("Failed to close stream: %s", e)
+
+class _StreamMeter:
+    """Pass the chunks of a stream through, keeping track of the tokens it used"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._iterator = None
+        self._output = TokenCounter()
+        self._reported = None
+
+    def __aiter__(self):
+        self._iterator = self._stream.__aiter__()
+        return self
+
+    async def __anext__(self):
+        chunk = await self._iterator.__anext__()
+        total = getattr(getattr(chunk, "usage", None), "total_tokens", None)
+        if total is not None:
+            self._reported = total
+        for choice in getattr(chunk, "choices", None) or []:
+            delta = getattr(getattr(choice, "delta", None), "content", None)
+            if delta:
+                self._output.add(delta)
+        return chunk
+
+    @property
+    def used(self) -> int:
+        """Tokens reported in the final chunk, the estimate of the received text if there was none"""
+        return self._reported if self._reported is not None else self._output.total
+
+@asynccontextmanager
+async def astream_with_limits(api_url: str, tokens: int, create, retries: int = MAX_RETRIES):
+    """Open a streaming request under the endpoint limits
+
+    Opening the stream is retried like acall_with_limits; the concurrency
+    slot is held until the caller has finished reading the stream. The
+    stream is closed on exit, so a caller that stops early (e.g. because
+    the request was cancelled) aborts the upstream request at once. The
+    unused part of the token reservation is returned when the stream ends.
+    """
+    limiter = get_limiter(api_url)
+    attempt = 0
+    while True:
+        await limiter.acquire(tokens)
+        try:
+            stream = await create()
+            break
+        except BaseException as e:
+            limiter.release()
+            delay = limiter.on_error(e, attempt, retries) if isinstance(e, Exception) else None
+            if delay is None:
+                raise
+        attempt += 1
+        await asyncio.sleep(delay)
+    meter = _StreamMeter(stream)
+    try:
+        yield meter
+        limiter.on_success()
+    finally:
+        limiter.release()
+        limiter.settle(tokens, meter.used)
+        await _close_stream(stream)
@@ -0,0 +1,195 @@
+"""生成结果缓存模块
+
+以完整渲染后的提示词和模型参数的哈希作为键，把生成结果缓存到磁盘，
+支持最大容量、过期时间和LRU淘汰。
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+def make_cache_key(**parts) -> str:
+    """Hash the rendered prompt and model parameters into a cache key
+
+    Args:
+        **parts: JSON-serializable values that fully determine the response
+
+    Returns:
+        str: Hex digest used as the cache key
+    """
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """On-disk LRU cache for LLM responses"""
+
+    def __init__(self, cache_dir: str, max_bytes: int, max_entries: int, ttl: float, enabled: bool = True):
+        """
+        Args:
+            cache_dir: Directory holding one JSON file per entry
+            max_bytes: Maximum total size of cached entries in bytes
+            max_entries: Maximum number of cached entries
+            ttl: Entry lifetime in seconds (0 means entries never expire)
+            enabled: Whether the cache is used at all
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # key -> (size, created)，按最近访问时间排序
+        self._index = OrderedDict()
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "expired": 0}
+        self._loaded = False
+
+    @classmethod
+    def from_env(cls, name: str) -> "ResponseCache":
+        """Build a cache from the RESPONSE_CACHE_* environment variables
+
+        Args:
+            name: Service name, used for the default cache directory
+
+        Returns:
+            ResponseCache: Configured cache
+        """
+        default_dir = os.path.join(os.path.expanduser("~"), ".cache", name)
+        return cls(
+            cache_dir=os.environ.get("RESPONSE_CACHE_DIR", default_dir),
+            max_bytes=int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(100 * 1024 * 1024))),
+            max_entries=int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "2000")),
+            ttl=float(os.environ.get("RESPONSE_CACHE_TTL", str(7 * 24 * 3600))),
+            enabled=os.environ.get("RESPONSE_CACHE_ENABLED", "1").lower() not in ("0", "false", "no")
+        )
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load_index(self) -> None:
+        """Rebuild the in-memory index from the cache directory (called with lock held)"""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.isdir(self.cache_dir):
+            return
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            stat = entry.stat()
+            # 文件的atime记录最近访问时间，mtime记录创建时间
+            entries.append((stat.st_atime, entry.name[:-5], stat.st_size, stat.st_mtime))
+        for _, key, size, created in sorted(entries):
+            self._index[key] = (size, created)
+            self._bytes += size
+
+    def _remove(self, key: str) -> None:
+        """Drop an entry from index and disk (called with lock held)"""
+        size, _ = self._index.pop(key)
+        self._bytes -= size
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self) -> None:
+        """Evict least recently used entries until within limits (called with lock held)"""
+        while self._index and (len(self._index) > self.max_entries or self._bytes > self.max_bytes):
+            key = next(iter(self._index))
+            self._remove(key)
+            self._stats["evictions"] += 1
+
+    def get(self, key: str):
+        """Look up a cached value
+
+        Args:
+            key: Cache key from make_cache_key
+
+        Returns:
+            The cached value, or None on a miss
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._load_index()
+            meta = self._index.get(key)
+            if meta is None:
+                self._stats["misses"] += 1
+                return None
+            if self.ttl and time.time() - meta[1] > self.ttl:
+                self._remove(key)
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            try:
+                with open(self._path(key), 'r', encoding='utf-8') as f:
+                    value = json.load(f)["value"]
+                os.utime(self._path(key), (time.time(), meta[1]))
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("Dropping unreadable cache entry %s: %s", key, e)
+                self._remove(key)
+                self._stats["misses"] += 1
+                return None
+            self._index.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def set(self, key: str, value) -> None:
+        """Store a value and evict old entries if over the limits
+
+        Args:
+            key: Cache key from make_cache_key
+            value: JSON-serializable value
+        """
+        if not self.enabled:
+            return
+        data = json.dumps({"created": time.time(), "value": value}, ensure_ascii=False).encode("utf-8")
+        with self._lock:
+            self._load_index()
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                tmp_path = f"{self._path(key)}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, self._path(key))
+            except OSError as e:
+                logger.warning("Failed to write cache entry: %s", e)
+                return
+            if key in self._index:
+                self._bytes -= self._index.pop(key)[0]
+            self._index[key] = (len(data), time.time())
+            self._bytes += len(data)
+            self._stats["writes"] += 1
+            self._evict()
+
+    def clear(self) -> None:
+        """Remove all cached entries"""
+        with self._lock:
+            self._load_index()
+            for key in list(self._index):
+                self._remove(key)
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and current cache size"""
+        with self._lock:
+            self._load_index()
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "entries": len(self._index),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "enabled": self.enabled,
+                "cache_dir": self.cache_dir
+            }
@@ -0,0 +1,90 @@
+"""请求级别的LLM配置模块
+
+每个请求携带自己的配置对象，而不是修改进程级的环境变量，
+这样同一个服务进程可以并发处理指向不同模型/端点的请求。
+
+API_ENDPOINTS 可以配置多个端点用于故障转移，格式为逗号分隔的URL列表，
+或者JSON数组（每项包含 url，可选 api_key、model、weight，未指定时使用
+API_KEY / MODEL）。第一个端点是主端点。
+
+两个服务的用量账本、后台任务状态和文档章节指纹保存在项目根目录的 STATE_FOLDER 中，
+不放在 doc/ 或 prompts/ 这些输出目录里。
+"""
+
+import os
+import json
+from dataclasses import dataclass, replace
+
+# 项目内保存用量账本、任务状态等记录的目录，相对于项目根目录
+STATE_FOLDER = os.environ.get("STATE_FOLDER", ".cursor-copilot")
+
+@dataclass(frozen=True)
+class LLMSettings:
+    """Model and endpoint settings for one generation request"""
+
+    api_key: str
+    api_url: str
+    model: str
+    # 故障转移时依次尝试的备用端点
+    fallbacks: tuple = ()
+    # 按权重选择端点时的权重
+    weight: float = 1.0
+
+    @classmethod
+    def from_env(cls) -> "LLMSettings":
+        """Build settings from the API_KEY / API_URL / MODEL / API_ENDPOINTS environment variables"""
+        api_key = os.environ.get("API_KEY", "")
+        model = os.environ.get("MODEL", "gpt-4")
+        endpoints = _parse_endpoints(os.environ.get("API_ENDPOINTS", ""), api_key, model)
+        if not endpoints:
+            return cls(
+                api_key=api_key,
+                api_url=os.environ.get("API_URL", "https://api.openai.com/v1"),
+                model=model
+            )
+        return replace(endpoints[0], fallbacks=tuple(endpoints[1:]))
+
+    def endpoints(self) -> list:
+        """All endpoints of this request, the primary first"""
+        return [replace(self, fallbacks=())] + list(self.fallbacks)
+
+    def override(self, model: str = None, api_base_url: str = None) -> "LLMSettings":
+        """Return a copy with the per-request overrides applied
+
+        A custom model applies to every endpoint; a custom API base URL pins the
+        request to that endpoint and disables failover.
+
+        Args:
+            model: Custom model name (optional)
+            api_base_url: Custom API base URL (optional)
+
+        Returns:
+            LLMSettings: New settings object, self is left unchanged
+        """
+        changes = {}
+        if model:
+            changes["model"] = model
+            changes["fallbacks"] = tuple(replace(fallback, model=model) for fallback in self.fallbacks)
+        if api_base_url:
+            changes["api_url"] = api_base_url
+            changes["fallbacks"] = ()
+        return replace(self, **changes) if changes else self
+
+def _parse_endpoints(value: str, api_key: str, model: str) -> list:
+    """Parse API_ENDPOINTS into settings objects"""
+    value = value.strip()
+    if not value:
+        return []
+    if value.startswith("["):
+        entries = json.loads(value)
+    else:
+        entries = [{"url": url.strip()} for url in value.split(",") if url.strip()]
+    return [
+        LLMSettings(
+            api_key=entry.get("api_key", api_key),
+            api_url=entry["url"],
+            model=entry.get("model", model),
+            weight=float(entry.get("weight", 1.0))
+        )
+        for entry in entries
+    ]
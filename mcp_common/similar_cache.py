@@ -0,0 +1,309 @@
+"""相似请求缓存模块
+
+结果缓存只有渲染后的提示词完全相同时才会命中，换一种说法描述同一个需求（如
+"user login module" 和 "login module for users"）仍会触发一次完整的生成。本模块在
+本地比较请求文本的相似度，不依赖任何网络嵌入服务：请求按 library 模块的分词方式切分，
+去掉常见虚词和英文复数后计算TF-IDF向量，用倒排索引找出有共同词的历史请求并计算余弦相似度。
+
+只有相同作用域（文档模板类型和语言，提示词的语言和规则）内的请求会互相匹配，相似度
+不低于 SIMILAR_CACHE_THRESHOLD 时，按 SIMILAR_CACHE_MODE 直接返回之前的结果（return）
+或者只提示已有相似结果（offer）。历史请求和结果保存在SQLite文件中，服务重启后继续使用。
+"""
+
+import os
+import json
+import math
+import time
+import sqlite3
+import logging
+import threading
+from collections import Counter, deque
+
+from .library import tokenize
+from .response_cache import make_cache_key
+from .metrics import metrics
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+SIMILAR_MODES = ("return", "offer")
+# 保留的延迟样本数，用于计算分位数
+LATENCY_SAMPLES = 1000
+
+# 不参与匹配的英文虚词
+STOPWORDS = frozenset("""
+a an and are as at be by for from how i in into is it of on or that the this to we with
+please should can could would will need needs want wants use using which what
+""".split())
+
+def normalize_terms(text: str) -> Counter:
+    """Term counts of a request text used for similarity matching
+
+    Args:
+        text: Request text
+
+    Returns:
+        Counter: Terms without stopwords, simple English plurals folded
+    """
+    terms = Counter()
+    for term in tokenize(text):
+        if term in STOPWORDS:
+            continue
+        if len(term) > 3 and term.isascii() and term.isalpha():
+            if term.endswith("ies"):
+                term = term[:-3] + "y"
+            elif term.endswith("s") and not term.endswith("ss"):
+                term = term[:-1]
+        terms[term] += 1
+    return terms
+
+def make_scope(**parts) -> str:
+    """Scope of a request, only requests in the same scope are matched
+
+    Args:
+        **parts: JSON-serializable values that must be equal, e.g. template_type and language
+    """
+    return make_cache_key(**parts)[:32]
+
+class _ScopeIndex:
+    """In-memory term statistics of the cached requests of one scope"""
+
+    def __init__(self):
+        # 条目ID -> (词频, 创建时间)
+        self.entries = {}
+        self.df = Counter()
+        self.postings = {}
+
+    def add(self, entry_id: int, terms: Counter, created: float) -> None:
+        self.entries[entry_id] = (terms, created)
+        for term in terms:
+            self.df[term] += 1
+            self.postings.setdefault(term, set()).add(entry_id)
+
+    def remove(self, entry_id: int) -> None:
+        terms, _ = self.entries.pop(entry_id)
+        for term in terms:
+            self.df[term] -= 1
+            if not self.df[term]:
+                del self.df[term]
+            self.postings[term].discard(entry_id)
+            if not self.postings[term]:
+                del self.postings[term]
+
+    def idf(self, term: str) -> float:
+        return math.log((len(self.entries) + 1) / (self.df.get(term, 0) + 1)) + 1
+
+    def best(self, terms: Counter, expired_before: float) -> tuple:
+        """(entry ID, cosine similarity) of the most similar entry, (None, 0.0) if none shares a term"""
+        query = {term: count * self.idf(term) for term, count in terms.items()}
+        query_norm = math.sqrt(sum(weight * weight for weight in query.values()))
+        candidates = set()
+        for term in query:
+            candidates.update(self.postings.get(term, ()))
+        best_id, best_score = None, 0.0
+        for entry_id in candidates:
+            entry_terms, created = self.entries[entry_id]
+            if created < expired_before:
+                continue
+            dot = 0.0
+            norm = 0.0
+            for term, count in entry_terms.items():
+                weight = count * self.idf(term)
+                norm += weight * weight
+                if term in query:
+                    dot += weight * query[term]
+            score = dot / (query_norm * math.sqrt(norm)) if query_norm and norm else 0.0
+            if score > best_score:
+                best_id, best_score = entry_id, score
+        return best_id, best_score
+
+class SimilarCache:
+    """Local cache returning the result of an earlier, similar request"""
+
+    def __init__(self, db_path: str, threshold: float, mode: str, max_entries: int, ttl: float, enabled: bool = False):
+        """
+        Args:
+            db_path: Path of the SQLite file holding requests and results
+            threshold: Minimum cosine similarity of a match, between 0 and 1
+            mode: return (reuse the earlier result) or offer (only report it)
+            max_entries: Maximum number of cached requests, the oldest are dropped first
+            ttl: Entry lifetime in seconds (0 means entries never expire)
+            enabled: Whether the cache is used at all
+        """
+        if mode not in SIMILAR_MODES:
+            logger.warning("Unknown SIMILAR_CACHE_MODE %s, using return", mode)
+            mode = "return"
+        self.db_path = db_path
+        self.threshold = threshold
+        self.mode = mode
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._conn = None
+        self._scopes = None
+        self._stats = {"lookups": 0, "hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    @classmethod
+    def from_env(cls, name: str) -> "SimilarCache":
+        """Build a cache from the SIMILAR_CACHE_* environment variables
+
+        Args:
+            name: Service name, used for the default cache directory
+
+        Returns:
+            SimilarCache: Configured cache
+        """
+        default_path = os.path.join(os.path.expanduser("~"), ".cache", name, "similar.sqlite3")
+        return cls(
+            db_path=os.environ.get("SIMILAR_CACHE_PATH", default_path),
+            threshold=float(os.environ.get("SIMILAR_CACHE_THRESHOLD", "0.85")),
+            mode=os.environ.get("SIMILAR_CACHE_MODE", "return").lower(),
+            max_entries=int(os.environ.get("SIMILAR_CACHE_MAX_ENTRIES", "5000")),
+            ttl=float(os.environ.get("SIMILAR_CACHE_TTL", str(7 * 24 * 3600))),
+            enabled=os.environ.get("SIMILAR_CACHE_ENABLED", "0").lower() in ("1", "true", "yes")
+        )
+
+    def _load(self) -> sqlite3.Connection:
+        """Open the database and build the in-memory index (called with lock held)"""
+        if self._conn is not None:
+            return self._conn
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY,
+                scope TEXT,
+                request TEXT,
+                value TEXT,
+                path TEXT,
+                created REAL
+            )
+        """)
+        conn.commit()
+        self._scopes = {}
+        for entry_id, scope, request, created in conn.execute("SELECT id, scope, request, created FROM entries ORDER BY id"):
+            self._scopes.setdefault(scope, _ScopeIndex()).add(entry_id, normalize_terms(request), created)
+        self._conn = conn
+        return conn
+
+    def lookup(self, scope: str, request: str):
+        """Find the most similar earlier request of the same scope
+
+        Args:
+            scope: Scope from make_scope
+            request: Text of the new request
+
+        Returns:
+            dict: similarity, earlier request, its result value, path and creation time, or None below the threshold
+        """
+        if not self.enabled:
+            return None
+        started = time.perf_counter()
+        match = None
+        with self._lock:
+            conn = self._load()
+            index = self._scopes.get(scope)
+            if index is not None:
+                expired_before = time.time() - self.ttl if self.ttl else float("-inf")
+                entry_id, similarity = index.best(normalize_terms(request), expired_before)
+                if entry_id is not None and similarity >= self.threshold:
+                    row = conn.execute("SELECT request, value, path, created FROM entries WHERE id = ?", (entry_id,)).fetchone()
+                    if row is not None:
+                        match = {
+                            "similarity": round(similarity, 4),
+                            "request": row[0],
+                            "value": json.loads(row[1]),
+                            "path": row[2],
+                            "created": row[3]
+                        }
+            self._stats["lookups"] += 1
+            self._stats["hits" if match else "misses"] += 1
+            self._latencies.append(time.perf_counter() - started)
+        metrics.count("similar_hits" if match else "similar_misses")
+        return match
+
+    def add(self, scope: str, request: str, value, path: str = "") -> None:
+        """Remember the result of a request, replacing an earlier identical request
+
+        Args:
+            scope: Scope from make_scope
+            request: Text of the request
+            value: JSON-serializable result
+            path: File the result was saved to (optional)
+        """
+        if not self.enabled:
+            return
+        created = time.time()
+        with self._lock:
+            conn = self._load()
+            index = self._scopes.setdefault(scope, _ScopeIndex())
+            try:
+                with conn:
+                    for (entry_id,) in conn.execute("SELECT id FROM entries WHERE scope = ? AND request = ?", (scope, request)).fetchall():
+                        conn.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+                        index.remove(entry_id)
+                    entry_id = conn.execute(
+                        "INSERT INTO entries (scope, request, value, path, created) VALUES (?, ?, ?, ?, ?)",
+                        (scope, request, json.dumps(value, ensure_ascii=False), path, created)
+                    ).lastrowid
+                    index.add(entry_id, normalize_terms(request), created)
+                    self._stats["writes"] += 1
+                    self._evict(conn)
+            except sqlite3.Error as e:
+                logger.warning("Failed to write similar cache entry: %s", e)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Drop expired entries and the oldest entries above max_entries (called with lock held)"""
+        expired_before = time.time() - self.ttl if self.ttl else float("-inf")
+        count = sum(len(index.entries) for index in self._scopes.values())
+        while True:
+            rows = conn.execute("SELECT id, scope, created FROM entries ORDER BY id LIMIT 64").fetchall()
+            if not rows:
+                return
+            for entry_id, scope, created in rows:
+                if created >= expired_before and count <= self.max_entries:
+                    return
+                conn.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+                self._scopes[scope].remove(entry_id)
+                count -= 1
+                self._stats["evictions"] += 1
+
+    def stats(self) -> dict:
+        """Return lookup counters, hit rate and lookup latency"""
+        with self._lock:
+            lookups = self._stats["lookups"]
+            ordered = sorted(self._latencies)
+            entries = sum(len(index.entries) for index in self._scopes.values()) if self._scopes is not None else None
+            return {
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "lookup_ms": {
+                    "mean": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else None,
+                    "p50": round(ordered[len(ordered) // 2] * 1000, 3) if ordered else None,
+                    "p95": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000, 3) if ordered else None
+                },
+                "entries": entries,
+                "threshold": self.threshold,
+                "mode": self.mode,
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "enabled": self.enabled,
+                "path": self.db_path
+            }
+
+    def clear(self) -> None:
+        """Remove all cached requests"""
+        with self._lock:
+            conn = self._load()
+            with conn:
+                conn.execute("DELETE FROM entries")
+            self._scopes = {}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                self._scopes = None
@@ -0,0 +1,84 @@
+"""请求合并模块
+
+相同输入的并发请求共享同一个正在进行的生成任务，
+避免重复调用模型以及多个请求同时写同一个文件。
+"""
+
+import json
+import asyncio
+import hashlib
+import logging
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+def normalize_key(**inputs) -> str:
+    """Build a key from request inputs, ignoring surrounding whitespace and case of the language
+
+    Args:
+        **inputs: JSON-serializable request inputs
+
+    Returns:
+        str: Hex digest identifying the request
+    """
+    normalized = {}
+    for name, value in inputs.items():
+        if isinstance(value, str):
+            value = value.strip()
+            if name == "language":
+                value = value.lower()
+        normalized[name] = value
+    payload = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key onto one in-flight task"""
+
+    def __init__(self):
+        self._inflight = {}
+        self._stats = {"calls": 0, "executions": 0, "coalesced": 0}
+
+    def _forget(self, key: str, entry: dict) -> None:
+        if self._inflight.get(key) is entry:
+            del self._inflight[key]
+
+    async def do(self, key: str, fn):
+        """Run fn() unless a call with the same key is already running
+
+        Args:
+            key: Request key, e.g. from normalize_key
+            fn: Coroutine function producing the result
+
+        Returns:
+            tuple: (result, whether this call joined an in-flight task)
+        """
+        self._stats["calls"] += 1
+        entry = self._inflight.get(key)
+        coalesced = entry is not None
+        if coalesced:
+            self._stats["coalesced"] += 1
+            logger.info("Joined in-flight request %s", key[:12])
+        else:
+            self._stats["executions"] += 1
+            entry = {"task": asyncio.ensure_future(fn()), "waiters": 0}
+            self._inflight[key] = entry
+            entry["task"].add_done_callback(lambda _: self._forget(key, entry))
+        entry["waiters"] += 1
+        try:
+            # 单个等待方被取消时不影响其他等待方共享的任务
+            return await asyncio.shield(entry["task"]), coalesced
+        finally:
+            entry["waiters"] -= 1
+            if entry["waiters"] == 0 and not entry["task"].done():
+                # 所有等待方都已离开，不再需要这次生成
+                entry["task"].cancel()
+                self._forget(key, entry)
+
+    def stats(self) -> dict:
+        """Return call counters and the number of in-flight tasks"""
+        calls = self._stats["calls"]
+        return {
+            **self._stats,
+            "coalesced_rate": round(self._stats["coalesced"] / calls, 4) if calls else 0.0,
+            "in_flight": len(self._inflight)
+        }
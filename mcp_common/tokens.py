@@ -0,0 +1,103 @@
+"""Token估算模块
+
+优先使用tiktoken（如已安装）精确计算，否则按字符类型估算：
+中日韩字符约每字一个token，其余文本约每4个字符一个token。
+"""
+
+import re
+import logging
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+CJK_PATTERN = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯＀-￯]")
+
+_encoding = None
+_encoding_loaded = False
+
+def _get_encoding():
+    """Load the tiktoken encoding once, None if tiktoken is not installed"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            logger.debug("tiktoken is not available, using heuristic token estimation")
+    return _encoding
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a text
+
+    Args:
+        text: Text to measure
+
+    Returns:
+        int: Token count
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut a text down to at most max_tokens tokens, keeping its beginning
+
+    Args:
+        text: Text to shorten
+        max_tokens: Token limit
+
+    Returns:
+        str: The longest prefix of text within the limit
+    """
+    if max_tokens <= 0 or not text:
+        return ""
+    encoding = _get_encoding()
+    if encoding is not None:
+        ids = encoding.encode(text, disallowed_special=())
+        return text if len(ids) <= max_tokens else encoding.decode(ids[:max_tokens])
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 估算值随长度单调增加，二分查找最长的前缀
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
+
+class TokenCounter:
+    """Running token estimate of text that arrives in small pieces, e.g. a streamed completion
+
+    Estimating every piece on its own over-counts (each piece rounds up) and
+    re-estimating the whole text after every piece is quadratic, so pieces are
+    collected and estimated together every FLUSH_CHARS characters.
+    """
+
+    FLUSH_CHARS = 256
+
+    def __init__(self):
+        self._counted = 0
+        self._pending = []
+        self._pending_chars = 0
+
+    def add(self, text: str) -> int:
+        """Add a piece of text and return the estimate of everything added so far"""
+        self._pending.append(text)
+        self._pending_chars += len(text)
+        if self._pending_chars >= self.FLUSH_CHARS:
+            self._counted += estimate_tokens("".join(self._pending))
+            self._pending = []
+            self._pending_chars = 0
+        return self.total
+
+    @property
+    def total(self) -> int:
+        """Token estimate of all text added so far"""
+        return self._counted + estimate_tokens("".join(self._pending))
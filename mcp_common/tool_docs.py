@@ -0,0 +1,97 @@
+"""工具说明模块
+
+从工具函数的签名和文档字符串（Args 部分）生成 use_description 返回的工具说明，
+说明中的参数、类型、是否必填和默认值与实际注册的工具保持一致，不需要手工维护。
+"""
+
+import re
+import types
+import typing
+import inspect
+
+# 注解类型对应的JSON类型
+_JSON_TYPES = {str: "string", bool: "boolean", int: "integer", float: "number", list: "array", dict: "object"}
+
+# 文档字符串中的小节标题，例如 "Args:"、"Returns:"
+_SECTION = re.compile(r"^([A-Z][A-Za-z ]*):$")
+_ARG = re.compile(r"^(\w+)\s*(?:\([^)]*\))?:\s*(.*)$")
+
+def parse_docstring(doc: str) -> tuple:
+    """Split a Google style docstring into its description and argument descriptions
+
+    Returns:
+        tuple: (description, {argument name: description})
+    """
+    paragraphs = [[]]
+    args = {}
+    indents = {}
+    section = None
+    current = None
+    for line in inspect.cleandoc(doc or "").splitlines():
+        stripped = line.strip()
+        indent = len(line) - len(line.lstrip())
+        header = _SECTION.match(stripped)
+        if header:
+            section = header.group(1)
+            current = None
+        elif section is None:
+            if stripped:
+                paragraphs[-1].append(stripped)
+            elif paragraphs[-1]:
+                paragraphs.append([])
+        elif section == "Args" and stripped:
+            match = _ARG.match(stripped)
+            if match and (current is None or indent <= indents[current]):
+                current = match.group(1)
+                args[current] = match.group(2)
+                indents[current] = indent
+            elif current:
+                # 参数说明的续行
+                args[current] = f"{args[current]} {stripped}"
+    description = "\n\n".join(" ".join(lines) for lines in paragraphs if lines)
+    return description, args
+
+def json_type(annotation):
+    """JSON type name of a parameter annotation, a list of names for unions, None if unknown"""
+    origin = typing.get_origin(annotation)
+    if origin in (typing.Union, types.UnionType):
+        names = []
+        for arg in typing.get_args(annotation):
+            if arg is type(None):
+                continue
+            name = json_type(arg)
+            if name and name not in names:
+                names.append(name)
+        return names[0] if len(names) == 1 else names or None
+    return _JSON_TYPES.get(origin or annotation)
+
+def describe_tool(name: str, fn, skip: tuple = ("ctx",)) -> dict:
+    """Description of one tool function
+
+    Args:
+        name: Name the tool is registered under
+        fn: Tool function, or a registered tool object wrapping it in .fn
+        skip: Parameters injected by the server rather than passed by the client
+
+    Returns:
+        dict: name, description and parameters with type, description, required and default
+    """
+    fn = getattr(fn, "fn", fn)
+    description, arg_docs = parse_docstring(fn.__doc__)
+    parameters = {}
+    for param in inspect.signature(fn).parameters.values():
+        if param.name in skip or param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+            continue
+        info = {
+            "type": json_type(param.annotation) if param.annotation is not param.empty else None,
+            "description": arg_docs.get(param.name, ""),
+            "required": param.default is param.empty
+        }
+        if param.default is not param.empty and param.default is not None:
+            info["default"] = param.default
+        parameters[param.name] = info
+    return {"name": name, "description": description, "parameters": parameters}
+
+def describe_tools(tools) -> list:
+    """Descriptions of tool functions given as (name, function) pairs, in order"""
+    return [describe_tool(name, fn) for name, fn in tools]
@@ -0,0 +1,125 @@
+"""服务传输模块
+
+默认通过stdio为单个编辑器提供服务。设置 MCP_TRANSPORT=http（streamable HTTP）
+或 sse 后，服务以网络方式运行，一个常驻进程可以同时为多个编辑器和项目服务，
+共享结果缓存、连接池、限流器和后台任务队列。
+
+网络模式下每个请求通过 project_path 指定自己的项目，可以用
+ALLOWED_PROJECT_ROOTS 限制允许访问的项目目录。
+"""
+
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 传输方式：stdio / http（streamable HTTP）/ sse
+MCP_TRANSPORT = os.environ.get("MCP_TRANSPORT", "stdio").lower()
+MCP_HOST = os.environ.get("MCP_HOST", "127.0.0.1")
+MCP_PORT = int(os.environ.get("MCP_PORT", "8000"))
+# 同时处理的HTTP连接和请求数上限，超出时返回503，0表示不限制
+MCP_HTTP_CONCURRENCY = int(os.environ.get("MCP_HTTP_CONCURRENCY", "64"))
+# 允许访问的项目根目录，多个目录用路径分隔符分隔，为空时不限制
+ALLOWED_PROJECT_ROOTS = [os.path.realpath(d) for d in os.environ.get("ALLOWED_PROJECT_ROOTS", "").split(os.pathsep) if d]
+
+HTTP_TRANSPORTS = ("http", "streamable-http", "sse")
+
+def project_allowed(project_path: str) -> bool:
+    """Whether a request may read and write inside project_path
+
+    Args:
+        project_path: Project root directory of the request
+
+    Returns:
+        bool: True if no roots are configured or the path lies inside one of them
+    """
+    if not ALLOWED_PROJECT_ROOTS:
+        return True
+    path = os.path.realpath(project_path)
+    return any(path == root or path.startswith(root + os.sep) for root in ALLOWED_PROJECT_ROOTS)
+
+class SharedLifespan:
+    """Server lifespan shared by every client session of one process
+
+    Over stdio there is a single session and the lifespan simply wraps it.
+    Over HTTP the MCP frameworks enter the lifespan once per client session,
+    so the wrapped lifespan is entered once around the whole HTTP server
+    instead, and sessions only receive its state. A disconnecting editor
+    therefore never closes the pooled clients or stops the job workers other
+    editors are using.
+    """
+
+    def __init__(self, lifespan):
+        """
+        Args:
+            lifespan: Async context manager factory lifespan(server) yielding the server state
+        """
+        self.lifespan = lifespan
+        self._state = None
+        self._held = False
+
+    @asynccontextmanager
+    async def session(self, server):
+        """Lifespan passed to the MCP framework, entered for every client session"""
+        if self._held:
+            yield self._state
+            return
+        async with self.lifespan(server) as state:
+            yield state
+
+    @asynccontextmanager
+    async def hold(self, server):
+        """Enter the lifespan for the lifetime of the process"""
+        async with self.lifespan(server) as state:
+            self._state = state
+            self._held = True
+            try:
+                yield state
+            finally:
+                self._held = False
+                self._state = None
+
+def _http_app(server, transport: str):
+    """ASGI app of an MCP server for the given network transport"""
+    if hasattr(server, "http_app"):
+        return server.http_app(transport="sse" if transport == "sse" else "http")
+    if transport == "sse":
+        return server.sse_app()
+    return server.streamable_http_app()
+
+async def _serve_http(server, lifespan: SharedLifespan, transport: str, host: str, port: int, concurrency: int) -> None:
+    import uvicorn
+
+    config = uvicorn.Config(
+        _http_app(server, transport),
+        host=host,
+        port=port,
+        limit_concurrency=concurrency or None,
+        log_level="info"
+    )
+    async with lifespan.hold(server):
+        await uvicorn.Server(config).serve()
+
+def run_server(server, lifespan: SharedLifespan, transport: str = MCP_TRANSPORT, host: str = MCP_HOST, port: int = MCP_PORT, concurrency: int = MCP_HTTP_CONCURRENCY) -> None:
+    """Run an MCP server over stdio or as a long-lived HTTP/SSE server
+
+    Args:
+        server: FastMCP server instance
+        lifespan: Shared lifespan the server was created with
+        transport: stdio, http (streamable HTTP) or sse
+        host: Interface to listen on for network transports
+        port: Port to listen on for network transports
+        concurrency: Maximum concurrent HTTP connections, 0 for no limit
+    """
+    if transport not in HTTP_TRANSPORTS:
+        if transport != "stdio":
+            logger.warning("Unknown MCP_TRANSPORT %s, using stdio", transport)
+        server.run()
+        return
+    logger.info("Serving MCP over %s on http://%s:%s", transport, host, port)
+    if ALLOWED_PROJECT_ROOTS:
+        logger.info("Allowed project roots: %s", ', '.join(ALLOWED_PROJECT_ROOTS))
+    asyncio.run(_serve_http(server, lifespan, transport, host, port, concurrency))
@@ -6,28 +6,87 @@ GPT服务模块 - 负责与OpenAI API通信，生成提示词
 """
 
 import os
+import re
+import json
+import asyncio
 import logging
-from openai import OpenAI
+from mcp_common.client_pool import get_async_client
+from mcp_common.rate_limit import estimate_request_tokens
+from mcp_common.tokens import estimate_tokens, TokenCounter
+from mcp_common.endpoints import acall_with_failover, astream_with_failover, HEDGE_DELAY
+from mcp_common.settings import LLMSettings
+from mcp_common.response_cache import ResponseCache, make_cache_key
+from mcp_common.metrics import metrics, span, set_labels, record_usage, record_cancelled
+from mcp_common.budget import fit_messages, check_budget, charge
 
 # 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger('prompt-gen.gpt_service')
 
-# 环境变量配置
-API_KEY = os.environ.get("API_KEY", "")
-MODEL = os.environ.get("MODEL", "gpt-4")
-API_URL = os.environ.get("API_URL", "https://api.openai.com/v1")
+# 生成参数
+TEMPERATURE = 0.7
+MAX_TOKENS = 1000
 
-def generate_prompt(
-    purpose: str,
-    rules: str,
-    language: str
-) -> dict:
+# 输入超出 MAX_INPUT_TOKENS 时依次压缩、截断的用户输入
+SHRINK_ORDER = ("rules", "purpose")
+BATCH_SHRINK_ORDER = ("rules",)
+
+# 结构化输出方式：json_schema（按schema约束输出）/ json_object（只保证输出JSON）/ none（只靠提示词约束），
+# 端点拒绝某种方式时自动降级到下一种
+PROMPT_RESPONSE_FORMAT = os.environ.get("PROMPT_RESPONSE_FORMAT", "json_schema").lower()
+RESPONSE_FORMATS = ("json_schema", "json_object", "none")
+# 批量生成时一次请求最多包含的提示词数
+PROMPT_BATCH_SIZE = int(os.environ.get("PROMPT_BATCH_SIZE", "8"))
+# 批量请求的输出token上限，每个提示词按 MAX_TOKENS 计算
+PROMPT_BATCH_MAX_TOKENS = int(os.environ.get("PROMPT_BATCH_MAX_TOKENS", "8000"))
+
+PROMPT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "content": {"type": "string"}
+    },
+    "required": ["title", "content"],
+    "additionalProperties": False
+}
+
+BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "prompts": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "index": {"type": "integer"},
+                    "title": {"type": "string"},
+                    "content": {"type": "string"}
+                },
+                "required": ["index", "title", "content"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["prompts"],
+    "additionalProperties": False
+}
+
+CODE_FENCE_PATTERN = re.compile(r"^```(?:json)?\s*(.*?)\s*```$", re.DOTALL)
+
+# API地址 -> 该端点可以使用的结构化输出方式
+_response_formats = {}
+
+# 系统提示词 - 对所有语言保持一致
+SYSTEM_PROMPT = "You are an expert AI prompt engineer who creates effective prompts based on user requirements. You can create prompts in multiple languages as requested."
+
+# 生成结果缓存
+response_cache = ResponseCache.from_env("prompt-gen")
+
+def build_messages(purpose: str, rules: str, language: str) -> list:
     """
-    调用OpenAI API生成提示词
+    构造生成提示词的对话消息
+    
+    说明和输出格式在前，规则其次，目的在最后，相同语言和规则的请求共享字节完全一致的前缀，
+    可以命中服务商的提示词缓存
     
     Args:
         purpose: The purpose of the prompt - what it's intended to do
@@ -35,31 +94,12 @@ def generate_prompt(
         language: The language the prompt should be generated in
         
     Returns:
-        dict: Dictionary containing the generated prompt content and title
-              {"title": prompt_title, "content": prompt_content}
+        list: Chat completion messages
     """
-    if not API_KEY:
-        logger.warning("API_KEY environment variable is not set")
-    
-    try:
-        # 创建OpenAI客户端，使用环境变量中的配置
-        client = OpenAI(
-            api_key=API_KEY,
-            base_url=API_URL
-        )
-        
-        logger.info(f"Using model: {MODEL}, API base URL: {API_URL}")
-
-        # 构造提示词模板
-        prompt = f"""
+    # 构造提示词模板，固定部分在前，可变部分在最后
+    prompt = f"""
         You are a professional AI prompt engineer tasked with creating an effective prompt.
         
-        Prompt Purpose:
-        {purpose}
-        
-        Global Rules:
-        {rules}
-        
         Please provide your response in the following JSON format:
         {{
           "title": "A descriptive title for this prompt (3-5 words)",
@@ -67,57 +107,456 @@ def generate_prompt(
         }}
         
         Instructions:
-        1. Create a well-structured, effective prompt based on the purpose and rules provided.
+        1. Create a well-structured, effective prompt based on the purpose and rules given below.
         2. The prompt should be in {language} language.
         3. The title should be concise but descriptive.
         4. Make sure both the title and content are in {language} language.
         5. IMPORTANT: Return your response only in valid JSON format as specified above, with no additional text.
+        
+        Global Rules:
+        {rules}
+        
+        Prompt Purpose:
+        {purpose}
         """
+    
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+def parse_prompt_response(response_content: str, purpose: str) -> tuple:
+    """
+    解析模型返回的JSON格式提示词
+    
+    Args:
+        response_content: Raw response text
+        purpose: The purpose of the prompt, used for the fallback title
         
-        logger.info("Sending request to OpenAI API...")
+    Returns:
+        tuple: (result dict, whether the response was valid JSON with the required fields)
+    """
+    # 回退：使用前50字符作为标题
+    fallback = {
+        "title": purpose[:50].strip() if len(purpose) > 0 else "Generated Prompt",
+        "content": response_content
+    }
+    try:
+        # 尝试解析JSON响应
+        result = json.loads(_strip_code_fence(response_content))
+    except json.JSONDecodeError:
+        logger.warning("Failed to parse JSON response, using fallback")
+        return fallback, False
+    
+    # 确保结果包含所需字段
+    if not isinstance(result, dict) or 'title' not in result or 'content' not in result:
+        logger.warning("Response missing required fields, using fallback")
+        return fallback, False
+    return result, True
+
+def build_batch_messages(purposes: list, rules: str, language: str) -> list:
+    """
+    构造一次生成多个提示词的对话消息，所有提示词共用同一组规则和语言
+    
+    与 build_messages 相同，目的列表放在最后
+    
+    Args:
+        purposes: Purposes of the prompts, identified by their index in the list
+        rules: Global rules shared by all prompts
+        language: The language the prompts should be generated in
+        
+    Returns:
+        list: Chat completion messages
+    """
+    items = "\n        ".join(f"[{index}] {purpose}" for index, purpose in enumerate(purposes))
+    prompt = f"""
+        You are a professional AI prompt engineer tasked with creating several effective prompts that share the same global rules.
+        
+        Please provide your response in the following JSON format, with exactly one entry per purpose:
+        {{
+          "prompts": [
+            {{"index": 0, "title": "A descriptive title for this prompt (3-5 words)", "content": "The complete prompt text here"}}
+          ]
+        }}
+        
+        Instructions:
+        1. Create a well-structured, effective prompt for each purpose given below, following the global rules.
+        2. The prompts should be in {language} language.
+        3. Each title should be concise but descriptive.
+        4. Make sure all titles and contents are in {language} language.
+        5. IMPORTANT: Return your response only in valid JSON format as specified above, with no additional text.
+        
+        Global Rules:
+        {rules}
         
-        # 系统提示词 - 对所有语言保持一致
-        system_prompt = "You are an expert AI prompt engineer who creates effective prompts based on user requirements. You can create prompts in multiple languages as requested."
+        Prompt Purposes ({len(purposes)} in total, create one prompt for each, identified by its index):
+        {items}
+        """
+    
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+def build_repair_messages(entries: dict, rules: str, language: str) -> list:
+    """
+    构造修复批量结果中无效条目的对话消息，只重新处理这些条目
+    
+    Args:
+        entries: Index -> (purpose, previous raw output of the entry or None if it was missing)
+        rules: Global rules shared by all prompts
+        language: The language the prompts should be generated in
         
-        # 调用OpenAI API
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=1000,
-        )
+    Returns:
+        list: Chat completion messages
+    """
+    items = "\n        ".join(
+        f"[{index}] Purpose: {purpose}\n        Previous output: {previous if previous else 'missing'}"
+        for index, (purpose, previous) in sorted(entries.items())
+    )
+    prompt = f"""
+        Some prompts generated earlier for the purposes below were missing or were not valid entries with a non-empty "title" and "content".
+        Fix only the entries below: keep the usable parts of a previous output, and write the prompt from its purpose where the output is missing.
+        Return only valid JSON in the format {{"prompts": [{{"index": <index>, "title": "...", "content": "..."}}]}} with one entry for each index below.
+        Make sure all titles and contents are in {language} language.
         
-        # 提取生成的提示词（JSON格式）
-        response_content = response.choices[0].message.content.strip()
+        Global Rules:
+        {rules}
         
+        {items}
+        """
+    
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+def _batch_items(response_content: str) -> list:
+    """Entries of a batch response, salvaging the complete ones from cut-off JSON"""
+    text = _strip_code_fence(response_content)
+    try:
+        result = json.loads(text)
+    except json.JSONDecodeError:
+        result = None
+    if isinstance(result, dict) and isinstance(result.get("prompts"), list):
+        return result["prompts"]
+    if isinstance(result, list):
+        return result
+    # 输出被截断或格式有误时，逐个解析数组中完整的条目
+    decoder = json.JSONDecoder()
+    items = []
+    position = text.find("[")
+    if position < 0:
+        return items
+    position += 1
+    while True:
+        while position < len(text) and text[position] in " \t\r\n,":
+            position += 1
+        if position >= len(text) or text[position] != "{":
+            return items
         try:
-            # 尝试解析JSON响应
-            import json
-            result = json.loads(response_content)
-            
-            # 确保结果包含所需字段
-            if 'title' not in result or 'content' not in result:
-                logger.warning("Response missing required fields, using fallback")
-                # 回退：使用前50字符作为标题
-                result = {
-                    "title": purpose[:50].strip() if len(purpose) > 0 else "Generated Prompt",
-                    "content": response_content
-                }
-        except json.JSONDecodeError:
-            logger.warning("Failed to parse JSON response, using fallback")
-            # 使用前50字符作为标题
-            result = {
-                "title": purpose[:50].strip() if len(purpose) > 0 else "Generated Prompt",
-                "content": response_content
-            }
+            item, position = decoder.raw_decode(text, position)
+        except ValueError:
+            return items
+        items.append(item)
+
+def parse_batch_response(response_content: str, count: int) -> tuple:
+    """
+    解析批量生成返回的JSON，区分有效和无效的条目
+    
+    Args:
+        response_content: Raw response text
+        count: Number of prompts requested
+        
+    Returns:
+        tuple: (index -> {"title", "content"} of valid entries, index -> raw entry JSON or None for invalid or missing entries)
+    """
+    valid = {}
+    invalid = {}
+    for item in _batch_items(response_content):
+        index = item.get("index") if isinstance(item, dict) else None
+        if not isinstance(index, int) or not 0 <= index < count or index in valid:
+            continue
+        title, content = item.get("title"), item.get("content")
+        if isinstance(title, str) and title.strip() and isinstance(content, str) and content.strip():
+            valid[index] = {"title": title.strip(), "content": content}
+            invalid.pop(index, None)
+        else:
+            invalid[index] = json.dumps(item, ensure_ascii=False)
+    for index in range(count):
+        if index not in valid:
+            invalid.setdefault(index, None)
+    return valid, invalid
+
+def _cache_key(messages: list, settings: LLMSettings) -> str:
+    """Cache key for a rendered request, the API key is deliberately left out"""
+    return make_cache_key(
+        messages=messages,
+        model=settings.model,
+        api_url=settings.api_url,
+        temperature=TEMPERATURE,
+        max_tokens=MAX_TOKENS
+    )
+
+def _strip_code_fence(text: str) -> str:
+    """Remove a Markdown code fence the model may wrap its JSON in"""
+    match = CODE_FENCE_PATTERN.match(text.strip())
+    return match.group(1) if match else text
+
+def _response_format(api_url: str) -> str:
+    """Structured output mode used for an endpoint"""
+    default = PROMPT_RESPONSE_FORMAT if PROMPT_RESPONSE_FORMAT in RESPONSE_FORMATS else "none"
+    return _response_formats.get(api_url, default)
+
+def _format_kwargs(kind: str, name: str, schema: dict) -> dict:
+    """response_format argument of a chat completion for a structured output mode"""
+    if kind == "json_schema":
+        return {"response_format": {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}}
+    if kind == "json_object":
+        return {"response_format": {"type": "json_object"}}
+    return {}
+
+def _downgrade_format(api_url: str, error: Exception) -> bool:
+    """Switch an endpoint to a plainer structured output mode after it rejected the current one
+    
+    Returns:
+        bool: True if the request should be retried with the plainer mode
+    """
+    # 出错时客户端已经创建，OpenAI SDK 已经导入
+    import openai
+    kind = _response_format(api_url)
+    message = str(error).lower()
+    if kind == "none" or not isinstance(error, openai.BadRequestError):
+        return False
+    if not any(word in message for word in ("response_format", "json_schema", "json_object")):
+        return False
+    _response_formats[api_url] = RESPONSE_FORMATS[RESPONSE_FORMATS.index(kind) + 1]
+    logger.warning("%s rejected response_format %s, falling back to %s", api_url, kind, _response_formats[api_url])
+    return True
+
+async def _collect_stream(chunks, endpoint: LLMSettings, output: TokenCounter) -> tuple:
+    """Text, usage and answering endpoint of a streamed completion
+    
+    The usage comes with the last chunk when include_usage is requested;
+    endpoint is returned unchanged if the stream yields nothing. output counts
+    the tokens received so far, also when the stream is cancelled.
+    """
+    parts = []
+    usage = None
+    try:
+        async for chunk, endpoint in chunks:
+            usage = getattr(chunk, "usage", None) or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                output.add(chunk.choices[0].delta.content)
+    finally:
+        # 关闭流，中断进行中的HTTP请求
+        await chunks.aclose()
+    return "".join(parts), usage, endpoint
+
+async def _complete_json(settings: LLMSettings, messages: list, max_tokens: int, name: str, schema: dict) -> str:
+    """Run a chat completion in the endpoint's structured output mode and return its text
+    
+    With hedging enabled and fallback endpoints configured the completion is
+    streamed internally, so a slow first token can be hedged.
+    """
+    await asyncio.to_thread(check_budget, estimate_request_tokens(messages, 0))
+    hedged = HEDGE_DELAY > 0 and bool(settings.fallbacks)
+    while True:
+        issued = False
+        # 最后一个发出请求的端点，拒绝结构化输出时按它降级
+        attempted = settings
+        output = TokenCounter()
         
-        logger.info(f"Successfully generated prompt: {result['title']}")
+        def create(endpoint: LLMSettings, **kwargs):
+            nonlocal issued, attempted
+            # 取得限流配额后才会调用，此时请求才真正发出
+            issued = True
+            attempted = endpoint
+            return get_async_client(endpoint.api_url, endpoint.api_key).chat.completions.create(
+                model=endpoint.model,
+                messages=messages,
+                temperature=TEMPERATURE,
+                max_tokens=max_tokens,
+                **_format_kwargs(_response_format(endpoint.api_url), name, schema),
+                **kwargs
+            )
         
+        try:
+            with span("generation"):
+                if hedged:
+                    content, usage, endpoint = await _collect_stream(astream_with_failover(settings, estimate_request_tokens(messages, max_tokens), lambda endpoint: create(endpoint, stream=True, stream_options={"include_usage": True})), settings, output)
+                else:
+                    response, endpoint = await acall_with_failover(settings, estimate_request_tokens(messages, max_tokens), create)
+                    content, usage = response.choices[0].message.content or "", response.usage
+            break
+        except asyncio.CancelledError:
+            # 取消会中断进行中的HTTP请求，模型不再继续生成
+            record_cancelled(estimate_request_tokens(messages, 0), output.total, max_tokens, issued)
+            logger.info("Upstream call cancelled")
+            raise
+        except Exception as e:
+            if not _downgrade_format(attempted.api_url, e):
+                raise
+    # 服务商没有报告用量时按返回的文本估算输出token数
+    record_usage(usage, estimate_request_tokens(messages, 0), estimate_tokens(content))
+    # 按实际返回结果的端点的模型计费
+    await asyncio.to_thread(charge, usage, endpoint.model, estimate_request_tokens(messages, 0), estimate_tokens(content))
+    return content.strip()
+
+async def agenerate_prompt(
+    purpose: str,
+    rules: str,
+    language: str,
+    settings: LLMSettings = None,
+    use_cache: bool = True
+) -> dict:
+    """
+    异步调用OpenAI API生成提示词，不阻塞事件循环，多个请求可以同时进行
+    
+    Args:
+        purpose: The purpose of the prompt - what it's intended to do
+        rules: Global rules - the overall rules and constraints set by user
+        language: The language the prompt should be generated in
+        settings: Request-scoped model/endpoint settings (optional, default from environment)
+        use_cache: Whether to reuse a cached response for identical requests
+        
+    Returns:
+        dict: Dictionary containing the generated prompt content and title
+              {"title": prompt_title, "content": prompt_content}
+    """
+    settings = settings or LLMSettings.from_env()
+    if not settings.api_key:
+        logger.warning("API_KEY environment variable is not set")
+    set_labels(model=settings.model)
+    
+    with span("prompt_build"):
+        messages = fit_messages(build_messages, SHRINK_ORDER, purpose=purpose, rules=rules, language=language)
+        cache_key = _cache_key(messages, settings)
+    if use_cache:
+        cached = await asyncio.to_thread(response_cache.get, cache_key)
+        metrics.count("cache_hits" if cached is not None else "cache_misses")
+        if cached is not None:
+            logger.info("Cache hit for prompt: %s", cached['title'])
+            return cached
+    
+    try:
+        logger.info("Using model: %s, API base URL: %s", settings.model, settings.api_url)
+        logger.info("Sending request to OpenAI API...")
+        
+        response_content = await _complete_json(settings, messages, MAX_TOKENS, "prompt", PROMPT_SCHEMA)
+        result, valid = parse_prompt_response(response_content, purpose)
+        if not valid:
+            metrics.count("parse_failures")
+        
+        logger.info("Successfully generated prompt: %s", result['title'])
+        
+        # 只缓存格式正确的结果，回退结果下次重新生成
+        if valid:
+            await asyncio.to_thread(response_cache.set, cache_key, result)
         return result
     
     except Exception as e:
-        logger.error(f"Failed to call GPT service: {str(e)}")
+        logger.error("Failed to call GPT service: %s", e)
         raise Exception(f"Failed to call GPT service: {str(e)}")
+
+def _batch_cache_key(purpose: str, rules: str, language: str, settings: LLMSettings) -> str:
+    """Cache key of one prompt of a batch, independent of the other prompts in the batch"""
+    return make_cache_key(
+        kind="batch",
+        purpose=purpose,
+        rules=rules,
+        language=language,
+        model=settings.model,
+        api_url=settings.api_url,
+        temperature=TEMPERATURE
+    )
+
+async def _agenerate_batch(purposes: list, rules: str, language: str, settings: LLMSettings) -> dict:
+    """
+    用一次请求生成一批提示词，无效或缺失的条目再发一次只包含这些条目的修复请求
+    
+    Returns:
+        dict: Index in purposes -> {"title", "content"} of the prompts generated successfully
+    """
+    with span("prompt_build"):
+        messages = fit_messages(build_batch_messages, BATCH_SHRINK_ORDER, purposes=purposes, rules=rules, language=language)
+    response_content = await _complete_json(settings, messages, min(PROMPT_BATCH_MAX_TOKENS, MAX_TOKENS * len(purposes)), "prompt_batch", BATCH_SCHEMA)
+    valid, invalid = parse_batch_response(response_content, len(purposes))
+    if not invalid:
+        return valid
+    
+    logger.warning("%s of %s prompts in the batch are invalid, requesting a repair", len(invalid), len(purposes))
+    metrics.count("parse_failures", len(invalid))
+    metrics.count("repairs", len(invalid))
+    with span("prompt_build"):
+        repair_messages = fit_messages(build_repair_messages, BATCH_SHRINK_ORDER, entries={index: (purposes[index], previous) for index, previous in invalid.items()}, rules=rules, language=language)
+    response_content = await _complete_json(settings, repair_messages, min(PROMPT_BATCH_MAX_TOKENS, MAX_TOKENS * len(invalid)), "prompt_batch", BATCH_SCHEMA)
+    repaired, _ = parse_batch_response(response_content, len(purposes))
+    valid.update({index: repaired[index] for index in invalid if index in repaired})
+    return valid
+
+async def agenerate_prompts(
+    purposes: list,
+    rules: str,
+    language: str,
+    settings: LLMSettings = None,
+    use_cache: bool = True
+) -> list:
+    """
+    批量生成多个共用规则和语言的提示词，尽量合并到少量请求中
+    
+    Purposes are packed PROMPT_BATCH_SIZE at a time (fewer if
+    PROMPT_BATCH_MAX_TOKENS cannot hold that many outputs) into requests that
+    use the provider's structured output mode, and the requests run
+    concurrently. Every prompt is cached on its own.
+    
+    Args:
+        purposes: Purposes of the prompts
+        rules: Global rules shared by all prompts
+        language: The language the prompts should be generated in
+        settings: Request-scoped model/endpoint settings (optional, default from environment)
+        use_cache: Whether to reuse cached prompts for identical purposes
+        
+    Returns:
+        list: (result, error) for every purpose in order, result is {"title", "content"} or None if the prompt failed
+    """
+    settings = settings or LLMSettings.from_env()
+    if not settings.api_key:
+        logger.warning("API_KEY environment variable is not set")
+    set_labels(model=settings.model)
+    
+    results = [None] * len(purposes)
+    errors = [None] * len(purposes)
+    keys = [_batch_cache_key(purpose, rules, language, settings) for purpose in purposes]
+    pending = []
+    for index, key in enumerate(keys):
+        cached = await asyncio.to_thread(response_cache.get, key) if use_cache else None
+        if use_cache:
+            metrics.count("cache_hits" if cached is not None else "cache_misses")
+        if cached is not None:
+            results[index] = cached
+        else:
+            pending.append(index)
+    
+    size = max(1, min(PROMPT_BATCH_SIZE, PROMPT_BATCH_MAX_TOKENS // MAX_TOKENS))
+    batches = [pending[i:i + size] for i in range(0, len(pending), size)]
+    logger.info("Generating %s prompts in %s requests, %s from cache", len(pending), len(batches), len(purposes) - len(pending))
+    
+    async def run_batch(batch: list) -> None:
+        try:
+            generated = await _agenerate_batch([purposes[index] for index in batch], rules, language, settings)
+        except Exception as e:
+            logger.error("Failed to call GPT service: %s", e)
+            for index in batch:
+                errors[index] = f"Failed to call GPT service: {str(e)}"
+            return
+        for position, index in enumerate(batch):
+            if position in generated:
+                results[index] = generated[position]
+                await asyncio.to_thread(response_cache.set, keys[index], generated[position])
+            else:
+                errors[index] = "The model did not return a valid prompt for this purpose, even after a repair request"
+    
+    await asyncio.gather(*(run_batch(batch) for batch in batches))
+    return list(zip(results, errors))
@@ -7,19 +7,32 @@
 """
 
 import os
+import sys
 import json
+import asyncio
 import logging
 import re
 from mcp.server import FastMCP
 from mcp import types
 
-from proxy.gpt_service import generate_prompt
+# 两个服务共用的 mcp_common 包在仓库根目录
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from proxy.gpt_service import agenerate_prompt, agenerate_prompts, response_cache
+from mcp_common.client_pool import pool_lifespan
+from mcp_common.settings import LLMSettings, STATE_FOLDER
+from mcp_common.singleflight import SingleFlight, normalize_key
+from mcp_common.jobs import JobQueue, JobQueueFull, FINISHED_STATES
+from mcp_common.rate_limit import limiter_stats
+from mcp_common.endpoints import endpoint_stats
+from mcp_common.transport import SharedLifespan, run_server, project_allowed
+from mcp_common.metrics import metrics, span, traced
+from mcp_common.budget import budgeted, ledger_for, budget_status, PROJECT_BUDGET_DAYS
+from mcp_common.library import Library, LIBRARY_FOLDERS
+from mcp_common.similar_cache import SimilarCache, make_scope
+from mcp_common.tool_docs import describe_tools
+from contextlib import asynccontextmanager
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger('prompt-gen')
 
 # 环境变量配置
@@ -30,177 +43,726 @@ API_URL = os.environ.get("API_URL", "https://api.openai.com/v1")
 # 提示词保存目录
 PROMPT_SAVE_FOLDER = "prompts"
 
+# 导出的Prometheus指标名前缀
+metrics.namespace = "prompt_gen"
+
+# 合并相同输入的并发生成请求
+inflight = SingleFlight()
+
+# 相似请求缓存，换一种说法描述的重复请求复用之前的结果
+similar_cache = SimilarCache.from_env("prompt-gen")
+
+# 项目 prompts/ 和 doc/ 目录的检索索引
+library = Library.from_env("prompt-gen")
+
+# 后台任务队列，任务状态保存在项目的 .cursor-copilot/jobs/prompt-gen 目录
+job_queue = JobQueue("prompt-gen", os.path.join(STATE_FOLDER, "jobs", "prompt-gen"), runners={
+    "prompt": lambda **params: _create_prompt(**params)
+})
+
+@asynccontextmanager
+async def server_lifespan(server):
+    """Start the background job workers, stop them and close pooled clients on shutdown"""
+    async with pool_lifespan(server) as state:
+        metrics.start_exporter()
+        await job_queue.start()
+        try:
+            yield state
+        finally:
+            await job_queue.stop()
+            library.close()
+            similar_cache.close()
+
+# 网络模式下所有客户端会话共享同一个生命周期
+lifespan = SharedLifespan(server_lifespan)
+
 # 创建 FastMCP 实例
-mcp_server = FastMCP(name="prompt-gen")
+mcp_server = FastMCP(name="prompt-gen", lifespan=lifespan.session)
+
+def _write_prompt(save_path: str, title: str, content: str) -> None:
+    with open(save_path, 'w', encoding='utf-8') as f:
+        # Add title and content
+        f.write(f"# {title}\n\n{content}")
+
+def _prompt_file_name(title: str, file_name: str = "") -> str:
+    """File name of a saved prompt, derived from its title when not given"""
+    # 如果未提供文件名，根据标题生成
+    if not file_name:
+        # Clean title, replace invalid characters, limit length
+        clean_title = re.sub(r'[\\/:*?"<>|]', '_', title)  # Replace invalid characters
+        clean_title = clean_title.replace(' ', '_')  # Replace spaces with underscores
+        file_name = f"{clean_title[:50]}.md"  # Limit length and add extension
+        logger.info("Generated file name from title: %s", file_name)
+    elif not file_name.endswith('.md'):
+        file_name = f"{file_name}.md"
+        logger.info("File name added extension: %s", file_name)
+    return file_name
+
+async def _generate_and_save(purpose: str, rules: str, language: str, prompt_dir: str, file_name: str, settings: LLMSettings, use_cache: bool) -> tuple:
+    """
+    Generate a prompt and save it into the prompt directory
+    
+    Returns:
+        tuple: (saved file path, prompt title, prompt content)
+    """
+    # 调用GPT服务生成提示词
+    prompt_result = await agenerate_prompt(
+        purpose=purpose,
+        rules=rules,
+        language=language,
+        settings=settings,
+        use_cache=use_cache
+    )
+    
+    # 提取标题和内容
+    prompt_title = prompt_result.get('title', '提示词')
+    prompt_content = prompt_result.get('content', '')
+    
+    # Save prompt to file
+    save_path = os.path.join(prompt_dir, _prompt_file_name(prompt_title, file_name))
+    with span("file_write"):
+        await asyncio.to_thread(_write_prompt, save_path, prompt_title, prompt_content)
+    
+    logger.info("Prompt saved: %s", save_path)
+    return save_path, prompt_title, prompt_content
 
-@mcp_server.add_tool
-def generate_document(
+async def _similar_result(match: dict, prompt_dir: str, file_name: str) -> dict:
+    """
+    Tool response for a request matching an earlier, similar one
+    
+    In return mode the earlier prompt is saved into the prompt directory, in
+    offer mode nothing is written and the earlier prompt is only reported.
+    
+    Returns:
+        dict: Tool response with success, error, prompt and the similar request
+    """
+    prompt_title = match["value"].get("title", "提示词")
+    prompt_content = match["value"].get("content", "")
+    similar = {
+        "similarity": match["similarity"],
+        "request": match["request"],
+        "path": match["path"],
+        "created": match["created"]
+    }
+    if similar_cache.mode == "offer":
+        return {
+            "success": True,
+            "error": None,
+            "message": "A very similar prompt was generated before, no new prompt was created. Use it, or call again with use_cache set to false to generate a new one.",
+            "prompt": None,
+            "similar": {**similar, "title": prompt_title, "content": prompt_content}
+        }
+    
+    save_path = os.path.join(prompt_dir, _prompt_file_name(prompt_title, file_name))
+    with span("file_write"):
+        await asyncio.to_thread(_write_prompt, save_path, prompt_title, prompt_content)
+    logger.info("Prompt saved from a similar request (similarity %s): %s", match["similarity"], save_path)
+    return {
+        "success": True,
+        "error": None,
+        "message": "I have created the prompt file from a very similar earlier request. If it does not fit, call again with use_cache set to false to generate a new one.",
+        "prompt": {
+            "path": save_path,
+            "title": prompt_title,
+            "content": prompt_content,
+            "coalesced": False
+        },
+        "similar": similar
+    }
+
+@traced("generate_prompt", template_type="prompt")
+@budgeted()
+async def _create_prompt(
     purpose: str,
     rules: str,
     language: str,
     project_path: str,
     file_name: str = "",
     model: str = "",
-    api_base_url: str = ""
-) -> list:
+    api_base_url: str = "",
+    use_cache: bool = True
+) -> dict:
     """
-    Generate AI prompt based on user requirements
+    Validate a prompt request, generate the prompt and save it into prompts/
     
-    Args:
-        purpose: The purpose of the prompt - what it's intended to do
-        rules: Global rules - the overall rules and constraints set by user
-        language: The language the prompt should be generated in
-        project_path: Project root directory path
-        file_name: Optional, file name for generated prompt (without path, with extension), will be generated from title if not provided
-        model: Optional, custom OpenAI model to use
-        api_base_url: Optional, custom OpenAI API base URL
-        
     Returns:
-        List: Contains the generated result JSON string
+        dict: Tool response with success, error and prompt information
     """
     
     # 验证参数
     if not purpose or not rules or not language or not project_path:
         error_msg = "Purpose, rules, language, and project_path cannot be empty"
         logger.error(error_msg)
-        return [
-            types.TextContent(
-                type="text",
-                text=json.dumps({
-                    "success": False,
-                    "error": error_msg,
-                    "prompt": None
-                }, ensure_ascii=False)
-            )
-        ]
+        return {
+            "success": False,
+            "error": error_msg,
+            "prompt": None
+        }
     
     # 验证project_path
     if not os.path.exists(project_path):
         error_msg = f"Project path does not exist: {project_path}"
         logger.error(error_msg)
-        return [
-            types.TextContent(
-                type="text",
-                text=json.dumps({
-                    "success": False,
-                    "error": error_msg,
-                    "prompt": None
-                }, ensure_ascii=False)
-            )
-        ]
+        return {
+            "success": False,
+            "error": error_msg,
+            "prompt": None
+        }
+    if not project_allowed(project_path):
+        error_msg = f"Project path is outside the allowed project roots: {project_path}"
+        logger.error(error_msg)
+        return {
+            "success": False,
+            "error": error_msg,
+            "prompt": None
+        }
     
     # Create save directory
     prompt_dir = os.path.join(project_path, PROMPT_SAVE_FOLDER)
     if not os.path.exists(prompt_dir):
         os.makedirs(prompt_dir)
-        logger.info(f"Created prompt save directory: {prompt_dir}")
+        logger.info("Created prompt save directory: %s", prompt_dir)
         
     try:
-        # If a custom model or API URL is provided, update environment variables
+        # If a custom model or API URL is provided, apply them to this request only
+        settings = LLMSettings.from_env().override(model=model, api_base_url=api_base_url)
         if model:
-            os.environ["MODEL"] = model
-            logger.info(f"Using custom model: {model}")
+            logger.info("Using custom model: %s", model)
         
         if api_base_url:
-            os.environ["API_URL"] = api_base_url
-            logger.info(f"Using custom API base URL: {api_base_url}")
+            logger.info("Using custom API base URL: %s", api_base_url)
         
-        # 调用GPT服务生成提示词
-        prompt_result = generate_prompt(
+        # 相同输入的并发请求共享一次生成，避免重复调用模型和同时写同一文件
+        flight_key = normalize_key(
+            prompt_dir=os.path.abspath(prompt_dir),
+            file_name=file_name,
             purpose=purpose,
             rules=rules,
-            language=language
+            language=language,
+            model=settings.model,
+            api_url=settings.api_url,
+            use_cache=use_cache
         )
+        # 相同语言和规则下足够相似的历史请求，直接复用或提示之前的结果
+        similar_scope = make_scope(kind="prompt", language=language, rules=" ".join(rules.split()))
+        if use_cache:
+            with span("similar_lookup"):
+                match = await asyncio.to_thread(similar_cache.lookup, similar_scope, purpose)
+            if match:
+                return await _similar_result(match, prompt_dir, file_name)
         
-        # 提取标题和内容
-        prompt_title = prompt_result.get('title', '提示词')
-        prompt_content = prompt_result.get('content', '')
+        (save_path, prompt_title, prompt_content), coalesced = await inflight.do(
+            flight_key,
+            lambda: _generate_and_save(purpose, rules, language, prompt_dir, file_name, settings, use_cache)
+        )
+        if use_cache and not coalesced:
+            await asyncio.to_thread(similar_cache.add, similar_scope, purpose, {"title": prompt_title, "content": prompt_content}, save_path)
         
-        # 如果未提供文件名，根据标题生成
-        if not file_name:
-            # Clean title, replace invalid characters, limit length
-            clean_title = re.sub(r'[\\/:*?"<>|]', '_', prompt_title)  # Replace invalid characters
-            clean_title = clean_title.replace(' ', '_')  # Replace spaces with underscores
-            file_name = f"{clean_title[:50]}.md"  # Limit length and add extension
-            logger.info(f"Generated file name from title: {file_name}")
-        elif not file_name.endswith('.md'):
-            file_name = f"{file_name}.md"
-            logger.info(f"File name added extension: {file_name}")
+        # Return result
+        return {
+            "success": True,
+            "error": None,
+            "message": "I have created the prompt file. You can view and use it in the prompt library.",
+            "prompt": {
+                "path": save_path,
+                "title": prompt_title,
+                "content": prompt_content,
+                "coalesced": coalesced
+            }
+        }
+        
+    except Exception as e:
+        error_msg = f"Failed to generate prompt: {str(e)}"
+        logger.error(error_msg)
+        return {
+            "success": False,
+            "error": error_msg,
+            "prompt": None
+        }
+
+@mcp_server.tool()
+async def generate_document(
+    purpose: str,
+    rules: str,
+    language: str,
+    project_path: str,
+    file_name: str = "",
+    model: str = "",
+    api_base_url: str = "",
+    use_cache: bool = True
+) -> list:
+    """
+    Generate AI prompt based on user requirements
+    
+    Args:
+        purpose: The purpose of the prompt - what it's intended to do
+        rules: Global rules - the overall rules and constraints set by user
+        language: The language the prompt should be generated in
+        project_path: Project root directory path
+        file_name: Optional, file name for generated prompt (without path, with extension), will be generated from title if not provided
+        model: Optional, custom OpenAI model to use
+        api_base_url: Optional, custom OpenAI API base URL
+        use_cache: Optional, reuse a cached result for an identical (or, with the similar cache enabled, very similar) request, set False to force regeneration
         
-        # Save prompt to file
+    Returns:
+        List: Contains the generated result JSON string
+    """
+    result = await _create_prompt(
+        purpose=purpose,
+        rules=rules,
+        language=language,
+        project_path=project_path,
+        file_name=file_name,
+        model=model,
+        api_base_url=api_base_url,
+        use_cache=use_cache
+    )
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps(result, ensure_ascii=False)
+        )
+    ]
+
+@traced("generate_prompts", template_type="prompt")
+@budgeted()
+async def _create_prompts(
+    purposes: list,
+    rules: str,
+    language: str,
+    project_path: str,
+    model: str = "",
+    api_base_url: str = "",
+    use_cache: bool = True
+) -> dict:
+    """
+    Validate a batch prompt request, generate the prompts and save them into prompts/ concurrently
+    
+    Returns:
+        dict: Tool response with success, error and the result of every prompt
+    """
+    if isinstance(purposes, str):
+        purposes = [line.strip() for line in purposes.splitlines()]
+    purposes = [purpose.strip() for purpose in purposes or [] if purpose and purpose.strip()]
+    
+    # 验证参数
+    error_msg = None
+    if not purposes or not rules or not language or not project_path:
+        error_msg = "Purposes, rules, language, and project_path cannot be empty"
+    elif not os.path.exists(project_path):
+        error_msg = f"Project path does not exist: {project_path}"
+    elif not project_allowed(project_path):
+        error_msg = f"Project path is outside the allowed project roots: {project_path}"
+    if error_msg:
+        logger.error(error_msg)
+        return {
+            "success": False,
+            "error": error_msg,
+            "prompts": None
+        }
+    
+    # Create save directory
+    prompt_dir = os.path.join(project_path, PROMPT_SAVE_FOLDER)
+    os.makedirs(prompt_dir, exist_ok=True)
+    
+    settings = LLMSettings.from_env().override(model=model, api_base_url=api_base_url)
+    generated = await agenerate_prompts(purposes, rules, language, settings, use_cache)
+    
+    # 同一批中标题相同的提示词使用不同的文件名
+    results = []
+    writes = []
+    used_names = set()
+    for purpose, (prompt_result, error) in zip(purposes, generated):
+        if prompt_result is None:
+            results.append({"purpose": purpose, "success": False, "error": error, "path": None, "title": None, "content": None})
+            continue
+        file_name = _prompt_file_name(prompt_result["title"])
+        stem, suffix = os.path.splitext(file_name)
+        number = 2
+        while file_name in used_names:
+            file_name = f"{stem}_{number}{suffix}"
+            number += 1
+        used_names.add(file_name)
         save_path = os.path.join(prompt_dir, file_name)
-        with open(save_path, 'w', encoding='utf-8') as f:
-            # Add title and content
-            f.write(f"# {prompt_title}\n\n{prompt_content}")
+        writes.append((len(results), asyncio.to_thread(_write_prompt, save_path, prompt_result["title"], prompt_result["content"])))
+        results.append({"purpose": purpose, "success": True, "error": None, "path": save_path, "title": prompt_result["title"], "content": prompt_result["content"]})
+    
+    with span("file_write"):
+        outcomes = await asyncio.gather(*(write for _, write in writes), return_exceptions=True)
+    for (position, _), outcome in zip(writes, outcomes):
+        if isinstance(outcome, Exception):
+            logger.error("Failed to save prompt %s: %s", results[position]["path"], outcome)
+            results[position].update({"success": False, "error": f"Failed to save prompt: {str(outcome)}", "path": None})
+    
+    succeeded = sum(1 for r in results if r["success"])
+    logger.info("Saved %s of %s prompts into %s", succeeded, len(results), prompt_dir)
+    return {
+        "success": succeeded == len(results),
+        "error": None if succeeded == len(results) else f"{len(results) - succeeded} of {len(results)} prompts failed",
+        "message": f"I have created {succeeded} of {len(results)} prompt files. You can view and use them in the prompt library.",
+        "prompts": results
+    }
+
+@mcp_server.tool()
+async def generate_prompts(
+    purposes: list[str],
+    rules: str,
+    language: str,
+    project_path: str,
+    model: str = "",
+    api_base_url: str = "",
+    use_cache: bool = True
+) -> list:
+    """
+    Generate several AI prompts that share one set of rules and language, packed into as few model requests as possible
+    
+    Args:
+        purposes: Purposes of the prompts, one prompt is generated and saved for each
+        rules: Global rules shared by all prompts
+        language: The language the prompts should be generated in
+        project_path: Project root directory path
+        model: Optional, custom OpenAI model to use
+        api_base_url: Optional, custom OpenAI API base URL
+        use_cache: Optional, reuse cached prompts for identical purposes, set False to force regeneration
         
-        logger.info(f"Prompt saved: {save_path}")
+    Returns:
+        List: Contains the per-prompt result JSON string
+    """
+    result = await _create_prompts(
+        purposes=purposes,
+        rules=rules,
+        language=language,
+        project_path=project_path,
+        model=model,
+        api_base_url=api_base_url,
+        use_cache=use_cache
+    )
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps(result, ensure_ascii=False)
+        )
+    ]
+
+@mcp_server.tool()
+async def submit_prompt_job(
+    purpose: str,
+    rules: str,
+    language: str,
+    project_path: str,
+    file_name: str = "",
+    model: str = "",
+    api_base_url: str = "",
+    use_cache: bool = True
+) -> list:
+    """
+    Queue a prompt generation in the background and return a job ID immediately, poll job_status and fetch the prompt with job_result
+    
+    Args:
+        purpose: The purpose of the prompt - what it's intended to do
+        rules: Global rules - the overall rules and constraints set by user
+        language: The language the prompt should be generated in
+        project_path: Project root directory path
+        file_name: Optional, file name for generated prompt (without path, with extension), will be generated from title if not provided
+        model: Optional, custom OpenAI model to use
+        api_base_url: Optional, custom OpenAI API base URL
+        use_cache: Optional, reuse a cached result for an identical (or, with the similar cache enabled, very similar) request, set False to force regeneration
         
-        # Return result
+    Returns:
+        List: Contains the queued job JSON string
+    """
+    if not project_path or not os.path.exists(project_path) or not project_allowed(project_path):
+        error_msg = f"Project path does not exist or is not allowed: {project_path}"
+        logger.error(error_msg)
         return [
             types.TextContent(
                 type="text",
                 text=json.dumps({
-                    "success": True,
-                    "error": None,
-                    "message": "I have created the prompt file. You can view and use it in the prompt library.",
-                    "prompt": {
-                        "path": save_path,
-                        "title": prompt_title,
-                        "content": prompt_content
-                    }
+                    "success": False,
+                    "error": error_msg,
+                    "job": None
                 }, ensure_ascii=False)
             )
         ]
-        
-    except Exception as e:
-        error_msg = f"Failed to generate prompt: {str(e)}"
-        logger.error(error_msg)
+    
+    try:
+        job = await job_queue.submit("prompt", project_path, {
+            "purpose": purpose,
+            "rules": rules,
+            "language": language,
+            "project_path": project_path,
+            "file_name": file_name,
+            "model": model,
+            "api_base_url": api_base_url,
+            "use_cache": use_cache
+        })
+    except JobQueueFull as e:
+        logger.error(str(e))
         return [
             types.TextContent(
                 type="text",
                 text=json.dumps({
                     "success": False,
-                    "error": error_msg,
-                    "prompt": None
+                    "error": str(e),
+                    "job": None
                 }, ensure_ascii=False)
             )
         ]
+    
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({
+                "success": True,
+                "error": None,
+                "message": "The prompt job has been queued. Call job_status with the job ID to check its progress, and job_result to get the prompt once it has finished.",
+                "job": job_queue.summary(job)
+            }, ensure_ascii=False)
+        )
+    ]
+
+def _job_not_found(job_id: str) -> list:
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({
+                "success": False,
+                "error": f"Job not found: {job_id}",
+                "job": None
+            }, ensure_ascii=False)
+        )
+    ]
+
+@mcp_server.tool()
+def job_status(job_id: str) -> list:
+    """
+    Show the status of a background job (queued/running/cancelling/succeeded/failed/cancelled)
+    
+    Args:
+        job_id: Job ID returned by submit_prompt_job
+    """
+    job = job_queue.get(job_id)
+    if not job:
+        return _job_not_found(job_id)
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({
+                "success": True,
+                "error": None,
+                "job": job_queue.summary(job)
+            }, ensure_ascii=False)
+        )
+    ]
+
+@mcp_server.tool()
+def job_result(job_id: str) -> list:
+    """
+    Get the result of a finished background job
+    
+    Args:
+        job_id: Job ID returned by submit_prompt_job
+    """
+    job = job_queue.get(job_id)
+    if not job:
+        return _job_not_found(job_id)
+    finished = job["status"] in FINISHED_STATES
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({
+                "success": finished,
+                "error": None if finished else f"Job is still {job['status']}, check again later",
+                "job": job_queue.summary(job),
+                "result": job["result"]
+            }, ensure_ascii=False)
+        )
+    ]
+
+@mcp_server.tool()
+def cancel_job(job_id: str) -> list:
+    """
+    Cancel a queued or running background job
+    
+    Args:
+        job_id: Job ID returned by submit_prompt_job
+    """
+    job = job_queue.cancel(job_id)
+    if not job:
+        return _job_not_found(job_id)
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({
+                "success": True,
+                "error": None,
+                "job": job_queue.summary(job)
+            }, ensure_ascii=False)
+        )
+    ]
 
-@mcp_server.add_tool
+@mcp_server.tool()
 def use_description() -> list:
     """
     List all available tools and their parameters
     """
+    # 由工具函数的签名和文档字符串生成，与实际注册的参数保持一致
     return [
         types.TextContent(
             type="text",
             text=json.dumps({
                 "functions": {
-                    "generate_document": {
-                        "description": "Generate AI prompt based on user requirements",
-                        "parameters": {
-                            "purpose": "The purpose of the prompt - what it's intended to do",
-                            "rules": "Global rules - the overall rules and constraints set by user",
-                            "language": "The language the prompt should be generated in",
-                            "project_path": "Project root directory path",
-                            "file_name": "Optional, file name for generated prompt (without path, with extension)",
-                            "model": "Optional, custom OpenAI model to use",
-                            "api_base_url": "Optional, custom OpenAI API base URL"
-                        }
-                    },
-                    "use_description": {
-                        "description": "List all functions and their parameters",
-                        "parameters": {}
+                    tool["name"]: {
+                        "description": tool["description"],
+                        "parameters": {name: param["description"] for name, param in tool["parameters"].items()}
                     }
+                    for tool in describe_tools([
+                        ("generate_document", generate_document),
+                        ("generate_prompts", generate_prompts),
+                        ("submit_prompt_job", submit_prompt_job),
+                        ("job_status", job_status),
+                        ("job_result", job_result),
+                        ("cancel_job", cancel_job),
+                        ("token_usage", token_usage),
+                        ("search_library", search_library),
+                        ("server_stats", server_stats),
+                        ("cache_stats", cache_stats),
+                        ("use_description", use_description)
+                    ])
                 }
             }, ensure_ascii=False)
         )
     ]
 
+@mcp_server.tool()
+async def cache_stats() -> list:
+    """
+    Show hit/miss statistics and size of the generation result cache, hit rate and lookup latency of the similar request cache, how often concurrent identical requests were coalesced, and the upstream rate limit and endpoint health state
+    """
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({
+                "success": True,
+                "error": None,
+                "cache": await asyncio.to_thread(response_cache.stats),
+                "similar_cache": await asyncio.to_thread(similar_cache.stats),
+                "coalescing": inflight.stats(),
+                "rate_limits": limiter_stats(),
+                "endpoints": endpoint_stats()
+            }, ensure_ascii=False)
+        )
+    ]
+
+@mcp_server.tool()
+def server_stats() -> list:
+    """
+    Show per-stage timings (prompt build, rate limit, generation, file write), request/error/token/cache/retry counters per model, and the most recent requests
+    """
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({
+                "success": True,
+                "error": None,
+                **metrics.stats(),
+                "jobs": job_queue.stats()
+            }, ensure_ascii=False)
+        )
+    ]
+
+@mcp_server.tool()
+async def token_usage(project_path: str, days: int = PROJECT_BUDGET_DAYS) -> list:
+    """
+    Show the token usage and cost recorded for a project, per model and per day, and how much of its token budget is left
+    
+    Args:
+        project_path: Project root directory path
+        days: Optional, number of days to report, 0 for all recorded usage
+    """
+    if not project_path or not os.path.exists(project_path) or not project_allowed(project_path):
+        error_msg = f"Project path does not exist or is not allowed: {project_path}"
+        logger.error(error_msg)
+        return [
+            types.TextContent(
+                type="text",
+                text=json.dumps({
+                    "success": False,
+                    "error": error_msg,
+                    "usage": None
+                }, ensure_ascii=False)
+            )
+        ]
+    
+    ledger = ledger_for(project_path)
+    usage = await asyncio.to_thread(ledger.summary, days)
+    budget = await asyncio.to_thread(budget_status, ledger)
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({
+                "success": True,
+                "error": None,
+                "usage": usage,
+                "budget": budget
+            }, ensure_ascii=False)
+        )
+    ]
+
+@mcp_server.tool()
+async def search_library(query: str, project_path: str, folder: str = "all", limit: int = 10, refresh: bool = False) -> list:
+    """
+    Search the existing prompts and documents of a project (prompts/ and doc/) by title and content, ranked by BM25
+    
+    Args:
+        query: Search text, Chinese and English may be mixed
+        project_path: Project root directory path
+        folder: Optional, folder to search, all, prompts or doc
+        limit: Optional, maximum number of results
+        refresh: Optional, rescan the folders even if they were scanned recently
+    """
+    error_msg = None
+    if not project_path or not os.path.exists(project_path) or not project_allowed(project_path):
+        error_msg = f"Project path does not exist or is not allowed: {project_path}"
+    elif folder != "all" and folder not in LIBRARY_FOLDERS:
+        error_msg = f"Unknown folder: {folder}, must be all, {' or '.join(LIBRARY_FOLDERS)}"
+    elif not query or not query.strip():
+        error_msg = "Query must not be empty"
+    if error_msg:
+        logger.error(error_msg)
+        return [
+            types.TextContent(
+                type="text",
+                text=json.dumps({
+                    "success": False,
+                    "error": error_msg,
+                    "results": []
+                }, ensure_ascii=False)
+            )
+        ]
+    
+    with span("library_search"):
+        found = await asyncio.to_thread(library.search, project_path, query, max(1, limit), None if folder == "all" else folder, refresh)
+    return [
+        types.TextContent(
+            type="text",
+            text=json.dumps({
+                "success": True,
+                "error": None,
+                **found
+            }, ensure_ascii=False)
+        )
+    ]
+
 if __name__ == "__main__":
+    # 配置日志
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
     # Print current configuration
-    logger.info(f"Starting prompt generation service...")
-    logger.info(f"API key status: {'Set' if API_KEY else 'Not set'}")
-    logger.info(f"Using model: {MODEL}")
-    logger.info(f"API base URL: {API_URL}")
-    mcp_server.run()
+    logger.info("Starting prompt generation service...")
+    logger.info("API key status: %s", 'Set' if API_KEY else 'Not set')
+    logger.info("Using model: %s", MODEL)
+    logger.info("API base URL: %s", API_URL)
+    run_server(mcp_server, lifespan)
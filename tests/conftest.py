@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 共用的 mcp_common 包在仓库根目录，文档生成服务的 proxy 包在 doc-gen-server 下
+sys.path.insert(0, ROOT)
+sys.path.insert(1, os.path.join(ROOT, "doc-gen-server"))
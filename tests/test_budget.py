@@ -0,0 +1,59 @@
+import os
+import json
+
+import pytest
+
+from mcp_common.budget import fit_messages, compress_text, UsageLedger, BudgetExceeded
+from mcp_common.rate_limit import estimate_request_tokens
+
+def _build(instructions: str, description: str, additional_info: str) -> list:
+    return [
+        {"role": "system", "content": instructions},
+        {"role": "user", "content": f"{description}\n{additional_info}"}
+    ]
+
+def test_messages_within_the_limit_are_unchanged():
+    messages = fit_messages(_build, ("additional_info",), limit=1000, instructions="Be brief", description="Login", additional_info="None")
+    assert messages == _build("Be brief", "Login", "None")
+
+def test_fields_are_truncated_in_shrink_order():
+    fields = {"instructions": "Be brief", "description": "desc " * 400, "additional_info": "info " * 400}
+    messages = fit_messages(_build, ("additional_info", "description"), limit=300, **fields)
+    assert estimate_request_tokens(messages, 0) <= 300
+    user = messages[1]["content"]
+    assert "tokens truncated to fit the input budget" in user
+    # 先截断附加信息，描述仍然完整保留开头
+    assert user.startswith("desc desc")
+
+def test_prompt_that_cannot_fit_is_rejected():
+    with pytest.raises(BudgetExceeded):
+        fit_messages(_build, ("additional_info",), limit=10, instructions="rule " * 100, description="x", additional_info="y")
+
+def test_compress_text_drops_blank_runs_and_repeated_long_lines():
+    line = "A repeated line that is long enough to be deduplicated"
+    assert compress_text(f"a    b\n\n\n\n{line}\n{line}\n") == f"a b\n\n{line}"
+
+def test_ledger_totals_and_reload_after_external_change(tmp_path):
+    path = str(tmp_path / "usage.json")
+    ledger = UsageLedger(path)
+    ledger.record("gpt-4o", 100, 50)
+    ledger.record("gpt-4o", 10, 5, estimated=True, cached=4)
+    summary = ledger.summary()
+    assert summary["total"]["prompt_tokens"] == 110
+    assert summary["total"]["estimated_requests"] == 1
+    assert ledger.spent() == 165
+
+    # 另一个进程写入的记录在下次读取时生效
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    day = next(iter(data["days"]))
+    data["days"][day]["other-model"] = {**data["days"][day]["gpt-4o"], "prompt_tokens": 1000, "completion_tokens": 0}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.utime(path, ns=(os.stat(path).st_mtime_ns + 10**9,) * 2)
+    assert ledger.spent() == 1165
+
+def test_unreadable_ledger_starts_empty(tmp_path):
+    path = tmp_path / "usage.json"
+    path.write_text("not json", encoding="utf-8")
+    assert UsageLedger(str(path)).spent() == 0
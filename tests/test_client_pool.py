@@ -0,0 +1,58 @@
+import asyncio
+import threading
+
+from mcp_common.client_pool import _discard
+
+class _Client:
+    def __init__(self):
+        self.closed = threading.Event()
+        self.loop = None
+
+    async def close(self):
+        self.loop = asyncio.get_running_loop()
+        self.closed.set()
+
+def test_client_of_a_running_loop_is_closed_on_that_loop():
+    old = asyncio.new_event_loop()
+    thread = threading.Thread(target=old.run_forever)
+    thread.start()
+    client = _Client()
+    try:
+        async def main():
+            _discard(old, client)
+
+        asyncio.run(main())
+        assert client.closed.wait(1)
+    finally:
+        old.call_soon_threadsafe(old.stop)
+        thread.join()
+        old.close()
+    assert client.loop is old
+
+def test_client_of_a_stopped_loop_is_closed_in_the_background():
+    old = asyncio.new_event_loop()
+    client = _Client()
+
+    async def main():
+        _discard(old, client)
+        await asyncio.sleep(0)
+        return asyncio.get_running_loop()
+
+    try:
+        current = asyncio.run(main())
+    finally:
+        old.close()
+    assert client.closed.is_set()
+    assert client.loop is current
+
+def test_client_of_a_closed_loop_is_dropped():
+    old = asyncio.new_event_loop()
+    old.close()
+    client = _Client()
+
+    async def main():
+        _discard(old, client)
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert not client.closed.is_set()
@@ -0,0 +1,87 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+openai = pytest.importorskip("openai")
+httpx = pytest.importorskip("httpx")
+
+import mcp_common.endpoints as endpoints
+from mcp_common.endpoints import acall_with_failover, astream_with_failover, endpoint_stats
+from mcp_common.settings import LLMSettings
+
+@pytest.fixture(autouse=True)
+def fresh_health(monkeypatch):
+    monkeypatch.setattr(endpoints, "_health", {})
+    monkeypatch.setattr(endpoints, "HEDGE_DELAY", 0.0)
+
+def _settings(name: str) -> LLMSettings:
+    return LLMSettings("key", f"http://{name}-a", "model-a", fallbacks=(LLMSettings("key", f"http://{name}-b", "model-b"),))
+
+def _status_error(cls, status: int, url: str):
+    response = httpx.Response(status, request=httpx.Request("POST", url))
+    return cls("error", response=response, body=None)
+
+def test_unavailable_endpoint_fails_over_and_reports_the_answering_endpoint():
+    settings = _settings("failover")
+
+    async def create(endpoint):
+        if endpoint.model == "model-a":
+            raise _status_error(openai.AuthenticationError, 401, endpoint.api_url)
+        return SimpleNamespace(usage=None, model=endpoint.model)
+
+    response, endpoint = asyncio.run(acall_with_failover(settings, 10, create))
+    assert (response.model, endpoint.model) == ("model-b", "model-b")
+    stats = endpoint_stats()
+    assert stats["http://failover-a"]["failures"] == 1
+    assert stats["http://failover-b"]["successes"] == 1
+
+def test_request_errors_do_not_fail_over_or_count_against_the_endpoint():
+    settings = _settings("bad-request")
+    calls = []
+
+    async def create(endpoint):
+        calls.append(endpoint.model)
+        raise _status_error(openai.BadRequestError, 400, endpoint.api_url)
+
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(acall_with_failover(settings, 10, create))
+    assert calls == ["model-a"]
+    assert endpoint_stats()["http://bad-request-a"]["failures"] == 0
+
+class _Stream:
+    def __init__(self, delay: float, chunks: list):
+        self.delay = delay
+        self.chunks = list(chunks)
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(self.delay)
+        if not self.chunks:
+            raise StopAsyncIteration
+        return self.chunks.pop(0)
+
+    async def close(self):
+        self.closed = True
+
+def test_slow_first_token_is_hedged_and_the_loser_closed(monkeypatch):
+    monkeypatch.setattr(endpoints, "HEDGE_DELAY", 0.05)
+    settings = _settings("hedge")
+    streams = {}
+
+    async def create(endpoint):
+        delay = 1.0 if endpoint.model == "model-a" else 0.0
+        streams[endpoint.model] = _Stream(delay, [endpoint.model + "-1", endpoint.model + "-2"])
+        return streams[endpoint.model]
+
+    async def main():
+        return [item async for item in astream_with_failover(settings, 10, create)]
+
+    items = asyncio.run(main())
+    assert [chunk for chunk, _ in items] == ["model-b-1", "model-b-2"]
+    assert {endpoint.model for _, endpoint in items} == {"model-b"}
+    assert streams["model-a"].closed
+    assert endpoint_stats()["http://hedge-b"]["hedge_wins"] == 1
@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+from proxy.gpt_service import _strip_overlap, _gather_all, SEAM_MIN_OVERLAP
+
+def test_repeated_seam_is_removed_from_a_continuation():
+    previous = "Intro\nThe service stores sessions in Redis"
+    assert _strip_overlap(previous, "sessions in Redis and expires them") == " and expires them"
+
+def test_repeated_last_line_is_removed():
+    previous = "## API\nGET /users returns the list of"
+    assert _strip_overlap(previous, "GET /users returns the list of users") == " users"
+
+def test_short_overlaps_are_kept():
+    overlap = "x" * (SEAM_MIN_OVERLAP - 1)
+    assert _strip_overlap("abc " + overlap, overlap + " rest") == overlap + " rest"
+
+def test_unrelated_continuation_is_unchanged():
+    assert _strip_overlap("First part.", "Second part.") == "Second part."
+
+def test_failed_section_cancels_the_others():
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def failing():
+        await asyncio.sleep(0)
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        asyncio.run(_gather_all([slow(), failing(), slow()]))
+    assert cancelled == [True, True]
@@ -0,0 +1,90 @@
+import os
+import json
+import asyncio
+
+from mcp_common.jobs import JobQueue, QUEUED, RUNNING, CANCELLING, CANCELLED, SUCCEEDED
+
+def _queue(tmp_path, runners: dict, workers: int = 1) -> JobQueue:
+    return JobQueue("test", ".state", runners, workers=workers, registry_dir=str(tmp_path / "registry"))
+
+async def _wait_for(condition) -> None:
+    for _ in range(200):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not reached")
+
+def test_projects_are_served_in_turn(tmp_path):
+    async def main():
+        started = []
+        gate = asyncio.Event()
+
+        async def run(name: str) -> dict:
+            started.append(name)
+            await gate.wait()
+            return {"success": True}
+
+        queue = _queue(tmp_path, {"run": run})
+        a, b = str(tmp_path / "a"), str(tmp_path / "b")
+        jobs = [await queue.submit("run", a, {"name": "a1"})]
+        await _wait_for(lambda: started)
+        for project, name in ((a, "a2"), (a, "a3"), (b, "b1")):
+            jobs.append(await queue.submit("run", project, {"name": name}))
+        gate.set()
+        await _wait_for(lambda: all(queue.get(job["id"])["status"] == SUCCEEDED for job in jobs))
+        # b 的任务不必等待 a 排在它前面的所有任务
+        assert started == ["a1", "b1", "a2", "a3"]
+        await queue.stop()
+
+    asyncio.run(main())
+
+def test_running_job_is_cancelling_until_its_worker_stops(tmp_path):
+    async def main():
+        async def run() -> dict:
+            await asyncio.sleep(10)
+            return {}
+
+        queue = _queue(tmp_path, {"run": run})
+        job = await queue.submit("run", str(tmp_path / "a"), {})
+        await _wait_for(lambda: queue.get(job["id"])["status"] == RUNNING)
+        assert queue.cancel(job["id"])["status"] == CANCELLING
+        await _wait_for(lambda: queue.get(job["id"])["status"] == CANCELLED)
+        queued = await queue.submit("run", str(tmp_path / "b"), {})
+        queued_too = await queue.submit("run", str(tmp_path / "b"), {})
+        assert queue.cancel(queued_too["id"])["status"] == CANCELLED
+        queue.cancel(queued["id"])
+        await queue.stop()
+
+    asyncio.run(main())
+
+def test_restart_requeues_unfinished_jobs_and_skips_bad_files(tmp_path):
+    async def main():
+        gate = asyncio.Event()
+
+        async def run() -> dict:
+            await gate.wait()
+            return {"success": True}
+
+        project = str(tmp_path / "a")
+        queue = _queue(tmp_path, {"run": run})
+        running = await queue.submit("run", project, {})
+        queued = await queue.submit("run", project, {})
+        await _wait_for(lambda: queue.get(running["id"])["status"] == RUNNING)
+        await queue.stop()
+
+        jobs_dir = os.path.join(project, ".state")
+        with open(os.path.join(jobs_dir, "broken.json"), 'w', encoding='utf-8') as f:
+            f.write("[1, 2")
+        cancelling = {**queue.get(queued["id"]), "id": "cancelling", "status": CANCELLING}
+        with open(os.path.join(jobs_dir, "cancelling.json"), 'w', encoding='utf-8') as f:
+            json.dump(cancelling, f)
+
+        restarted = _queue(tmp_path, {"run": run})
+        await restarted.start()
+        assert restarted.get("cancelling")["status"] == CANCELLED
+        assert restarted.get(queued["id"])["status"] in (QUEUED, RUNNING)
+        gate.set()
+        await _wait_for(lambda: all(restarted.get(job["id"])["status"] == SUCCEEDED for job in (running, queued)))
+        await restarted.stop()
+
+    asyncio.run(main())
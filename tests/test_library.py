@@ -0,0 +1,44 @@
+import os
+
+from mcp_common.library import LibraryIndex, tokenize
+
+def _write(path, text: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+def test_tokenize_splits_cjk_into_pairs():
+    assert tokenize("Login 用户登录") == ["login", "用户", "户登", "登录"]
+
+def test_search_ranks_by_bm25_and_filters_by_folder(tmp_path):
+    project = tmp_path / "project"
+    _write(str(project / "prompts" / "login.md"), "# Login prompt\nHandle user login and sessions.")
+    _write(str(project / "doc" / "api.md"), "# Server API\nEndpoints. The login endpoint is mentioned once.")
+    _write(str(project / "doc" / "plan.md"), "# Plan\nMilestones only.")
+    _write(str(project / "doc" / ".api.md.part"), "# Partial login login login")
+    index = LibraryIndex(str(project), str(tmp_path / "index.sqlite3"))
+    try:
+        results = index.search("login")["results"]
+        assert [r["title"] for r in results] == ["Login prompt", "Server API"]
+        assert results[0]["score"] > results[1]["score"]
+        assert [r["title"] for r in index.search("login", folder="doc")["results"]] == ["Server API"]
+        assert index.search("用户登录")["results"] == []
+    finally:
+        index.close()
+
+def test_new_and_removed_files_are_picked_up_on_refresh(tmp_path):
+    project = tmp_path / "project"
+    _write(str(project / "doc" / "a.md"), "# A\nalpha")
+    index = LibraryIndex(str(project), str(tmp_path / "index.sqlite3"), rescan_interval=3600)
+    try:
+        assert len(index.search("alpha")["results"]) == 1
+        _write(str(project / "doc" / "b.md"), "# B\nalpha beta")
+        os.remove(str(project / "doc" / "a.md"))
+        # 扫描间隔内不重新扫描：新文件还不在索引中，已删除的文件读取失败被跳过
+        assert [r["title"] for r in index.search("alpha")["results"]] == []
+        # refresh 强制重新扫描
+        result = index.search("alpha", refresh=True)
+        assert [r["title"] for r in result["results"]] == ["B"]
+        assert (result["index"]["indexed"], result["index"]["removed"]) == (1, 1)
+    finally:
+        index.close()
@@ -0,0 +1,17 @@
+from mcp_common.metrics import Metrics, record_cancelled
+import mcp_common.metrics as metrics_module
+
+def _counters(metrics: Metrics) -> dict:
+    return {counter["name"]: counter["value"] for counter in metrics.stats()["counters"]}
+
+def test_cancelled_request_counts_wasted_and_saved_tokens(monkeypatch):
+    metrics = Metrics("test")
+    monkeypatch.setattr(metrics_module, "metrics", metrics)
+    record_cancelled(100, 30, 500)
+    assert _counters(metrics) == {"upstream_cancelled": 1, "tokens_wasted": 130, "tokens_saved": 470}
+
+def test_request_cancelled_before_it_was_sent_wastes_nothing(monkeypatch):
+    metrics = Metrics("test")
+    monkeypatch.setattr(metrics_module, "metrics", metrics)
+    record_cancelled(100, 0, 500, issued=False)
+    assert _counters(metrics) == {"upstream_cancelled": 1, "tokens_saved": 600}
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from proxy.pipeline import run_pipeline, check_acyclic, build_upstream_context, summarize_document
+
+def test_nodes_start_after_their_dependencies_with_their_content():
+    async def main():
+        started = []
+
+        async def run_node(node, upstream):
+            started.append((node, sorted(upstream)))
+            await asyncio.sleep(0)
+            return f"# {node}"
+
+        dependencies = {"a": [], "b": ["a"], "c": ["a", "b", "old"]}
+        results = await run_pipeline(["c", "b", "a"], run_node, dependencies, external={"old": "# old"})
+        assert results == {"c": "# c", "b": "# b", "a": "# a"}
+        assert [node for node, _ in started] == ["a", "b", "c"]
+        assert dict(started)["c"] == ["a", "b", "old"]
+
+    asyncio.run(main())
+
+def test_failed_dependency_does_not_block_dependents():
+    async def main():
+        async def run_node(node, upstream):
+            if node == "a":
+                raise ValueError("boom")
+            return sorted(upstream)
+
+        results = await run_pipeline(["a", "b"], run_node, {"a": [], "b": ["a"]})
+        assert isinstance(results["a"], ValueError)
+        assert results["b"] == []
+
+    asyncio.run(main())
+
+def test_cycles_are_rejected():
+    with pytest.raises(ValueError):
+        check_acyclic(["a", "b"], {"a": ["b"], "b": ["a"]})
+
+def test_upstream_context_summarizes_documents():
+    content = "# Doc\nFirst line\nSecond line\n```\ncode\n```\n## Part\n| table |\nText"
+    assert summarize_document(content) == "# Doc\nFirst line\n## Part\nText"
+    assert build_upstream_context({"requirement_doc": content}).startswith("[requirement_doc]\n# Doc")
@@ -0,0 +1,41 @@
+import os
+import json
+import importlib.util
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope="module")
+def gpt_service():
+    # 提示词生成服务的 proxy 包与文档生成服务的同名，按文件路径单独加载
+    spec = importlib.util.spec_from_file_location("prompt_gen_gpt_service", os.path.join(ROOT, "prompt_gen_server", "proxy", "gpt_service.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_valid_batch_is_parsed(gpt_service):
+    content = json.dumps({"prompts": [{"index": 1, "title": "B", "content": "b"}, {"index": 0, "title": " A ", "content": "a"}]})
+    valid, invalid = gpt_service.parse_batch_response(content, 2)
+    assert valid == {0: {"title": "A", "content": "a"}, 1: {"title": "B", "content": "b"}}
+    assert invalid == {}
+
+def test_complete_entries_are_salvaged_from_cut_off_json(gpt_service):
+    content = '```json\n{"prompts": [{"index": 0, "title": "A", "content": "a"}, {"index": 1, "title": "B", "cont'
+    valid, invalid = gpt_service.parse_batch_response(content, 3)
+    assert list(valid) == [0]
+    assert invalid == {1: None, 2: None}
+
+def test_invalid_and_out_of_range_entries_are_reported_for_repair(gpt_service):
+    content = json.dumps([
+        {"index": 0, "title": "", "content": "a"},
+        {"index": 5, "title": "X", "content": "x"},
+        {"index": 1, "title": "B", "content": "b"},
+        {"index": 1, "title": "B2", "content": "b2"}
+    ])
+    valid, invalid = gpt_service.parse_batch_response(content, 2)
+    assert valid == {1: {"title": "B", "content": "b"}}
+    assert json.loads(invalid[0]) == {"index": 0, "title": "", "content": "a"}
+
+def test_unparseable_response_has_no_entries(gpt_service):
+    assert gpt_service._batch_items("no json here") == []
@@ -0,0 +1,165 @@
+import asyncio
+from types import SimpleNamespace
+
+import mcp_common.rate_limit as rate_limit
+from mcp_common.rate_limit import EndpointLimiter, TokenBucket, astream_with_limits
+
+def _limiter(concurrency: int) -> EndpointLimiter:
+    return EndpointLimiter("http://test", rpm=0, tpm=0, max_concurrency=concurrency, min_concurrency=1)
+
+async def _settle() -> None:
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def test_slots_are_limited_and_handed_over_in_order():
+    async def main():
+        limiter = _limiter(2)
+        order = []
+
+        async def worker(name: str, hold: asyncio.Event) -> None:
+            await limiter.acquire(0)
+            order.append(name)
+            await hold.wait()
+            limiter.release()
+
+        holds = {name: asyncio.Event() for name in "abcd"}
+        tasks = [asyncio.ensure_future(worker(name, holds[name])) for name in "abcd"]
+        await _settle()
+        assert order == ["a", "b"]
+        assert limiter.in_flight == 2
+        holds["a"].set()
+        await _settle()
+        assert order == ["a", "b", "c"]
+        for hold in holds.values():
+            hold.set()
+        await asyncio.gather(*tasks)
+        assert order == ["a", "b", "c", "d"]
+        assert limiter.in_flight == 0
+
+    asyncio.run(main())
+
+def test_cancelled_waiter_does_not_lose_the_slot():
+    async def main():
+        limiter = _limiter(1)
+        await limiter.acquire(0)
+        a = asyncio.ensure_future(limiter.acquire(0))
+        b = asyncio.ensure_future(limiter.acquire(0))
+        await _settle()
+        a.cancel()
+        await _settle()
+        # 持有槽位的请求结束后，排在被取消的请求后面的等待者必须拿到槽位
+        limiter.release()
+        await asyncio.wait_for(b, 1)
+        assert a.cancelled()
+        assert limiter.in_flight == 1
+        limiter.release()
+        assert limiter.in_flight == 0
+        assert not limiter._waiters
+
+    asyncio.run(main())
+
+def test_waiter_cancelled_after_being_granted_passes_the_slot_on():
+    async def main():
+        limiter = _limiter(1)
+        await limiter.acquire(0)
+        a = asyncio.ensure_future(limiter.acquire(0))
+        b = asyncio.ensure_future(limiter.acquire(0))
+        await _settle()
+        # 槽位交给 a 之后、a 恢复运行之前取消它
+        limiter.release()
+        a.cancel()
+        await asyncio.wait_for(b, 1)
+        assert a.cancelled()
+        assert limiter.in_flight == 1
+        limiter.release()
+        assert limiter.in_flight == 0
+
+    asyncio.run(main())
+
+def test_raised_limit_wakes_waiters():
+    async def main():
+        limiter = _limiter(4)
+        limiter.limit = 1.0
+        await limiter.acquire(0)
+        waiter = asyncio.ensure_future(limiter.acquire(0))
+        await _settle()
+        assert not waiter.done()
+        limiter.on_success()
+        limiter.on_success()
+        await asyncio.wait_for(waiter, 1)
+        assert limiter.in_flight == 2
+
+    asyncio.run(main())
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(60)
+    assert bucket.reserve(60) == 0.0
+    assert 0.9 < bucket.reserve(1) <= 1.0
+    bucket.refund(1)
+    assert bucket.reserve(1) <= 1.0
+
+class _Stream:
+    def __init__(self, chunks: list):
+        self.chunks = list(chunks)
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.chunks:
+            raise StopAsyncIteration
+        return self.chunks.pop(0)
+
+    async def close(self):
+        self.closed = True
+
+def _chunk(text: str = None, usage: int = None):
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=text))] if text is not None else []
+    return SimpleNamespace(choices=choices, usage=SimpleNamespace(total_tokens=usage) if usage is not None else None)
+
+def test_finished_stream_returns_its_unused_tokens(monkeypatch):
+    limiter = EndpointLimiter("http://stream", rpm=0, tpm=6000, max_concurrency=2)
+    monkeypatch.setitem(rate_limit._limiters, "http://stream", limiter)
+    stream = _Stream([_chunk("Hello"), _chunk(" world"), _chunk(usage=150)])
+
+    async def main():
+        async with astream_with_limits("http://stream", 2000, lambda: _open(stream)) as chunks:
+            assert limiter.tokens.level < 4100
+            return [chunk async for chunk in chunks]
+
+    assert len(asyncio.run(main())) == 3
+    assert stream.closed
+    # 预占2000，实际用量150，其余退还
+    assert 5800 < limiter.tokens.level <= 6000 - 150 + 1
+    assert limiter.in_flight == 0
+
+def test_stream_without_usage_is_settled_with_the_received_estimate(monkeypatch):
+    limiter = EndpointLimiter("http://estimate", rpm=0, tpm=6000, max_concurrency=2)
+    monkeypatch.setitem(rate_limit._limiters, "http://estimate", limiter)
+    stream = _Stream([_chunk("x" * 400)])
+
+    async def main():
+        async with astream_with_limits("http://estimate", 2000, lambda: _open(stream)) as chunks:
+            async for _ in chunks:
+                pass
+
+    asyncio.run(main())
+    assert 5850 < limiter.tokens.level <= 6000 - 100 + 1
+
+def test_cancelled_while_waiting_for_budget_refunds_the_reservation():
+    async def main():
+        limiter = EndpointLimiter("http://test", rpm=0, tpm=60, max_concurrency=2)
+        await limiter.acquire(60)
+        waiter = asyncio.ensure_future(limiter.acquire(30))
+        await _settle()
+        assert limiter.tokens.level < -29
+        waiter.cancel()
+        await _settle()
+        assert waiter.cancelled()
+        assert -1 < limiter.tokens.level < 1
+
+    asyncio.run(main())
+
+async def _open(stream):
+    return stream
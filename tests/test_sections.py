@@ -0,0 +1,39 @@
+from proxy.sections import split_sections, build_outline, join_sections
+
+DOCUMENT = """# Login
+
+Intro paragraph.
+
+## 1. Overview
+Text
+
+```
+## not a heading
+```
+
+### Details
+More
+
+## 2. API
+Endpoints
+"""
+
+def test_split_sections_ignores_headings_in_code_blocks():
+    preamble, sections = split_sections(DOCUMENT)
+    assert preamble == "# Login\n\nIntro paragraph."
+    assert [section.heading for section in sections] == ["## 1. Overview", "## 2. API"]
+    assert "## not a heading" in sections[0].body
+    assert sections[0].key == "Overview"
+
+def test_build_outline_lists_sections_and_subsections():
+    _, sections = split_sections(DOCUMENT)
+    assert build_outline(sections) == "## 1. Overview\n### Details\n## 2. API"
+
+def test_join_sections_keeps_the_intro_and_replaces_the_title():
+    preamble, sections = split_sections(DOCUMENT)
+    joined = join_sections("Sign in", [section.text for section in sections], preamble)
+    assert joined.startswith("# Sign in\n\nIntro paragraph.\n\n## 1. Overview\n")
+    assert joined.endswith("## 2. API\nEndpoints\n")
+
+def test_join_sections_without_preamble():
+    assert join_sections("Doc", ["## A\ntext\n", "  ", "## B\n"]) == "# Doc\n\n## A\ntext\n\n## B\n"
@@ -0,0 +1,33 @@
+from mcp_common.similar_cache import SimilarCache, make_scope
+
+def _cache(tmp_path, **options) -> SimilarCache:
+    settings = {"threshold": 0.6, "mode": "return", "max_entries": 100, "ttl": 0, "enabled": True, **options}
+    return SimilarCache(str(tmp_path / "similar.sqlite3"), **settings)
+
+def test_similar_request_in_the_same_scope_matches(tmp_path):
+    cache = _cache(tmp_path)
+    scope = make_scope(kind="document", template_type="server_api", language="en")
+    cache.add(scope, "user login module with password reset", {"content": "doc"}, "doc/login.md")
+    match = cache.lookup(scope, "login module for users with password reset")
+    assert match["value"] == {"content": "doc"}
+    assert match["path"] == "doc/login.md"
+    assert match["similarity"] >= 0.6
+    assert cache.lookup(scope, "billing and invoices export") is None
+    assert cache.lookup(make_scope(kind="document", template_type="server_api", language="zh"), "user login module with password reset") is None
+    cache.close()
+
+def test_entries_survive_a_restart_and_oldest_are_evicted(tmp_path):
+    scope = make_scope(kind="prompt")
+    cache = _cache(tmp_path, max_entries=2)
+    for i, request in enumerate(["alpha beta gamma", "delta epsilon zeta", "eta theta iota"]):
+        cache.add(scope, request, i)
+    cache.close()
+    reopened = _cache(tmp_path, max_entries=2)
+    assert reopened.lookup(scope, "alpha beta gamma") is None
+    assert reopened.lookup(scope, "eta theta iota")["value"] == 2
+    reopened.close()
+
+def test_disabled_cache_never_matches(tmp_path):
+    cache = _cache(tmp_path, enabled=False)
+    cache.add("scope", "same text", 1)
+    assert cache.lookup("scope", "same text") is None
@@ -0,0 +1,66 @@
+import asyncio
+
+from mcp_common.singleflight import SingleFlight, normalize_key
+
+def test_concurrent_calls_share_one_execution():
+    async def main():
+        flight = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "done"
+
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(3)))
+        assert calls == [1]
+        assert [result for result, _ in results] == ["done"] * 3
+        assert sorted(coalesced for _, coalesced in results) == [False, True, True]
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+
+def test_cancelling_one_waiter_keeps_the_shared_task():
+    async def main():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "done"
+
+        first = asyncio.ensure_future(flight.do("key", work))
+        second = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await second == ("done", True)
+
+    asyncio.run(main())
+
+def test_task_is_cancelled_when_every_waiter_leaves():
+    async def main():
+        flight = SingleFlight()
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def work():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiter = asyncio.ensure_future(flight.do("key", work))
+        await started.wait()
+        waiter.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+
+def test_normalize_key_ignores_surrounding_whitespace():
+    assert normalize_key(title=" Login ", language="en") == normalize_key(title="Login", language="en")
+    assert normalize_key(title="Login") != normalize_key(title="Logout")
@@ -0,0 +1,20 @@
+from mcp_common.tokens import estimate_tokens, truncate_tokens, TokenCounter
+
+def test_counter_matches_the_estimate_of_the_joined_text():
+    pieces = ["Hello", " world, ", "这是", "一个测试。"] * 100
+    counter = TokenCounter()
+    for piece in pieces:
+        total = counter.add(piece)
+    assert total == counter.total
+    # 分段估算与整体估算的差距不超过每次结算时的取整误差
+    assert abs(counter.total - estimate_tokens("".join(pieces))) <= len("".join(pieces)) // TokenCounter.FLUSH_CHARS + 1
+
+def test_counter_starts_at_zero():
+    assert TokenCounter().total == 0
+
+def test_truncate_tokens_keeps_the_beginning_within_the_limit():
+    text = "word " * 200
+    truncated = truncate_tokens(text, 10)
+    assert text.startswith(truncated)
+    assert estimate_tokens(truncated) <= 10
+    assert truncate_tokens(text, 0) == ""
@@ -0,0 +1,35 @@
+from types import SimpleNamespace
+
+from mcp_common.tool_docs import describe_tool, parse_docstring
+
+async def _tool(title: str, template_types: list[str] | str = "all", model: str = None, limit: int = 10, ctx=None) -> list:
+    """Generate documents
+
+    Longer explanation
+    over two lines.
+
+    Args:
+        title: Document title,
+            continued on the next line
+        template_types: Template types or "all"
+
+    Returns:
+        List: Results
+    """
+
+def test_description_comes_from_the_signature_and_docstring():
+    tool = describe_tool("generate", _tool)
+    assert tool["name"] == "generate"
+    assert tool["description"] == "Generate documents\n\nLonger explanation over two lines."
+    assert list(tool["parameters"]) == ["title", "template_types", "model", "limit"]
+    assert tool["parameters"]["title"] == {"type": "string", "description": "Document title, continued on the next line", "required": True}
+    assert tool["parameters"]["template_types"]["type"] == ["array", "string"]
+    assert tool["parameters"]["template_types"]["default"] == "all"
+    assert "default" not in tool["parameters"]["model"]
+    assert tool["parameters"]["limit"] == {"type": "integer", "description": "", "required": False, "default": 10}
+
+def test_registered_tool_objects_are_unwrapped():
+    assert describe_tool("generate", SimpleNamespace(fn=_tool))["parameters"]["title"]["required"] is True
+
+def test_docstring_without_sections():
+    assert parse_docstring("\n    List all tools\n    ") == ("List all tools", {})